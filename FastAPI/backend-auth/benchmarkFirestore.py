@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+import src.helpers.mdpFirestore as mdp
+import src.helpers.memFirestore as memFirestore
+
+OWNER_EMAIL = "benchmark@example.com"
+COUNTRY = "United States"
+PLATFORM = "Phone"
+VARIABLES_PER_GENERATOR = 20
+EXPERIMENTS_PER_GENERATOR = 10
+
+
+def seedDatabase(size: int, variableRatio: float, experimentRatio: float, assignedRatio: float, seed: int = 0):
+    """
+    Build an in-memory Firestore populated with customers, variables and experiments.
+
+    Parameters:
+    - size: Number of customers to seed.
+    - variableRatio: Variables seeded per customer.
+    - experimentRatio: Experiments seeded per customer.
+    - assignedRatio: Share of customers already assigned to an experiment.
+    - seed: Random seed so runs are comparable.
+
+    Returns:
+    - A tuple (db, expGenIDs) with the seeded client and the owner's experiment generator IDs.
+    """
+    rng = random.Random(seed)
+    db = memFirestore.Client()
+
+    db.seed("Users", {mdp.userDocID(OWNER_EMAIL): {"email": OWNER_EMAIL, "password": "benchmark"}})
+
+    numVariables = max(int(size * variableRatio), VARIABLES_PER_GENERATOR * 5)
+    numVarGens = numVariables // VARIABLES_PER_GENERATOR
+    varGens, variables = dict(), dict()
+    for varGenID in range(1, numVarGens + 1):
+        varGens[memFirestore.autoID()] = {
+            "phase": f"Phase {(varGenID - 1) % 5 + 1}",
+            "product": "Benchmark",
+            "ownerEmail": OWNER_EMAIL if varGenID <= 5 else f"owner{varGenID % 50}@example.com",
+            "platform": PLATFORM,
+            "variableGeneratorID": varGenID,
+            "versionID": 1
+        }
+        for varID in range(1, VARIABLES_PER_GENERATOR + 1):
+            variables[mdp.variableDocID(varGenID, varID)] = {
+                "variableID": varID,
+                "variableGeneratorID": varGenID,
+                "painPoint": f"Pain point {varID}",
+                "contentA": f"Hook {varGenID}-{varID}",
+                "contentB": f"Solution {varGenID}-{varID}",
+                "contentC": None,
+                "contentD": None,
+                "contentE": None
+            }
+    db.seed("variableGenerators", varGens)
+    db.seed("variables", variables)
+
+    numExperiments = max(int(size * experimentRatio), EXPERIMENTS_PER_GENERATOR)
+    numExpGens = max(numExperiments // EXPERIMENTS_PER_GENERATOR, 1)
+    expGens, experiments, expGenIDs = dict(), dict(), []
+    for expGenID in range(1, numExpGens + 1):
+        ownerEmail = OWNER_EMAIL if expGenID <= 5 else f"owner{expGenID % 50}@example.com"
+        varGenIDs = rng.sample(range(1, numVarGens + 1), 2)
+        expGen = {"experimentGeneratorID": expGenID, "ownerEmail": ownerEmail, "platform": PLATFORM}
+        expGen.update({f"variableGeneratorID_{i+1}": v for i, v in enumerate(varGenIDs)})
+        expGens[memFirestore.autoID()] = expGen
+        if ownerEmail == OWNER_EMAIL:
+            expGenIDs.append(expGenID)
+
+        combinations = rng.sample(range(VARIABLES_PER_GENERATOR ** 2), EXPERIMENTS_PER_GENERATOR)
+        for expID, combination in enumerate(combinations, start=1):
+            varIDs = [combination // VARIABLES_PER_GENERATOR + 1, combination % VARIABLES_PER_GENERATOR + 1]
+            experiment = {"ownerEmail": ownerEmail, "experimentGeneratorID": expGenID, "experimentID": expID, "platform": PLATFORM}
+            for i, v in enumerate(varGenIDs):
+                experiment[f"variableGeneratorID_{i+1}"] = v
+                experiment[f"variableID_{i+1}"] = varIDs[i]
+            experiments[mdp.experimentDocID(expGenID, varIDs, ownerEmail)] = experiment
+    db.seed("experimentGenerators", expGens)
+    db.seed("experiments", experiments)
+
+    customers = dict()
+    for i in range(size):
+        docID = mdp.customerDocID("phoneNumber", f"+1555{i:07d}")
+        customers[docID] = {
+            "name": f"Customer {i}",
+            "role": "Physician",
+            "company": f"Company {i % 1000}",
+            "email": f"customer{i}@example.com",
+            "linkedInUrl": f"https://linkedin.com/in/customer{i}" if i % 2 == 0 else None,
+            "phoneNumber": f"+1555{i:07d}",
+            "hasEmail": True,
+            "hasLinkedIn": i % 2 == 0,
+            "hasPhone": True,
+            "leadStage": None,
+            "leadSource": None,
+            "leadStatus": None,
+            "productOfInterest": None,
+            "country": COUNTRY,
+            "activePlatforms": {platform: False for platform in mdp.PLATFORMS},
+            "sampleKey": rng.random()
+        }
+        if rng.random() < assignedRatio:
+            customers[docID]["activePlatforms"][PLATFORM] = True
+            expGenID = rng.randint(1, numExpGens)
+            db.seed(f"customers/{docID}/experiments", {memFirestore.autoID(): {
+                "experimentID": rng.randint(1, EXPERIMENTS_PER_GENERATOR),
+                "experimentGeneratorID": expGenID,
+                "platform": PLATFORM,
+                "status": "Active"
+            }})
+    db.seed("customers", customers)
+
+    return db, expGenIDs
+
+
+def customerUpload(size: int, offset: int) -> list:
+    """
+    Build a Phone customer upload in the format the Upload page posts.
+
+    Parameters:
+    - size: Number of rows, half of which already exist in the database.
+    - offset: Number of customers already seeded.
+
+    Returns:
+    - A list of row dictionaries.
+    """
+    start = offset - size // 2
+    return [{
+        "Name": f"Customer {i}",
+        "Profession": "Physician",
+        "Phone Number": f"+1555{i:07d}",
+        "Email": f"customer{i}@example.com"
+    } for i in range(start, start + size)]
+
+
+def variableUpload(size: int) -> list:
+    """
+    Build a variable upload in the format the Content page posts.
+
+    Parameters:
+    - size: Number of rows, spread over three phases.
+
+    Returns:
+    - A list of row dictionaries.
+    """
+    return [{
+        "Phase": f"Phase {i % 3 + 1}",
+        "Pain Point": f"Benchmark pain point {i}",
+        "contentA": f"Benchmark hook {i}",
+        "contentB": f"Benchmark solution {i}"
+    } for i in range(size)]
+
+
+def timeOperation(db, name: str, func, verbose: bool = False) -> dict:
+    """
+    Run a single operation and record its wall time and Firestore usage.
+
+    Parameters:
+    - db: In-memory Firestore client.
+    - name: Name of the operation.
+    - func: Zero argument callable to run.
+    - verbose: Keep the operation's own print output.
+
+    Returns:
+    - A dictionary with the timing and counters.
+    """
+    db.resetStats()
+    error = None
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(None if verbose else devnull):
+            try:
+                func()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+    result = {"operation": name, "seconds": round(time.perf_counter() - start, 4)}
+    result.update(db.getStats())
+    result["error"] = error
+    return result
+
+
+def runBenchmark(size: int, args) -> list:
+    """
+    Seed a database of the given size and time every benchmarked operation on it.
+
+    Parameters:
+    - size: Number of customers to seed.
+    - args: Parsed command line arguments.
+
+    Returns:
+    - A list of result dictionaries.
+    """
+    start = time.perf_counter()
+    db, expGenIDs = seedDatabase(size, args.variable_ratio, args.experiment_ratio, args.assigned_ratio, args.seed)
+    print(f"Seeded {size} customers in {time.perf_counter() - start:.1f}s")
+
+    operations = [
+        ("customerImport", lambda: mdp.customerImport(db, customerUpload(args.upload, size), PLATFORM, None, COUNTRY)),
+        ("variableImport", lambda: mdp.variableImport(db, variableUpload(args.variables), PLATFORM, "Benchmark", OWNER_EMAIL)),
+        ("fullExperimentalSetup", lambda: mdp.fullExperimentalSetup(db, [1, 2, 3], args.trials, args.experiments, PLATFORM, COUNTRY, OWNER_EMAIL)),
+        ("getExperiments", lambda: mdp.getExperiments(db, OWNER_EMAIL, expGenIDs)),
+        ("extractAllOutboundContacts", lambda: mdp.extractAllOutboundContacts(db, expGenIDs))
+    ]
+
+    results = []
+    for name, func in operations:
+        if args.only and name not in args.only:
+            continue
+        result = timeOperation(db, name, func, args.verbose)
+        result["size"] = size
+        results.append(result)
+        print(formatRow(result))
+    return results
+
+
+def formatRow(result: dict) -> str:
+    row = f"{result['size']:>9} {result['operation']:<28} {result['seconds']:>10.3f} {result['reads']:>10} {result['writes']:>8} {result['roundTrips']:>10}"
+    if result["error"]:
+        row += f"  {result['error']}"
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mdpFirestore against an in-memory Firestore.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Customer counts to seed.")
+    parser.add_argument("--variable-ratio", type=float, default=0.1, help="Variables seeded per customer.")
+    parser.add_argument("--experiment-ratio", type=float, default=0.01, help="Experiments seeded per customer.")
+    parser.add_argument("--assigned-ratio", type=float, default=0.1, help="Share of customers already in an experiment.")
+    parser.add_argument("--upload", type=int, default=500, help="Rows in the customerImport upload.")
+    parser.add_argument("--variables", type=int, default=60, help="Rows in the variableImport upload.")
+    parser.add_argument("--trials", type=int, default=5, help="Customers per experiment in fullExperimentalSetup.")
+    parser.add_argument("--experiments", type=int, default=5, help="Experiments created by fullExperimentalSetup.")
+    parser.add_argument("--only", nargs="+", help="Only run the named operations.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data.")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--verbose", action="store_true", help="Show print output from mdpFirestore.")
+    args = parser.parse_args()
+
+    print(f"{'size':>9} {'operation':<28} {'seconds':>10} {'reads':>10} {'writes':>8} {'roundTrips':>10}")
+    results = []
+    for size in args.sizes:
+        results.extend(runBenchmark(size, args))
+
+    if args.output:
+        with open(args.output, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,40 @@
+from google.api_core import exceptions
 from google.cloud import firestore
 import streamlit as st
+import src.helpers.mdpFirestore as mdp
 
 # Checks if a username / password combination is correct
 def checkUser(db, email, password):
-    query = db.collection("Users")
-    userFilter = firestore.FieldFilter("email", "==", email)
-    docs = query.where(filter=userFilter).get()
-    data = [doc.to_dict() for doc in docs]
+    if mdp.userDocID(email) is None:
+        return False
+    doc = mdp.userRef(db, email).get()
+    if doc.exists:
+        return doc.to_dict()["password"] == password
+    # Users created before documents were keyed by email
+    data = [doc.to_dict() for doc in legacyUsers(db, email).get()]
     if len(data)>0:
         return password in [d["password"] for d in data]
     return False
 
-# Creates a new user
+# Creates a new user under their normalized email
 def createUser(db, email, password):
-    query = db.collection("Users")
-    userFilter = firestore.FieldFilter("email", "==", email)
-    docs = query.where(filter=userFilter).get()
-    data = [doc.to_dict() for doc in docs]
-    if len(data)>0:
+    if mdp.userDocID(email) is None:
+        return False
+    if len(legacyUsers(db, email).limit(1).get())>0 or len(legacyUsersLike(db, email))>0:
         return False
-    else:
-        db.collection("Users").add({"email":email, "password":password})
-        return True
+    try:
+        mdp.userRef(db, email).create({"email":email, "password":password})
+    except exceptions.AlreadyExists:
+        return False
+    return True
+
+# Users stored under random IDs, until migrateUserIDs has run
+def legacyUsers(db, email):
+    userFilter = firestore.FieldFilter("email", "==", email)
+    return db.collection("Users").where(filter=userFilter)
+
+# Legacy users whose email only differs in case or spaces, which migrateUserIDs would move to the same document
+def legacyUsersLike(db, email):
+    docID = mdp.userDocID(email)
+    users = db.collection("Users").select(["email"]).stream()
+    return [user for user in users if user.id != docID and mdp.userDocID(user.get("email")) == docID]
@@ -4,8 +4,87 @@ import random
 import math
 import pandas as pd
 import collections
+import hashlib
+import threading
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions
 from google.cloud import firestore
 
+# Maximum number of references sent in a single get_all call
+GET_ALL_CHUNK_SIZE = 300
+
+# Maximum number of writes Firestore accepts in a single batch commit
+BATCH_SIZE = 500
+
+# Outreach platforms tracked on each customer's activePlatforms map
+PLATFORMS = ["LinkedIn", "Email", "Phone"]
+
+# Customer field that identifies a customer on each platform
+PLATFORM_KEYS = {"LinkedIn": "linkedInUrl", "Email": "email", "Phone": "phoneNumber"}
+
+# Documents read per page by the replaceNaN cleanup, enough to keep every BulkWriter worker busy
+REPLACE_NAN_PAGE_SIZE = 4000
+
+# Batch commits a BulkWriter runs in parallel
+WRITE_WORKERS = 8
+
+# Attempts per batch commit before a BulkWriter gives up, and the first retry delay in seconds
+WRITE_MAX_ATTEMPTS = 5
+WRITE_RETRY_DELAY = 0.5
+
+# Errors caused by contention or load that are safe to retry
+RETRYABLE_WRITE_ERRORS = (exceptions.Aborted, exceptions.DeadlineExceeded, exceptions.ServiceUnavailable, exceptions.ResourceExhausted, exceptions.InternalServerError)
+
+# Maximum number of values Firestore accepts in a single "in" filter
+IN_QUERY_LIMIT = 30
+
+# IDs each worker leases per counter transaction; raise it to cut contention across many workers
+ID_BLOCK_SIZE = 1
+
+# ID ranges leased by this process, {(clientScope, counter): (nextID, lastID)}, each guarded by its own lock
+_idLeases = dict()
+_idLeaseLocks = collections.defaultdict(threading.Lock)
+_idLeaseLock = threading.Lock()
+
+# Seconds a cached read of a reference collection stays fresh, and the most entries kept
+READ_CACHE_TTL = 60
+READ_CACHE_SIZE = 1024
+
+# Reference collections kept live in memory by startMirrors, with the field holding each document's numeric ID
+MIRRORED_COLLECTIONS = {"variableGenerators": "variableGeneratorID", "experimentGenerators": "experimentGeneratorID"}
+
+# Seconds startMirrors waits for each collection's first snapshot
+MIRROR_WARMUP_TIMEOUT = 30
+
+# Minutes an Agenda task stays leased to a caller before it returns to the queue
+AGENDA_LEASE_MINUTES = 10
+
+# Agenda tasks leased per call by default
+AGENDA_LEASE_COUNT = 5
+
+# Customer fields copied onto each Agenda task, the ones the call screen shows and taskQuery matches on
+AGENDA_CUSTOMER_FIELDS = ["name", "company", "role", "phoneNumber", "email"]
+
+# leaseExpires of a task nobody holds, so free and expired tasks are found with one indexed range query
+AGENDA_LEASE_FREE = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Attempts per lease transaction; callers starting at once all contend for the head of the queue
+AGENDA_LEASE_ATTEMPTS = 10
+
+# Shards per experiment and variable results counter; each shard sustains about one write per second
+RESULT_SHARDS = 10
+
+# Event call statuses counted as a success for the experiment and its variables
+SUCCESS_STATUSES = {"CONVERT"}
+
+# Customers sampled per customer an experiment setup needs, so duplicate contacts can be dropped without falling short
+SAMPLE_OVERDRAW = 1.25
+
+# Random pivots sampleCustomers draws runs of sampleKeys from, one query each
+SAMPLE_PIVOTS = 10
+
 
 class VariableGenerator:
     pass
@@ -492,7 +571,7 @@ class Experiment:
 
 
 class ExperimentGenerator:
-    def __init__(self, experimentGeneratorID: int, ownerEmail: str, platform: str, variableGeneratorID_1: int = None, variableGeneratorID_2: int = None, variableGeneratorID_3: int = None, variableGeneratorID_4: int = None, variableGeneratorID_5: int = None):
+    def __init__(self, experimentGeneratorID: int, ownerEmail: str, platform: str, variableGeneratorID_1: int = None, variableGeneratorID_2: int = None, variableGeneratorID_3: int = None, variableGeneratorID_4: int = None, variableGeneratorID_5: int = None, canonicalKey: str | None = None):
         """
         Initialize an ExperimentGenerator instance to generate experiments with pre-configured variable generators.
 
@@ -501,6 +580,7 @@ class ExperimentGenerator:
         - ownerEmail: Email of the owner of the experiment generator.
         - platform: Platform associated with the experiment generator.
         - variableGeneratorID_1-5: IDs of the variable generators used in this experiment generator.
+        - canonicalKey: Key built from the ordered variable generator IDs (optional).
         """
         self.experimentGeneratorID = experimentGeneratorID
         self.variableGeneratorID_1 = variableGeneratorID_1
@@ -510,6 +590,7 @@ class ExperimentGenerator:
         self.variableGeneratorID_5 = variableGeneratorID_5
         self.ownerEmail = ownerEmail
         self.platform = platform
+        self.canonicalKey = canonicalKey
         self.experiments = list()
 
     def getExperiments(self) -> list:
@@ -734,6 +815,28 @@ class Customer:
             "hasPhone": self.hasPhone
         }
     
+    def getActivityInfo(self) -> dict:
+        """
+        Retrieve the per-platform activity flags of a customer that has not been assigned yet.
+
+        Returns:
+        - A dictionary containing the activePlatforms map.
+        """
+        return {
+            "activePlatforms": {platform: False for platform in PLATFORMS}
+        }
+
+    def getSampleInfo(self) -> dict:
+        """
+        Retrieve the random key sampleCustomers draws customers by.
+
+        Returns:
+        - A dictionary containing a sampleKey uniform in [0, 1).
+        """
+        return {
+            "sampleKey": random.random()
+        }
+
     def fullDescription(self) -> dict:
         """
         Provide a full description of the customer, including all attributes.
@@ -748,6 +851,8 @@ class Customer:
         }
         d.update(self.getContactInfo())
         d.update(self.getZohoInfo())
+        d.update(self.getActivityInfo())
+        d.update(self.getSampleInfo())
         return d
     
     def __repr__(self):
@@ -852,6 +957,462 @@ class CustomerGenerator:
         return [cust.fullDescription() for cust in self.getCustomers()]
 
 
+class ReadCache:
+    def __init__(self, maxEntries: int = READ_CACHE_SIZE, ttl: float = READ_CACHE_TTL):
+        """
+        Initialize a process-local read-through cache for small, rarely changing collections.
+        Entries expire after ttl seconds, the least recently used entry is evicted once maxEntries
+        is reached, and writes invalidate every entry of the collection they touch. Keys start with
+        the client scope and the collection name.
+
+        Parameters:
+        - maxEntries: Maximum number of cached reads (default: READ_CACHE_SIZE).
+        - ttl: Seconds before a cached read is reloaded (default: READ_CACHE_TTL).
+        """
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._generations = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def lookup(self, key: tuple):
+        """
+        Look up a cached read.
+
+        Parameters:
+        - key: Cache key, starting with the client scope and the collection name.
+
+        Returns:
+        - A tuple (found, value, generation); pass generation back to put() after loading a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, deepcopy(entry[1]), None
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None, self._generations[key[:2]]
+
+    def put(self, key: tuple, value, generation: int) -> None:
+        """
+        Store a loaded read, unless its collection was written since the lookup that missed.
+
+        Parameters:
+        - key: Cache key.
+        - value: Loaded value.
+        - generation: Generation returned by lookup().
+        """
+        with self._lock:
+            if self._generations[key[:2]] != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, scope: tuple, collection: str) -> None:
+        """
+        Drop every cached read of a collection.
+
+        Parameters:
+        - scope: Client scope, from clientScope().
+        - collection: Name of the collection that was written.
+        """
+        with self._lock:
+            self._generations[(scope, collection)] += 1
+            for key in [k for k in self._entries if k[:2] == (scope, collection)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._entries:
+                self._generations[key[:2]] += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Report the cache counters.
+
+        Returns:
+        - A dictionary with hits, misses, evictions, entries and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "hitRate": self.hits / lookups if lookups else None
+            }
+
+
+# Shared by the sync and async clients, so writes through either invalidate reads through both
+readCache = ReadCache()
+
+
+def clientScope(dbClient) -> tuple:
+    """
+    Identify the database a client talks to, so sync and async clients of one database share cache entries.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+
+    Returns:
+    - A (project, database) tuple.
+    """
+    return (dbClient.project, getattr(dbClient, "_database", None))
+
+
+def cachedRead(dbClient, key: tuple, load):
+    """
+    Serve a read from readCache, loading and caching it on a miss.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - key: Cache key starting with the collection name, e.g. ("variables", 3).
+    - load: Zero argument callable performing the read.
+
+    Returns:
+    - The cached or loaded value.
+    """
+    key = (clientScope(dbClient),) + key
+    found, value, generation = readCache.lookup(key)
+    if found:
+        return value
+    value = load()
+    readCache.put(key, value, generation)
+    return value
+
+
+def invalidateCache(dbClient, collection: str) -> None:
+    """
+    Drop every cached read of a collection after writing to it.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - collection: Name of the collection that was written.
+    """
+    readCache.invalidate(clientScope(dbClient), collection)
+
+
+class CollectionMirror:
+    def __init__(self, dbClient, collection: str, idField: str, ownerField: str = "ownerEmail"):
+        """
+        Initialize an in-memory copy of a collection, kept fresh by an on_snapshot listener and
+        indexed by its numeric ID field and by owner. Call start() to subscribe.
+
+        Parameters:
+        - dbClient: Firestore database client; listeners need the sync client.
+        - collection: Name of the collection to mirror.
+        - idField: Field holding each document's numeric ID, e.g. "variableGeneratorID".
+        - ownerField: Field holding the owner's email (default: "ownerEmail").
+        """
+        self.dbClient = dbClient
+        self.collection = collection
+        self.idField = idField
+        self.ownerField = ownerField
+        self.updates = 0
+        self._docs = dict()
+        self._byID = dict()
+        self._byOwner = collections.defaultdict(set)
+        self._watch = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, timeout: float = MIRROR_WARMUP_TIMEOUT) -> bool:
+        """
+        Subscribe to the collection and wait for the first snapshot, so the mirror is warm on return.
+
+        Parameters:
+        - timeout: Seconds to wait for the first snapshot (default: MIRROR_WARMUP_TIMEOUT).
+
+        Returns:
+        - True if the mirror is live.
+        """
+        if self._watch is None:
+            self._watch = self.dbClient.collection(self.collection).on_snapshot(self._onSnapshot)
+        self._ready.wait(timeout)
+        return self.isLive()
+
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+        self._ready.clear()
+
+    def isLive(self) -> bool:
+        return self._ready.is_set() and self._watch is not None and getattr(self._watch, "is_active", True)
+
+    def _onSnapshot(self, snapshots, changes, readTime) -> None:
+        with self._lock:
+            for change in changes:
+                docID = change.document.id
+                self._drop(docID)
+                if change.type.name != "REMOVED":
+                    self._add(docID, change.document.to_dict())
+            self.updates += 1
+        self._ready.set()
+
+    def apply(self, docID: str, data: dict) -> None:
+        """
+        Apply a write made by this process right away, so its reads see it before the listener
+        delivers it. The listener's later snapshot of the document replaces it.
+
+        Parameters:
+        - docID: ID of the written document.
+        - data: The document's data after the write.
+        """
+        with self._lock:
+            self._drop(docID)
+            self._add(docID, deepcopy(data))
+
+    def _add(self, docID: str, data: dict) -> None:
+        self._docs[docID] = data
+        if data.get(self.idField) is not None:
+            self._byID[data[self.idField]] = docID
+        self._byOwner[data.get(self.ownerField)].add(docID)
+
+    def _drop(self, docID: str) -> None:
+        data = self._docs.pop(docID, None)
+        if data is None:
+            return
+        if self._byID.get(data.get(self.idField)) == docID:
+            del self._byID[data[self.idField]]
+        self._byOwner[data.get(self.ownerField)].discard(docID)
+
+    def get(self, id) -> dict | None:
+        """
+        Look up a document by its numeric ID.
+
+        Parameters:
+        - id: Value of the ID field.
+
+        Returns:
+        - A copy of the document's data, or None if it is not in the collection.
+        """
+        with self._lock:
+            docID = self._byID.get(id)
+            return deepcopy(self._docs[docID]) if docID is not None else None
+
+    def query(self, owner: str, **filters) -> list:
+        """
+        List an owner's documents, in document ID order like a Firestore query.
+
+        Parameters:
+        - owner: Value of the owner field.
+        - filters: Equality filters on other fields; filters set to None are ignored.
+
+        Returns:
+        - A list of copies of the matching documents' data.
+        """
+        filters = {k: v for k, v in filters.items() if v is not None}
+        with self._lock:
+            docs = [self._docs[docID] for docID in sorted(self._byOwner.get(owner, ()))]
+            return [deepcopy(d) for d in docs if all(d.get(k) == v for k, v in filters.items())]
+
+
+# Live mirrors started by startMirrors, {(clientScope, collection): CollectionMirror}
+_mirrors = dict()
+_mirrorLock = threading.Lock()
+
+
+def startMirrors(dbClient, timeout: float = MIRROR_WARMUP_TIMEOUT) -> dict:
+    """
+    Mirror every collection in MIRRORED_COLLECTIONS and wait until each is warm.
+
+    Parameters:
+    - dbClient: Sync Firestore database client.
+    - timeout: Seconds to wait for each collection's first snapshot (default: MIRROR_WARMUP_TIMEOUT).
+
+    Returns:
+    - A dictionary mapping each collection to whether its mirror is live.
+    """
+    status = dict()
+    for collection, idField in MIRRORED_COLLECTIONS.items():
+        key = (clientScope(dbClient), collection)
+        with _mirrorLock:
+            mirror = _mirrors.get(key)
+            if mirror is None:
+                mirror = _mirrors[key] = CollectionMirror(dbClient, collection, idField)
+        status[collection] = mirror.start(timeout)
+    return status
+
+
+def stopMirrors() -> None:
+    with _mirrorLock:
+        mirrors = list(_mirrors.values())
+        _mirrors.clear()
+    for mirror in mirrors:
+        mirror.stop()
+
+
+def getMirror(dbClient, collection: str) -> CollectionMirror | None:
+    """
+    Find the live mirror of a collection for the database a client talks to.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - collection: Name of the collection.
+
+    Returns:
+    - The CollectionMirror, or None if the collection is not mirrored or its listener is down.
+    """
+    mirror = _mirrors.get((clientScope(dbClient), collection))
+    return mirror if mirror is not None and mirror.isLive() else None
+
+
+def mirrorWrite(dbClient, collection: str, docID: str, data: dict) -> None:
+    """
+    Apply a write to the mirror of its collection, if there is one, so the writer reads its own write.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - collection: Name of the written collection.
+    - docID: ID of the written document.
+    - data: The document's data after the write.
+    """
+    mirror = _mirrors.get((clientScope(dbClient), collection))
+    if mirror is not None:
+        mirror.apply(docID, data)
+
+
+class BulkWriter:
+    def __init__(self, dbClient, batchSize: int = BATCH_SIZE, maxWorkers: int = WRITE_WORKERS, maxAttempts: int = WRITE_MAX_ATTEMPTS, ignoreExisting: bool = False):
+        """
+        Initialize a BulkWriter that takes the place of a WriteBatch for large writes. Writes are split into
+        batches of batchSize that commit in parallel, with at most two batches per worker in flight, and
+        batches failing on contention are retried with exponential backoff. Batches are not atomic with
+        each other and may land in any order, so call flush() between writes that depend on each other.
+
+        Parameters:
+        - dbClient: Firestore database client.
+        - batchSize: Maximum number of writes per commit (default: BATCH_SIZE).
+        - maxWorkers: Number of commits running in parallel (default: WRITE_WORKERS).
+        - maxAttempts: Attempts per commit before giving up (default: WRITE_MAX_ATTEMPTS).
+        - ignoreExisting: Skip create() writes whose document already exists instead of failing.
+        """
+        self.dbClient = dbClient
+        self.batchSize = batchSize
+        self.maxAttempts = maxAttempts
+        self.ignoreExisting = ignoreExisting
+        self.written = 0
+        self.skipped = 0
+        self._pending = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._inFlight = threading.BoundedSemaphore(maxWorkers * 2)
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # Writes queued before an error are still committed, like separate batches would have been
+        if excType is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception as e:
+                # The original error propagates and carries this one, rather than being replaced by it
+                excValue.add_note(f"BulkWriter failed while handling this error: {e!r}")
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set(self, reference, document_data: dict, merge: bool = False) -> None:
+        self._add(("set", reference, document_data, {"merge": merge}))
+
+    def create(self, reference, document_data: dict) -> None:
+        self._add(("create", reference, document_data, {}))
+
+    def update(self, reference, field_updates: dict) -> None:
+        self._add(("update", reference, field_updates, {}))
+
+    def delete(self, reference) -> None:
+        self._add(("delete", reference, None, {}))
+
+    def _add(self, write: tuple) -> None:
+        self._pending.append(write)
+        if len(self._pending) >= self.batchSize:
+            self._submit()
+
+    def _submit(self) -> None:
+        if not self._pending:
+            return
+        writes, self._pending = self._pending, []
+        # Flow control: block the caller while too many commits are in flight
+        self._inFlight.acquire()
+        future = self._executor.submit(self._commit, writes)
+        future.add_done_callback(lambda _: self._inFlight.release())
+        self._futures.append(future)
+
+    def _commit(self, writes: list) -> None:
+        attempt = 1
+        while writes:
+            batch = self.dbClient.batch()
+            for op, reference, data, kwargs in writes:
+                if op == "delete":
+                    batch.delete(reference)
+                else:
+                    getattr(batch, op)(reference, data, **kwargs)
+            try:
+                batch.commit()
+                with self._lock:
+                    self.written += len(writes)
+                return
+            except exceptions.AlreadyExists:
+                if not self.ignoreExisting:
+                    raise
+                creates = [w[1] for w in writes if w[0] == "create"]
+                existing = getDocuments(self.dbClient, creates)
+                kept = [w for w in writes if w[0] != "create" or not existing[w[1].path].exists]
+                with self._lock:
+                    self.skipped += len(writes) - len(kept)
+                writes = kept
+            except RETRYABLE_WRITE_ERRORS:
+                if attempt >= self.maxAttempts:
+                    raise
+                time.sleep(WRITE_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                attempt += 1
+
+    def flush(self) -> None:
+        """
+        Commit all pending writes and wait for every commit in flight, raising the first error
+        of a commit that failed after all retries. Each error is raised once, so the writer can
+        keep being used after a failed flush.
+        """
+        self._submit()
+        futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            for error in errors[1:]:
+                errors[0].add_note(f"Another commit of the same flush failed too: {error!r}")
+            raise errors[0]
+
+    def commit(self) -> None:
+        """
+        Flush the writer, so it can be used wherever a WriteBatch is committed.
+        """
+        self.flush()
+
+    def close(self) -> None:
+        """
+        Flush the writer and release its worker threads.
+        """
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
 def customerImport(dbClient, rawData, platform: str, title: str | None = None, country: str | None = None) -> dict:
     """
     Import customer data into the Firestore database.
@@ -949,8 +1510,8 @@ def customerImport(dbClient, rawData, platform: str, title: str | None = None, c
         keys = ["phoneNumber"]
 
     # Upload customers into Firestore
-    uploadCustomers(dbClient, custGen, keys=keys)
-    countRecords(dbClient, "customers")
+    created = uploadCustomers(dbClient, custGen, keys=keys)
+    print(f"Created {created} new customers")
     
     return clean.to_dict()
 
@@ -966,190 +1527,505 @@ def countRecords(dbClient, collection: str):
     Returns:
     - The number of records in the collection.
     """
-    return len(dbClient.collection(collection).get())
+    return countDocuments(dbClient.collection(collection))
 
 
-def dictToDocument(x, batch, collectionRef):
+def countDocuments(query) -> int:
     """
-    Convert a dictionary to a Firestore document and add it to a batch.
+    Count the documents matching a query with a server-side count() aggregation,
+    without downloading them.
 
     Parameters:
-    - x: Dictionary to convert.
-    - batch: Firestore batch to add the document to.
-    - collectionRef: Firestore collection reference.
+    - query: Firestore collection or query to count.
+
+    Returns:
+    - The number of matching documents.
     """
-    doc_ref = collectionRef.document()
-    batch.set(doc_ref, x.to_dict())
+    return int(query.count().get()[0][0].value)
 
 
-def compareToDatabase(upload: pd.DataFrame, dbClient, collection: str, keys: list = []):
+def documentExists(query) -> bool:
     """
-    Compare a DataFrame to existing records in a Firestore collection and upload new records.
+    Check whether a query matches at least one document by reading at most one.
 
     Parameters:
-    - upload: DataFrame containing the records to upload.
-    - dbClient: Firestore database client.
-    - collection: Name of the Firestore collection.
-    - keys: List of keys to use for comparison.
+    - query: Firestore collection or query to probe.
 
     Returns:
-    - None
+    - True if a matching document exists, False otherwise.
     """
-    collectionRef = dbClient.collection(collection)
-    data = [doc.to_dict() for doc in collectionRef.get()]
-    if data:
-        database = pd.DataFrame(data=data)
-        
-        for key in keys:
-            existing_data = set(database[f"{key}"])
-            upload = upload[~upload[f"{key}"].isin(existing_data)]
-            
-    if not upload.empty:
-        batch = dbClient.batch()
-        upload.apply(dictToDocument, axis=1, args=[batch, collectionRef])
-        batch.commit()
+    return len(query.limit(1).get()) > 0
 
 
-def uploadCustomers(dbClient, custGen: CustomerGenerator, keys: list):
+def getDocuments(dbClient, references: list) -> dict:
     """
-    Upload customer data to Firestore after comparing with existing records.
+    Fetch many documents by reference with get_all instead of one round trip per document.
 
     Parameters:
     - dbClient: Firestore database client.
-    - custGen: CustomerGenerator instance containing the customers to upload.
-    - keys: List of keys to use for comparison.
+    - references: List of document references to fetch.
+
+    Returns:
+    - A dictionary mapping each document path to its snapshot.
     """
-    upload = pd.DataFrame(custGen.exportCustomers())
-    collection = "customers"
-    compareToDatabase(upload, dbClient, collection, keys)
+    snapshots = dict()
+    for i in range(0, len(references), GET_ALL_CHUNK_SIZE):
+        for snapshot in dbClient.get_all(references[i:i + GET_ALL_CHUNK_SIZE]):
+            snapshots[snapshot.reference.path] = snapshot
+    return snapshots
 
 
-def variableImport(dbClient, rawData, platform: str | None = None, product: str | None = None, ownerEmail: str | None = None):
+def lastIDInQuery(query, field: str) -> int:
     """
-    Import variable data into Firestore.
+    Find the highest ID in a query with a single ordered read.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - rawData: Raw data to import.
-    - platform: Platform associated with the variables (optional).
-    - product: Product associated with the variables (optional).
-    - ownerEmail: Email of the owner of the variables (optional).
+    - query: Firestore query to search.
+    - field: Name of the ID field.
 
     Returns:
-    - A dictionary representing the cleaned and processed data.
+    - The highest ID, or 0 if the query is empty.
     """
-    df = pd.DataFrame(rawData)
-    if 'Unnamed: 0' in df.keys().to_list():
-        df = df.drop('Unnamed: 0', axis=1)
-    
-    content_flags = {
-        "contentA": True,
-        "contentB": True,
-        "contentC": "contentC" in df.keys().to_list(),
-        "contentD": "contentD" in df.keys().to_list(),
-        "contentE": "contentE" in df.keys().to_list()
-    }
-    
-    for phase in df["Phase"].unique():
-        a = createVariableGenerator(dbClient, phase, product, ownerEmail, platform)
-        df[df["Phase"] == phase].apply(uploadVariables, axis=1, args=[dbClient, a["variableGeneratorID"]] + list(content_flags.values())) 
-
-    return df.to_dict()
+    docs = query.order_by(field, direction=firestore.Query.DESCENDING).limit(1).get()
+    return int(docs[0].get(field)) if docs else 0
 
 
-def lookupVariables(experiment, varTypes):
+def reserveIDs(dbClient, counter: str, count: int = 1, seed=None) -> int:
     """
-    Lookup variables by their type in an experiment.
+    Reserve a range of consecutive IDs from a counter document inside a transaction,
+    so concurrent workers never receive the same ID.
 
     Parameters:
-    - experiment: The experiment to search in.
-    - varTypes: List of variable types to search for.
+    - dbClient: Firestore database client.
+    - counter: ID of the counter document in the counters collection.
+    - count: Number of IDs to reserve.
+    - seed: Callable returning the last ID already in use, for counters that do not exist yet (optional).
 
     Returns:
-    - A dictionary mapping variable types to their values in the experiment.
+    - The first reserved ID.
     """
-    getIndex = lambda varType: experiment.where(experiment == varType).dropna().index.values[0].split(" ")[1]
-    getValue = lambda varType:  experiment[f"Variable {getIndex(varType)} Value"]
-    
-    varLookup = dict()
-    for i, v in enumerate(varTypes):
-        varLookup[v] = getValue(v)
-    return varLookup
+    counterRef = dbClient.collection("counters").document(counter)
 
+    @firestore.transactional
+    def reserve(transaction):
+        snapshot = counterRef.get(transaction=transaction)
+        if snapshot.exists:
+            lastID = snapshot.get("lastID")
+        else:
+            lastID = seed() if seed is not None else 0
+        transaction.set(counterRef, {"lastID": lastID + count})
+        return lastID + 1
 
-def createVariable(dbClient, generatorID: int, painPoint: str, contentA: str | None = None, contentB: str | None = None, contentC: str | None = None, contentD: str | None = None, contentE: str | None = None):
+    return reserve(dbClient.transaction())
+
+
+def allocateID(dbClient, counter: str, seed=None, blockSize: int | None = None) -> int:
     """
-    Create a new variable in Firestore.
+    Allocate the next ID of a counter, reserving a new block of IDs only when this process's lease runs out.
+    Only allocations from the same counter of the same database wait for each other's reservations.
 
     Parameters:
     - dbClient: Firestore database client.
-    - generatorID: ID of the generator creating the variable.
-    - painPoint: The pain point the variable addresses.
-    - contentA-E: Content associated with the variable.
+    - counter: ID of the counter document in the counters collection.
+    - seed: Callable returning the last ID already in use, for counters that do not exist yet (optional).
+    - blockSize: Number of IDs to lease per transaction (default: ID_BLOCK_SIZE).
 
     Returns:
-    - A dictionary representing the created variable, or None if not unique.
+    - The allocated ID.
     """
-    collection = "variables"
-    varGenFilter = firestore.FieldFilter("variableGeneratorID", "==", generatorID)
-    data = [d.to_dict() for d in dbClient.collection(collection).where(filter=varGenFilter).get()]
-    varID = 1
-    if data:
-        df = pd.DataFrame(data=data)
-        variableIsUnique = False
-        
-        if not df.empty:
-            if contentA != None and not variableIsUnique:
-                variableIsUnique = len(df[df["contentA"] == contentA]) == 0 
-                
-            if contentB != None and not variableIsUnique:
-                variableIsUnique = len(df[df["contentB"] == contentB]) == 0 
-            
-            if contentC != None and not variableIsUnique:
-                variableIsUnique = len(df[df["contentC"] == contentC]) == 0 
-            
-            if contentD != None and not variableIsUnique:
-                variableIsUnique = len(df[df["contentD"] == contentD]) == 0  
-            
-            if contentE != None and not variableIsUnique:
-                variableIsUnique = len(df[df["contentE"] == contentE]) == 0  
-            
-            if variableIsUnique:  
-                varID = max(df["variableID"]) + 1
-            else:     
-                return None
-                
-    upload = {
-        "variableID": varID,
-        "variableGeneratorID": generatorID,
-        "painPoint": painPoint,
-        "contentA": contentA,
-        "contentB": contentB,
-        "contentC": contentC,
-        "contentD": contentD,
-        "contentE": contentE
-    }
+    blockSize = blockSize or ID_BLOCK_SIZE
+    key = (clientScope(dbClient), counter)
+    with _idLeaseLock:
+        lock = _idLeaseLocks[key]
+    with lock:
+        nextID, lastID = _idLeases.get(key, (1, 0))
+        if nextID > lastID:
+            nextID = reserveIDs(dbClient, counter, blockSize, seed)
+            lastID = nextID + blockSize - 1
+        _idLeases[key] = (nextID + 1, lastID)
+        return nextID
+
+
+def customerDocID(key: str, value) -> str | None:
+    """
+    Build the deterministic document ID of a customer from its platform key, so the same
+    customer always maps to the same document.
 
-    dbClient.collection(collection).add(upload)
-    return upload
+    Parameters:
+    - key: Customer field identifying the customer, e.g. "phoneNumber".
+    - value: Value of that field.
+
+    Returns:
+    - The document ID, or None if the value is missing.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    normalized = str(value).strip().lower()
+    if not normalized or normalized == "nan":
+        return None
+    return hashlib.sha1(f"{key}:{normalized}".encode()).hexdigest()
 
 
-def uploadVariables(x, dbClient, generatorID, contentA: bool = False, contentB: bool = False, contentC: bool = False, contentD: bool = False, contentE: bool = False):
+def customerKeyField(customer: dict) -> str | None:
     """
-    Upload variables to Firestore based on input data.
+    Find the platform key a stored customer was imported with. uploadCustomers records it as
+    importKey; for older customers it is rebuilt from the only platform they are active on, and
+    otherwise only LinkedIn imports carry a LinkedIn URL and every Email import an email.
 
     Parameters:
-    - x: Data to upload.
-    - dbClient: Firestore database client.
-    - generatorID: ID of the generator creating the variables.
-    - contentA-E: Flags indicating which content fields to upload.
+    - customer: Customer dictionary.
+
+    Returns:
+    - The key field, or None if the customer has no key.
     """
-    uploadDict = {
-        "dbClient": dbClient,
-        "generatorID": generatorID,
-        "painPoint": x["Pain Point"]
-    }
-    if contentA:
+    if customer.get("importKey"):
+        return customer["importKey"]
+    active = [p for p, isActive in (customer.get("activePlatforms") or {}).items() if isActive]
+    if len(active) == 1 and customer.get(PLATFORM_KEYS.get(active[0])):
+        return PLATFORM_KEYS[active[0]]
+    for key in [PLATFORM_KEYS["LinkedIn"], PLATFORM_KEYS["Email"], PLATFORM_KEYS["Phone"]]:
+        if customer.get(key):
+            return key
+    return None
+
+
+def customersConflict(customer: dict, other: dict) -> bool:
+    """
+    Check whether two customers that map to the same document ID are different people, i.e.
+    both have a contact key set and the values differ.
+
+    Parameters:
+    - customer: Customer dictionary.
+    - other: Customer dictionary to compare with.
+
+    Returns:
+    - True if the customers cannot be merged, False otherwise.
+    """
+    for key in PLATFORM_KEYS.values():
+        left, right = customerDocID(key, customer.get(key)), customerDocID(key, other.get(key))
+        if left is not None and right is not None and left != right:
+            return True
+    return False
+
+
+def createIfAbsent(dbClient, documents: dict) -> int:
+    """
+    Create documents that do not exist yet, leaving existing ones untouched. Chunks are written
+    blindly with create(); only a chunk that hits an existing document reads its own references
+    to find out which ones to skip.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - documents: Dictionary mapping document references to their data.
+
+    Returns:
+    - The number of documents created.
+    """
+    with BulkWriter(dbClient, ignoreExisting=True) as writer:
+        for ref, data in documents.items():
+            writer.create(ref, data)
+    return writer.written
+
+
+def uploadCustomers(dbClient, custGen: CustomerGenerator, keys: list):
+    """
+    Upload customer data to Firestore. Customers are stored under an ID derived from their key,
+    so existing customers and duplicate rows are skipped without reading the collection. Customers
+    already stored under another ID with the same key, e.g. by an import through another platform,
+    are skipped too. The key is recorded on each document as importKey.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - custGen: CustomerGenerator instance containing the customers to upload.
+    - keys: List of keys to use for comparison; the first one determines the document ID.
+
+    Returns:
+    - The number of customers created.
+    """
+    collectionRef = dbClient.collection("customers")
+    key = keys[0]
+    documents = dict()
+    for customer in custGen.exportCustomers():
+        docID = customerDocID(key, customer.get(key))
+        ref = collectionRef.document(docID)
+        # Later rows with the same key collapse into the first one
+        if docID is None or ref not in documents:
+            documents[ref] = {**customer, "importKey": key}
+
+    stored = storedElsewhere(dbClient, documents, keys)
+    if stored:
+        print(f"Skipped {len(stored)} customers already stored under another ID")
+    return createIfAbsent(dbClient, {ref: customer for ref, customer in documents.items() if ref not in stored})
+
+
+def storedElsewhere(dbClient, documents: dict, keys: list) -> set:
+    """
+    Find the customers of an upload that already exist under a different document ID, matching
+    the upload's keys with "in" queries.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - documents: Dictionary mapping the document references of the upload to their customers.
+    - keys: List of keys to match on.
+
+    Returns:
+    - The set of references whose customer is already stored elsewhere.
+    """
+    stored = set()
+    for key in keys:
+        existing = resolveCustomers(dbClient, key, [customer.get(key) for customer in documents.values()])
+        for ref, customer in documents.items():
+            if any(match.id != ref.id for match in existing.get(customer.get(key), [])):
+                stored.add(ref)
+    return stored
+
+
+def migrateCustomerIDs(dbClient) -> str:
+    """
+    Move customers stored under random IDs to their deterministic IDs, together with their
+    experiments subcollection. Customers sharing a key are merged into one document, see
+    mergeCustomer, unless their other contact keys differ: those are left in place and reported.
+
+    Parameters:
+    - dbClient: Firestore database client.
+
+    Returns:
+    - A message indicating how many customers were moved, and which were left in place.
+    """
+    collectionRef = dbClient.collection("customers")
+    moves = []
+    for customer in collectionRef.stream():
+        data = customer.to_dict()
+        key = customerKeyField(data)
+        docID = customerDocID(key, data.get(key)) if key else None
+        if docID is not None and docID != customer.id:
+            moves.append((customer, collectionRef.document(docID), key))
+
+    numMoved = 0
+    conflicts = []
+    with BulkWriter(dbClient) as writer:
+        for i in range(0, len(moves), GET_ALL_CHUNK_SIZE):
+            chunk = moves[i:i + GET_ALL_CHUNK_SIZE]
+            targets = getDocuments(dbClient, [target for _, target, _ in chunk])
+            merged = dict()
+            moved = []
+            assignments = []
+            for customer, target, key in chunk:
+                if target.path not in merged:
+                    merged[target.path] = (target, targets[target.path].to_dict() if targets[target.path].exists else None)
+                data = {**customer.to_dict(), "importKey": key}
+                if merged[target.path][1] is not None and customersConflict(merged[target.path][1], data):
+                    conflicts.append(customer.id)
+                    continue
+                merged[target.path] = (target, mergeCustomer(merged[target.path][1], data))
+                moved.append(customer)
+                for assignment in customer.reference.collection("experiments").stream():
+                    writer.set(target.collection("experiments").document(assignment.id), assignment.to_dict())
+                    assignments.append(assignment.reference)
+            for target, data in merged.values():
+                if data is not None:
+                    writer.set(target, data)
+
+            # Old documents are only deleted once their copies landed, so an interrupted run can simply be repeated
+            writer.flush()
+            for ref in assignments:
+                writer.delete(ref)
+            for customer in moved:
+                writer.delete(customer.reference)
+                numMoved += 1
+            writer.flush()
+
+    if conflicts:
+        print(f"Customers left in place, their ID is taken by a different customer: {conflicts}")
+        return f"Done with {numMoved} customers. Left in place, their ID is taken by a different customer: {', '.join(conflicts)}."
+    return f"Done with {numMoved} customers."
+
+
+def mergeCustomer(customer: dict | None, duplicate: dict) -> dict:
+    """
+    Merge a duplicate customer into another: fields the customer lacks are taken from the
+    duplicate, and flags such as hasEmail or activePlatforms are set if either has them set.
+
+    Parameters:
+    - customer: Customer dictionary kept, None if there is none yet.
+    - duplicate: Customer dictionary merged into it.
+
+    Returns:
+    - The merged customer dictionary.
+    """
+    if customer is None:
+        return dict(duplicate)
+    merged = dict(customer)
+    for key, value in duplicate.items():
+        if merged.get(key) is None:
+            merged[key] = value
+        elif isinstance(merged[key], dict) and isinstance(value, dict):
+            merged[key] = mergeCustomer(merged[key], value)
+        elif isinstance(merged[key], bool) and isinstance(value, bool):
+            merged[key] = merged[key] or value
+    return merged
+
+
+def variableImport(dbClient, rawData, platform: str | None = None, product: str | None = None, ownerEmail: str | None = None):
+    """
+    Import variable data into Firestore.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - rawData: Raw data to import.
+    - platform: Platform associated with the variables (optional).
+    - product: Product associated with the variables (optional).
+    - ownerEmail: Email of the owner of the variables (optional).
+
+    Returns:
+    - A dictionary representing the cleaned and processed data.
+    """
+    df = pd.DataFrame(rawData)
+    if 'Unnamed: 0' in df.keys().to_list():
+        df = df.drop('Unnamed: 0', axis=1)
+    
+    content_flags = {
+        "contentA": True,
+        "contentB": True,
+        "contentC": "contentC" in df.keys().to_list(),
+        "contentD": "contentD" in df.keys().to_list(),
+        "contentE": "contentE" in df.keys().to_list()
+    }
+    
+    for phase in df["Phase"].unique():
+        a = createVariableGenerator(dbClient, phase, product, ownerEmail, platform)
+        uploadVariableBatch(dbClient, df[df["Phase"] == phase], a["variableGeneratorID"], **content_flags)
+
+    return df.to_dict()
+
+
+def lookupVariables(experiment, varTypes):
+    """
+    Lookup variables by their type in an experiment.
+
+    Parameters:
+    - experiment: The experiment to search in.
+    - varTypes: List of variable types to search for.
+
+    Returns:
+    - A dictionary mapping variable types to their values in the experiment.
+    """
+    getIndex = lambda varType: experiment.where(experiment == varType).dropna().index.values[0].split(" ")[1]
+    getValue = lambda varType:  experiment[f"Variable {getIndex(varType)} Value"]
+    
+    varLookup = dict()
+    for i, v in enumerate(varTypes):
+        varLookup[v] = getValue(v)
+    return varLookup
+
+
+CONTENT_KEYS = ["contentA", "contentB", "contentC", "contentD", "contentE"]
+
+
+def buildContentSets(variables: list) -> dict:
+    """
+    Build one hash set of existing content per content field, for uniqueness checks.
+
+    Parameters:
+    - variables: List of variable dictionaries of a single generator.
+
+    Returns:
+    - A dictionary mapping each content field to the set of its existing values.
+    """
+    contentSets = {key: set() for key in CONTENT_KEYS}
+    for variable in variables:
+        addToContentSets(contentSets, variable)
+    return contentSets
+
+
+def addToContentSets(contentSets: dict, variable: dict) -> None:
+    """
+    Add a variable's content to the uniqueness sets.
+
+    Parameters:
+    - contentSets: Sets built by buildContentSets.
+    - variable: Variable dictionary.
+    """
+    for key in CONTENT_KEYS:
+        value = variable.get(key)
+        # NaN never compares equal, so it can never make a later variable a duplicate
+        if value is not None and not pd.isna(value):
+            contentSets[key].add(value)
+
+
+def isVariableUnique(contentSets: dict, content: dict) -> bool:
+    """
+    Check whether a variable has at least one provided content field not already used in the generator.
+
+    Parameters:
+    - contentSets: Sets built by buildContentSets.
+    - content: Mapping of content field to value for the new variable.
+
+    Returns:
+    - True if the variable is unique, False otherwise.
+    """
+    for key in CONTENT_KEYS:
+        value = content.get(key)
+        if value is not None and value not in contentSets[key]:
+            return True
+    return False
+
+
+def createVariable(dbClient, generatorID: int, painPoint: str, contentA: str | None = None, contentB: str | None = None, contentC: str | None = None, contentD: str | None = None, contentE: str | None = None):
+    """
+    Create a new variable in Firestore.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - generatorID: ID of the generator creating the variable.
+    - painPoint: The pain point the variable addresses.
+    - contentA-E: Content associated with the variable.
+
+    Returns:
+    - A dictionary representing the created variable, or None if not unique.
+    """
+    collection = "variables"
+    data = lookupVariablesByVarGen(dbClient, generatorID, useCache=False)
+    if data:
+        content = {"contentA": contentA, "contentB": contentB, "contentC": contentC, "contentD": contentD, "contentE": contentE}
+        if not isVariableUnique(buildContentSets(data), content):  
+            return None
+
+    lastVarID = lambda: max([int(d["variableID"]) for d in data], default=0)
+    varID = allocateID(dbClient, f"variables-{generatorID}", seed=lastVarID)
+                
+    upload = {
+        "variableID": varID,
+        "variableGeneratorID": generatorID,
+        "painPoint": painPoint,
+        "contentA": contentA,
+        "contentB": contentB,
+        "contentC": contentC,
+        "contentD": contentD,
+        "contentE": contentE
+    }
+
+    variableRef(dbClient, generatorID, varID).set(upload)
+    invalidateCache(dbClient, collection)
+    return upload
+
+
+def uploadVariables(x, dbClient, generatorID, contentA: bool = False, contentB: bool = False, contentC: bool = False, contentD: bool = False, contentE: bool = False):
+    """
+    Upload variables to Firestore based on input data.
+
+    Parameters:
+    - x: Data to upload.
+    - dbClient: Firestore database client.
+    - generatorID: ID of the generator creating the variables.
+    - contentA-E: Flags indicating which content fields to upload.
+    """
+    uploadDict = {
+        "dbClient": dbClient,
+        "generatorID": generatorID,
+        "painPoint": x["Pain Point"]
+    }
+    if contentA:
         uploadDict.update({"contentA": x["contentA"]})
     if contentB:
         uploadDict.update({"contentB": x["contentB"]})
@@ -1162,20 +2038,90 @@ def uploadVariables(x, dbClient, generatorID, contentA: bool = False, contentB:
     upload = createVariable(**uploadDict)
 
 
-def lookupVariablesByVarGen(dbClient, variableGeneratorID):
+def uploadVariableBatch(dbClient, rows: pd.DataFrame, generatorID: int, contentA: bool = False, contentB: bool = False, contentC: bool = False, contentD: bool = False, contentE: bool = False) -> list:
+    """
+    Upload many variables of one generator with a single read and batched writes. Variable IDs are
+    allocated in memory and duplicates are skipped with the same rules as createVariable.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - rows: DataFrame of variables to upload.
+    - generatorID: ID of the generator creating the variables.
+    - contentA-E: Flags indicating which content fields to upload.
+
+    Returns:
+    - A list of dictionaries representing the created variables.
+    """
+    flags = {"contentA": contentA, "contentB": contentB, "contentC": contentC, "contentD": contentD, "contentE": contentE}
+
+    existing = lookupVariablesByVarGen(dbClient, generatorID, useCache=False)
+    contentSets = buildContentSets(existing)
+    hasVariables = len(existing) > 0
+
+    uploads = []
+    for x in rows.to_dict(orient="records"):
+        content = {key: x[key] if flag else None for key, flag in flags.items()}
+        if hasVariables and not isVariableUnique(contentSets, content):
+            continue
+
+        upload = {
+            "variableGeneratorID": generatorID,
+            "painPoint": x["Pain Point"]
+        }
+        upload.update(content)
+        uploads.append(upload)
+        addToContentSets(contentSets, upload)
+        hasVariables = True
+
+    if uploads:
+        lastVarID = lambda: max([int(d["variableID"]) for d in existing], default=0)
+        firstVarID = reserveIDs(dbClient, f"variables-{generatorID}", len(uploads), seed=lastVarID)
+        for i, upload in enumerate(uploads):
+            upload["variableID"] = firstVarID + i
+
+    try:
+        with BulkWriter(dbClient) as writer:
+            for upload in uploads:
+                writer.set(variableRef(dbClient, generatorID, upload["variableID"]), upload)
+    finally:
+        # Earlier batches may have landed even if a later one failed
+        if uploads:
+            invalidateCache(dbClient, "variables")
+
+    return uploads
+
+
+def lookupVariablesByVarGen(dbClient, variableGeneratorID, useCache: bool = True):
     """
     Lookup variables based on a variable generator ID.
 
     Parameters:
     - dbClient: Firestore database client.
     - variableGeneratorID: ID of the variable generator to search for.
+    - useCache: Serve the read from readCache (default: True); writers pass False to see the latest data.
 
     Returns:
     - A list of dictionaries representing the variables.
     """
+    load = lambda: [d.to_dict() for d in variablesByVarGenQuery(dbClient, variableGeneratorID).get()]
+    if not useCache:
+        return load()
+    return cachedRead(dbClient, ("variables", variableGeneratorID), load)
+
+
+def variablesByVarGenQuery(dbClient, variableGeneratorID):
+    """
+    Build the query for the variables of a variable generator.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - variableGeneratorID: ID of the variable generator.
+
+    Returns:
+    - A Firestore query.
+    """
     varGenFilter = firestore.FieldFilter("variableGeneratorID", '==', variableGeneratorID)
-    data = dbClient.collection("variables").where(filter=varGenFilter).get()
-    return [d.to_dict() for d in data]
+    return dbClient.collection("variables").where(filter=varGenFilter)
 
 
 def createVariableGenerator(dbClient, phase: str, product: str, ownerEmail: str, platform: str):
@@ -1193,22 +2139,14 @@ def createVariableGenerator(dbClient, phase: str, product: str, ownerEmail: str,
     - A dictionary representing the created variable generator.
     """
     collection = "variableGenerators"
-    data = [d.to_dict() for d in dbClient.collection(collection).get()]
-    
-    if data:
-        df = pd.DataFrame(data=data)
-        generatorID = max(df["variableGeneratorID"]) + 1
-        checkGen = df[(df["phase"] == f"{phase}") & \
-                      (df["product"] == f"{product}") & \
-                      (df["ownerEmail"] == f"{ownerEmail}") & \
-                      (df["platform"] == f"{platform}")]
-        if not checkGen.empty:
-            versionID = max(checkGen["versionID"]) + 1
-        else:
-            versionID = 1
-    else:
-        generatorID = 1
-        versionID = 1
+    collectionRef = dbClient.collection(collection)
+    generatorID = allocateID(dbClient, collection, seed=lambda: lastIDInQuery(collectionRef, "variableGeneratorID"))
+
+    versions = collectionRef
+    for field, value in [("phase", phase), ("product", product), ("ownerEmail", ownerEmail), ("platform", platform)]:
+        versions = versions.where(filter=firestore.FieldFilter(field, "==", f"{value}"))
+    versionKey = hashlib.sha1(f"{phase}|{product}|{ownerEmail}|{platform}".encode()).hexdigest()
+    versionID = allocateID(dbClient, f"variableGeneratorVersions-{versionKey}", seed=lambda: lastIDInQuery(versions, "versionID"))
 
     upload = {
         "phase": phase,
@@ -1219,596 +2157,1668 @@ def createVariableGenerator(dbClient, phase: str, product: str, ownerEmail: str,
         "versionID": versionID
     }
 
-    dbClient.collection(collection).add(upload)
+    _, ref = dbClient.collection(collection).add(upload)
+    invalidateCache(dbClient, collection)
+    mirrorWrite(dbClient, collection, ref.id, upload)
     return upload
 
 
-def createExpGen(dbClient, varGenIDs: list, platform: str, ownerEmail: str) -> dict:
+def createExpGen(dbClient, varGenIDs: list, platform: str, ownerEmail: str) -> dict:
+    """
+    Create a new experiment generator in Firestore.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - varGenIDs: List of variable generator IDs to associate with the experiment generator.
+    - platform: Platform associated with the experiment generator.
+    - ownerEmail: Email of the owner of the experiment generator.
+
+    Returns:
+    - A dictionary representing the created experiment generator.
+    """
+    expGenInfo = lookupExpGen(dbClient, varGenIDs)
+    if expGenInfo is not None:
+        print("Existing experiment generator found.")
+        return expGenInfo
+
+    if checkExpGenValid(dbClient, varGenIDs):
+        expGenRef = dbClient.collection("experimentGenerators")
+        expGenID = allocateID(dbClient, "experimentGenerators", seed=lambda: lastIDInQuery(expGenRef, "experimentGeneratorID"))
+        canonicalKey = expGenKey(varGenIDs)
+        expGenInfo = {
+            "experimentGeneratorID": int(expGenID),
+            "ownerEmail": ownerEmail,
+            "platform": platform,
+            "canonicalKey": canonicalKey
+        }
+        for i, varGenID in enumerate(varGenIDs):
+            expGenInfo[f"variableGeneratorID_{i+1}"] = varGenID
+
+        # Creating the lookup document fails if another request registered the same generator first
+        batch = dbClient.batch()
+        expGenDoc = expGenRef.document()
+        batch.create(dbClient.collection("experimentGeneratorKeys").document(canonicalKey), expGenInfo)
+        batch.set(expGenDoc, expGenInfo)
+        try:
+            batch.commit()
+        except exceptions.AlreadyExists:
+            return lookupExpGen(dbClient, varGenIDs)
+        finally:
+            invalidateCache(dbClient, "experimentGenerators")
+        mirrorWrite(dbClient, "experimentGenerators", expGenDoc.id, expGenInfo)
+        return expGenInfo
+
+
+def expGenKey(varGenIDs: list) -> str:
+    """
+    Build the canonical key of an experiment generator from its ordered variable generator IDs.
+
+    Parameters:
+    - varGenIDs: List of variable generator IDs, in slot order.
+
+    Returns:
+    - The canonical key, e.g. "3-7-12".
+    """
+    return "-".join(str(int(varGenID)) for varGenID in varGenIDs)
+
+
+def lookupExpGen(dbClient, varGenIDs: list) -> dict:
+    """
+    Find the experiment generator for an ordered list of variable generators with a point read
+    on its canonical key. Generators created before canonical keys are found with one indexed
+    query and get their lookup document written on the way.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - varGenIDs: List of variable generator IDs, in slot order.
+
+    Returns:
+    - A dictionary representing the experiment generator, or None if it does not exist.
+    """
+    canonicalKey = expGenKey(varGenIDs)
+    lookupRef = dbClient.collection("experimentGeneratorKeys").document(canonicalKey)
+    lookup = lookupRef.get()
+    if lookup.exists:
+        return lookup.to_dict()
+
+    query = dbClient.collection("experimentGenerators")
+    for i, varGenID in enumerate(varGenIDs):
+        query = query.where(filter=firestore.FieldFilter(f"variableGeneratorID_{i+1}", "==", varGenID))
+
+    for d in query.get():
+        expGenInfo = d.to_dict()
+        if expGenInfo.get(f"variableGeneratorID_{len(varGenIDs)+1}") is None:
+            expGenInfo["canonicalKey"] = canonicalKey
+            batch = dbClient.batch()
+            batch.set(lookupRef, expGenInfo)
+            batch.update(d.reference, {"canonicalKey": canonicalKey})
+            batch.commit()
+            invalidateCache(dbClient, "experimentGenerators")
+            mirrorWrite(dbClient, "experimentGenerators", d.id, expGenInfo)
+            return expGenInfo
+
+    return None
+
+
+def backfillExpGenKeys(dbClient) -> str:
+    """
+    Write canonical keys and lookup documents for experiment generators created before canonical keys.
+
+    Parameters:
+    - dbClient: Firestore database client.
+
+    Returns:
+    - A message indicating how many generators were updated.
+    """
+    numUpdates = 0
+    for d in dbClient.collection("experimentGenerators").stream():
+        expGenInfo = d.to_dict()
+        varGenIDs = [expGenInfo[f"variableGeneratorID_{i}"] for i in range(1, 6) if expGenInfo.get(f"variableGeneratorID_{i}") is not None]
+        canonicalKey = expGenKey(varGenIDs)
+        if expGenInfo.get("canonicalKey") == canonicalKey:
+            continue
+
+        expGenInfo["canonicalKey"] = canonicalKey
+        # Keep the first generator registered for a key, as the DataFrame lookup did
+        try:
+            dbClient.collection("experimentGeneratorKeys").document(canonicalKey).create(expGenInfo)
+        except exceptions.AlreadyExists:
+            pass
+        d.reference.update({"canonicalKey": canonicalKey})
+        mirrorWrite(dbClient, "experimentGenerators", d.id, expGenInfo)
+        numUpdates += 1
+
+    invalidateCache(dbClient, "experimentGenerators")
+    return f"Done with {numUpdates} experiment generators."
+
+
+def checkExpGenValid(dbClient, varGenIDs: list) -> bool:    
+    """
+    Check if an experiment generator is valid based on its variable generators.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - varGenIDs: List of variable generator IDs to validate.
+
+    Returns:
+    - True if the experiment generator is valid, False otherwise.
+    """
+    varGenIDs = list(dict.fromkeys(int(vGenID) for vGenID in varGenIDs))
+    if not varGenIDs:
+        return False
+
+    varGenFilter = firestore.FieldFilter("variableGeneratorID", "in", varGenIDs)
+    if countDocuments(dbClient.collection("variableGenerators").where(filter=varGenFilter)) < len(varGenIDs):
+        return False
+
+    for vGenID in varGenIDs:
+        varFilter = firestore.FieldFilter("variableGeneratorID", "==", vGenID)
+        if not documentExists(dbClient.collection("variables").where(filter=varFilter)):
+            return False
+
+    return True
+
+
+def getVariableIDs(dbClient, varGenIDs: list) -> dict:
+    """
+    Retrieve the variable IDs of several variable generators through readCache. Generators not
+    cached are loaded with "in" queries that return only the ID fields, so the cost does not grow
+    with the size of the variables collection. Variable writes invalidate them with the rest of
+    the variables collection.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - varGenIDs: List of variable generator IDs.
+
+    Returns:
+    - A dictionary mapping each variable generator ID to a sorted list of its variable IDs.
+    """
+    scope = clientScope(dbClient)
+    variableIDs, generations = dict(), dict()
+    for varGenID in dict.fromkeys(varGenIDs):
+        found, value, generation = readCache.lookup((scope, "variables", "variableIDs", varGenID))
+        if found:
+            variableIDs[varGenID] = value
+        else:
+            generations[varGenID] = generation
+
+    missing = list(generations)
+    loaded = {v: [] for v in missing}
+    for i in range(0, len(missing), IN_QUERY_LIMIT):
+        varGenFilter = firestore.FieldFilter("variableGeneratorID", "in", missing[i:i + IN_QUERY_LIMIT])
+        query = dbClient.collection("variables").where(filter=varGenFilter).select(["variableGeneratorID", "variableID"])
+        for variable in query.stream():
+            loaded[variable.get("variableGeneratorID")].append(variable.get("variableID"))
+
+    for varGenID, varIDs in loaded.items():
+        variableIDs[varGenID] = sorted(varIDs)
+        readCache.put((scope, "variables", "variableIDs", varGenID), variableIDs[varGenID], generations[varGenID])
+    return {v: variableIDs[v] for v in varGenIDs}
+
+
+def getVarBank(dbClient, expGen: ExperimentGenerator):
+    """
+    Retrieve the bank of variables associated with an experiment generator.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - expGen: ExperimentGenerator instance.
+
+    Returns:
+    - A dictionary containing the variable bank.
+    """
+    variableIDs = getVariableIDs(dbClient, expGen.getGenerators())
+    varBank = collections.defaultdict(list)
+    for i, varGenID in enumerate(expGen.getGenerators()):
+        varBank[f"variableGeneratorID_{i+1}"] = varGenID
+        varBank[f"variableID_{i+1}_Bank"] = np.array(variableIDs[varGenID])
+    return varBank
+
+
+def createExperiment(dbClient, expGen: ExperimentGenerator, varBank: dict, ownerEmail: str, platform: str) -> int:
+    """
+    Create a new experiment in Firestore, or find the existing experiment with the same variables.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - expGen: ExperimentGenerator instance.
+    - varBank: Bank of variables to use in the experiment.
+    - ownerEmail: Email of the experiment owner.
+    - platform: Platform associated with the experiment.
+
+    Returns:
+    - The ID of the experiment.
+    """
+    return planExperiments(dbClient, expGen, varBank, 1, ownerEmail, platform)[0]["experimentID"]
+
+
+def planExperiments(dbClient, expGen: ExperimentGenerator, varBank: dict, numExperiments: int, ownerEmail: str, platform: str, seed: int | None = None) -> list:
+    """
+    Pick distinct combinations of variables, one from each bank, and create the experiments that do
+    not exist yet. Combinations are sampled without replacement from the Cartesian product of the
+    banks, so asking for more experiments than there are combinations returns every combination once.
+    Existing experiments are found with one get_all on their combination keys, and the new ones are
+    written with one batched write.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - expGen: ExperimentGenerator instance.
+    - varBank: Bank of variables from getVarBank.
+    - numExperiments: Number of distinct experiments wanted.
+    - ownerEmail: Email of the experiment owner.
+    - platform: Platform associated with the experiments.
+    - seed: Seed for the combinations sampled (optional).
+
+    Returns:
+    - A list of experiment dictionaries, in the order they were sampled.
+    """
+    expGenID = int(expGen.getID())
+    numVariables = int(len(varBank.keys()) / 2)
+    varGenIDs = [int(varBank[f"variableGeneratorID_{i}"]) for i in range(1, numVariables + 1)]
+    banks = [[int(varID) for varID in varBank[f"variableID_{i}_Bank"]] for i in range(1, numVariables + 1)]
+
+    # Each index of the product is decoded digit by digit, so the product is never materialized
+    numCombinations = math.prod(len(bank) for bank in banks)
+    if numCombinations < numExperiments:
+        print(f"Only {numCombinations} distinct experiments exist for experiment generator {expGenID}.")
+    combinations = []
+    for index in random.Random(seed).sample(range(numCombinations), min(numExperiments, numCombinations)):
+        combination = []
+        for bank in reversed(banks):
+            index, digit = divmod(index, len(bank))
+            combination.append(bank[digit])
+        combinations.append(combination[::-1])
+
+    refs = [experimentRef(dbClient, expGenID, combination, ownerEmail) for combination in combinations]
+    existing = getDocuments(dbClient, refs)
+
+    plan, new = [], []
+    for ref, combination in zip(refs, combinations):
+        if existing[ref.path].exists:
+            plan.append(existing[ref.path].to_dict())
+            continue
+
+        expDict = {"ownerEmail": ownerEmail}
+        for i, (varGenID, varID) in enumerate(zip(varGenIDs, combination), start=1):
+            expDict[f"variableGeneratorID_{i}"] = varGenID
+            expDict[f"variableID_{i}"] = varID
+        expDict["experimentGeneratorID"] = expGenID
+        expDict["platform"] = platform
+        plan.append(expDict)
+        new.append((ref, expDict))
+
+    if new:
+        expGenFilter = firestore.FieldFilter("experimentGeneratorID", "==", expGenID)
+        generatorExperiments = dbClient.collection("experiments").where(filter=expGenFilter)
+        firstExpID = reserveIDs(dbClient, f"experiments-{expGenID}", len(new), seed=lambda: lastIDInQuery(generatorExperiments, "experimentID"))
+        with BulkWriter(dbClient, ignoreExisting=True) as writer:
+            for i, (ref, expDict) in enumerate(new):
+                expDict["experimentID"] = firstExpID + i
+                writer.create(ref, expDict)
+
+        # Another setup created some of the same experiments first; use theirs
+        if writer.skipped:
+            created = getDocuments(dbClient, [ref for ref, _ in new])
+            for ref, expDict in new:
+                expDict.update(created[ref.path].to_dict())
+
+    return plan
+
+
+def experimentDocID(expGenID: int, varIDs: list, ownerEmail: str | None = None) -> str:
+    """
+    Build the document ID of an experiment from its combination key: the generator, the variable
+    picked from each bank and the owner.
+
+    Parameters:
+    - expGenID: ID of the experiment generator.
+    - varIDs: List of variable IDs, in slot order.
+    - ownerEmail: Email of the experiment owner (optional).
+
+    Returns:
+    - The document ID, e.g. "4_12-3-7_owner@example.com".
+    """
+    docID = f"{int(expGenID)}_{'-'.join(str(int(varID)) for varID in varIDs)}"
+    return f"{docID}_{userDocID(ownerEmail)}" if userDocID(ownerEmail) else docID
+
+
+def experimentRef(dbClient, expGenID: int, varIDs: list, ownerEmail: str | None = None):
+    """
+    Build the reference to an experiment document.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - expGenID: ID of the experiment generator.
+    - varIDs: List of variable IDs, in slot order.
+    - ownerEmail: Email of the experiment owner (optional).
+
+    Returns:
+    - A document reference.
+    """
+    return dbClient.collection("experiments").document(experimentDocID(expGenID, varIDs, ownerEmail))
+
+
+def migrateExperimentIDs(dbClient) -> str:
+    """
+    Move experiments stored under random IDs to their combination keys. Experiments repeating a
+    combination that was already moved keep their random ID, since customers may be assigned to them.
+
+    Parameters:
+    - dbClient: Firestore database client.
+
+    Returns:
+    - A message indicating how many experiments were moved and kept.
+    """
+    moves = []
+    for experiment in dbClient.collection("experiments").stream():
+        data = experiment.to_dict()
+        varIDs = [varID for _, varID in experimentVariableKeys(data)]
+        target = experimentRef(dbClient, data["experimentGeneratorID"], varIDs, data.get("ownerEmail"))
+        if target.id != experiment.id:
+            moves.append((experiment, target))
+
+    numMoved, numKept = 0, 0
+    with BulkWriter(dbClient) as writer:
+        for i in range(0, len(moves), GET_ALL_CHUNK_SIZE):
+            chunk = moves[i:i + GET_ALL_CHUNK_SIZE]
+            targets = getDocuments(dbClient, [target for _, target in chunk])
+            created = set()
+            moved = []
+            for experiment, target in chunk:
+                if targets[target.path].exists or target.path in created:
+                    numKept += 1
+                    continue
+                writer.set(target, experiment.to_dict())
+                created.add(target.path)
+                moved.append(experiment.reference)
+
+            # Old documents are only deleted once their copies landed, so an interrupted run can simply be repeated
+            writer.flush()
+            for ref in moved:
+                writer.delete(ref)
+                numMoved += 1
+            writer.flush()
+
+    return f"Done with {numMoved} experiments, {numKept} duplicates kept."
+
+
+def getActiveAssignments(dbClient, expGenID: int, expID: int = 0) -> dict:
+    """
+    Retrieve the experiment assignments of an experiment or experiment generator with a single
+    collection group query over every customer's experiments subcollection.
+    Requires a collection group index on experiments.experimentGeneratorID (see firestore.indexes.json).
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - expGenID: ID of the experiment generator.
+    - expID: ID of the experiment (optional).
+
+    Returns:
+    - A dictionary mapping each customer reference to its first matching assignment snapshot, in customer order.
+    """
+    assignments = dict()
+    for assignment in assignmentsQuery(dbClient, expGenID, expID).stream():
+        customer_ref = assignmentCustomer(assignment)
+        if customer_ref is not None and customer_ref not in assignments:
+            assignments[customer_ref] = assignment
+
+    return assignments
+
+
+def assignmentsQuery(dbClient, expGenID: int, expID: int = 0):
+    """
+    Build the collection group query over every customer's experiment assignments.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - expGenID: ID of the experiment generator.
+    - expID: ID of the experiment (optional).
+
+    Returns:
+    - A Firestore query.
+    """
+    assignments_ref = dbClient.collection_group("experiments")
+    experimentGen_filter = firestore.FieldFilter("experimentGeneratorID", "==", int(expGenID))
+    assignments_ref = assignments_ref.where(filter=experimentGen_filter)
+
+    if expID != 0:
+        experiment_filter = firestore.FieldFilter("experimentID", "==", int(expID))
+        assignments_ref = assignments_ref.where(filter=experiment_filter)
+
+    return assignments_ref
+
+
+def assignmentCustomer(assignment):
+    """
+    Find the customer an assignment belongs to.
+
+    Parameters:
+    - assignment: Snapshot from assignmentsQuery.
+
+    Returns:
+    - The customer reference, or None for documents of the top-level experiments collection,
+      which shares the collection ID.
+    """
+    customer_ref = assignment.reference.parent.parent
+    if customer_ref is None or customer_ref.parent.id != "customers":
+        return None
+    return customer_ref
+
+
+def getActiveCustomers(dbClient, expGenID: int, expID: int = 0) -> dict:
+    """
+    Retrieve active customers associated with a specific experiment or experiment generator.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - expGenID: ID of the experiment generator.
+    - expID: ID of the experiment (optional).
+
+    Returns:
+    - A list of references to the active customers.
+    """
+    return list(getActiveAssignments(dbClient, expGenID, expID).keys())
+
+
+def getInactiveCustomers(customers, platform) -> list:
+    """
+    Retrieve inactive customers associated with a specific platform using the
+    denormalized activePlatforms flags, in a single query.
+
+    Parameters:
+    - customers: Firestore query over the customers collection.
+    - platform: Platform to filter by (all platforms if None).
+
+    Returns:
+    - A list of snapshots of the inactive customers.
+    """
+    return inactiveCustomersQuery(customers, platform).get()
+
+
+def inactiveCustomersQuery(customers, platform):
+    """
+    Narrow a customers query to the customers not active on a platform.
+
+    Parameters:
+    - customers: Firestore query over the customers collection.
+    - platform: Platform to filter by (all platforms if None).
+
+    Returns:
+    - A Firestore query.
+    """
+    platforms = [platform] if platform is not None else PLATFORMS
+
+    for p in platforms:
+        inactive_filter = firestore.FieldFilter(f"activePlatforms.{p}", "==", False)
+        customers = customers.where(filter=inactive_filter)
+
+    return customers
+
+
+def activityUpdate(platform: str) -> dict:
+    """
+    Build the customer field updates that mark a customer as active on a platform. The customer
+    also gets a new sampleKey, so the keys sampleCustomers draws by stay uniform as customers
+    leave and return to the inactive pool.
+
+    Parameters:
+    - platform: Platform the customer was assigned on.
+
+    Returns:
+    - A dictionary of field paths to update on the customer document.
+    """
+    return {
+        f"activePlatforms.{platform}": True,
+        f"lastAssignedAt.{platform}": firestore.SERVER_TIMESTAMP,
+        "sampleKey": random.random()
+    }
+
+
+def backfillCustomerActivity(dbClient) -> str:
+    """
+    Populate activePlatforms and lastAssignedAt on existing customers from their experiments subcollections.
+
+    Parameters:
+    - dbClient: Firestore database client.
+
+    Returns:
+    - A message indicating how many customers were updated.
+    """
+    activity = collections.defaultdict(dict)
+    for assignment in dbClient.collection_group("experiments").stream():
+        customer_ref = assignment.reference.parent.parent
+        if customer_ref is None or customer_ref.parent.id != "customers":
+            continue
+        expInfo = assignment.to_dict()
+        platform = expInfo.get("platform")
+        if platform is None:
+            continue
+        assignedAt = expInfo.get("assigned_At")
+        seen = activity[customer_ref.path]
+        if platform not in seen or (assignedAt is not None and (seen[platform] is None or assignedAt > seen[platform])):
+            seen[platform] = assignedAt
+
+    numUpdates = 0
+    with BulkWriter(dbClient) as writer:
+        for customer in dbClient.collection("customers").stream():
+            platforms = activity.get(customer.reference.path, {})
+            update = {"activePlatforms": {p: p in platforms for p in PLATFORMS}}
+            lastAssignedAt = {p: t for p, t in platforms.items() if t is not None}
+            if lastAssignedAt:
+                update["lastAssignedAt"] = lastAssignedAt
+            writer.set(customer.reference, update, merge=True)
+            numUpdates += 1
+
+    return f"Done with {numUpdates} customers."
+
+
+def resolveCustomers(dbClient, key: str, values: list) -> dict:
+    """
+    Resolve many customers by a key field with "in" queries of up to IN_QUERY_LIMIT values,
+    instead of one equality query per customer.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - key: Customer field to match on, e.g. "phoneNumber".
+    - values: Key values to resolve.
+
+    Returns:
+    - A dictionary mapping each found key value to the list of matching customer snapshots.
+    """
+    values = list(dict.fromkeys(v for v in values if v is not None))
+    customers = collections.defaultdict(list)
+
+    for i in range(0, len(values), IN_QUERY_LIMIT):
+        keyFilter = firestore.FieldFilter(key, "in", values[i:i + IN_QUERY_LIMIT])
+        for customer in dbClient.collection("customers").where(filter=keyFilter).stream():
+            customers[customer.get(key)].append(customer)
+
+    return dict(customers)
+
+
+def lookupCustomerBatch(dbClient, customers, unmatched: list | None = None):
+    """
+    Lookup a batch of customers in Firestore. Rows without a contact key or without a match are
+    reported rather than silently left out.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - customers: DataFrame containing the customers to lookup.
+    - unmatched: List the rows that were not found are appended to (optional).
+
+    Returns:
+    - A list of references to the found customers.
+    """
+    # Missing values come back from pandas as NaN; compare them as None like the stored documents
+    records = customers.astype(object).where(customers.notna(), None).to_dict(orient='records')
+
+    # Each row is resolved on the first contact key it has, then matched on email and phone as a single lookup would
+    lookupKeys = ["phoneNumber", "email", "linkedInUrl"]
+    rowKeys = [next((k for k in lookupKeys if r.get(k) is not None), None) for r in records]
+    candidates = {k: resolveCustomers(dbClient, k, [r.get(k) for r, rowKey in zip(records, rowKeys) if rowKey == k]) for k in set(rowKeys) - {None}}
+
+    cust_references = []
+    missing = []
+    for cust, key in zip(records, rowKeys):
+        matches = candidates.get(key, {}).get(cust.get(key), [])
+        match = next((c for c in matches if c.get("email") == cust.get("email") and c.get("phoneNumber") == cust.get("phoneNumber")), None)
+        if match is None:
+            missing.append(cust)
+        else:
+            cust_references.append(match.reference)
+
+    if missing:
+        print(f"{len(missing)} customers not found in the database: {[{k: c.get(k) for k in lookupKeys} for c in missing]}")
+        if unmatched is not None:
+            unmatched.extend(missing)
+    return cust_references
+
+
+def getCustomers(dbClient, custRole: str = None, platform: str = None, country: str = None, inactiveOnly: str = "False") -> pd.DataFrame:
+    """
+    Retrieve customers from Firestore based on filters.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - custRole: Role to filter by (optional).
+    - platform: Platform to filter by (optional).
+    - country: Country to filter by (optional).
+    - inactiveOnly: Flag to include only inactive customers (default: "False").
+
+    Returns:
+    - A DataFrame containing the filtered customers.
+    """
+    customers = customersQuery(dbClient, custRole, platform, country)
+
+    try:
+        if str(inactiveOnly).lower() == "true":
+            customer_data = getInactiveCustomers(customers, platform)
+        else:
+            customer_data = customers.get()
+
+    except Exception as e:
+        print(f"Error retrieving customer data: {e}")
+        return None
+
+    return exportCustomerData(customer_data)
+
+
+def customersQuery(dbClient, custRole: str = None, platform: str = None, country: str = None):
+    """
+    Build the customers query used by getCustomers.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - custRole: Role to filter by (optional).
+    - platform: Platform to filter by (optional).
+    - country: Country to filter by (optional).
+
+    Returns:
+    - A Firestore query.
+    """
+    customers = dbClient.collection("customers")
+    
+    if custRole is not None:
+        role_filter = firestore.FieldFilter("role", "==", custRole)
+        customers = customers.where(filter=role_filter)
+    
+    if country is not None:
+        country_filter = firestore.FieldFilter("country", "==", country)
+        customers = customers.where(filter=country_filter)        
+
+    if platform is not None:    
+        if platform == "LinkedIn":
+            platform_filter = firestore.FieldFilter("hasLinkedIn", "==", True)
+        elif platform == "Email":
+            platform_filter = firestore.FieldFilter("hasEmail", "==", True)
+        elif platform == "Phone":
+            platform_filter = firestore.FieldFilter("hasPhone", "==", True)
+        customers = customers.where(filter=platform_filter)
+
+    return customers
+
+
+def sampleCustomers(dbClient, size: int, platform: str = None, country: str = None, custRole: str = None, seed: int | None = None) -> dict | None:
+    """
+    Draw a sample of inactive customers with range queries on their random sampleKey, so only
+    the sampled customers are read however large the eligible pool is. The sample is made of
+    short runs of keys following up to SAMPLE_PIVOTS random pivots, topped up from the lowest keys
+    if the runs overlap or reach the end. Customers in one run are neighbours by sampleKey, so the
+    sample is not fully independent: neighbours tend to be drawn together. activityUpdate gives
+    every assigned customer a new sampleKey, which breaks these neighbourhoods up over time.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - size: Number of customers to draw.
+    - platform: Platform the customers must be reachable and inactive on (optional).
+    - country: Country to filter by (optional).
+    - custRole: Role to filter by (optional).
+    - seed: Seed for the pivots, for reproducible samples (optional).
+
+    Returns:
+    - A dictionary containing the sampled customers, or None if there are none; fewer than size
+      only when the pool is smaller.
+    """
+    customers = inactiveCustomersQuery(customersQuery(dbClient, custRole, platform, country), platform)
+    rng = random.Random(seed)
+    pivots = sorted(rng.random() for _ in range(min(max(size, 0), SAMPLE_PIVOTS)))
+    runLength = math.ceil(size / len(pivots)) if pivots else 0
+
+    sample = dict()
+    for pivot in pivots:
+        above = firestore.FieldFilter("sampleKey", ">=", pivot)
+        for customer in customers.where(filter=above).order_by("sampleKey").limit(runLength).get():
+            sample.setdefault(customer.id, customer)
+    if len(sample) < size:
+        # Enough to fill the sample even if every customer already drawn comes back
+        for customer in customers.order_by("sampleKey").limit(size).get():
+            if len(sample) >= size:
+                break
+            sample.setdefault(customer.id, customer)
+
+    return exportCustomerData(list(sample.values())[:size])
+
+
+def backfillCustomerSampleKeys(dbClient) -> str:
+    """
+    Give existing customers the sampleKey that sampleCustomers draws them by; customers without
+    one are never sampled.
+
+    Parameters:
+    - dbClient: Firestore database client.
+
+    Returns:
+    - A message indicating how many customers were updated.
+    """
+    numUpdates = 0
+    with BulkWriter(dbClient) as writer:
+        for customer in dbClient.collection("customers").select(["sampleKey"]).stream():
+            if customer.to_dict().get("sampleKey") is None:
+                writer.set(customer.reference, {"sampleKey": random.random()}, merge=True)
+                numUpdates += 1
+
+    return f"Done with {numUpdates} customers."
+
+
+def exportCustomerData(customer_data: list) -> dict | None:
+    """
+    Format customer snapshots as returned by getCustomers.
+
+    Parameters:
+    - customer_data: List of customer snapshots.
+
+    Returns:
+    - A dictionary containing the customers, or None if there are none.
+    """
+    numCust = len(customer_data)
+    print("Number of customers found in the database", numCust)
+    if numCust > 0:
+        customers_export = [d.to_dict() for d in customer_data]
+        return {"customers": customers_export}
+    else:
+        return None
+
+
+def replaceNaN_single(d):
+    """
+    Replace NaN and other placeholder values with None in a dictionary.
+
+    Parameters:
+    - d: Dictionary to process.
+
+    Returns:
+    - The processed dictionary with NaN and placeholder values replaced with None.
+    """
+    for key, value in d.items():
+        if value in ["N/A", "NaN", float('inf'), float('-inf')]:
+            d[key] = None
+        elif pd.isna(value):
+            d[key] = None
+    return d
+
+
+def replaceNaN_changes(d: dict) -> dict:
+    """
+    Find the fields replaceNaN_single would clear, without modifying the dictionary.
+
+    Parameters:
+    - d: Dictionary to check.
+
+    Returns:
+    - A dictionary mapping each field to clear to None, empty if nothing changes.
+    """
+    cleaned = replaceNaN_single(dict(d))
+    return {key: None for key, value in cleaned.items() if value is None and d[key] is not None}
+
+
+def replaceNaN_collection(dbClient, collection: str, startAfter: str | None = None, maxDocuments: int | None = None, pageSize: int = REPLACE_NAN_PAGE_SIZE) -> dict:
+    """
+    Replace NaN values in a Firestore collection, paging through it in document ID order and
+    writing only the documents that change. Each page is flushed before the cursor moves past it,
+    so a run stopped at any point can resume from the last reported cursor.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - collection: Name of the collection to process.
+    - startAfter: Document ID to resume after (optional).
+    - maxDocuments: Stop after scanning about this many documents (optional).
+    - pageSize: Documents read per page (default: REPLACE_NAN_PAGE_SIZE).
+
+    Returns:
+    - A dictionary with the number of documents scanned and updated, and the cursor to resume from,
+      which is None once the whole collection has been processed.
+    """
+    collectionRef = dbClient.collection(collection)
+    cursor = startAfter
+    scanned, updated = 0, 0
+    done = False
+
+    with BulkWriter(dbClient) as writer:
+        while not done and (maxDocuments is None or scanned < maxDocuments):
+            query = collectionRef.order_by("__name__").limit(pageSize)
+            if cursor is not None:
+                query = query.start_after({"__name__": cursor})
+
+            numDocs = 0
+            for docSnapshot in query.stream():
+                numDocs += 1
+                changes = replaceNaN_changes(docSnapshot.to_dict())
+                if changes:
+                    writer.set(docSnapshot.reference, changes, merge=True)
+                    updated += 1
+                cursor = docSnapshot.id
+
+            writer.flush()
+            scanned += numDocs
+            done = numDocs < pageSize
+            print(f"replaceNaN {collection}: scanned {scanned}, updated {updated}, cursor {cursor}")
+
+    return {
+        "collection": collection,
+        "scanned": scanned,
+        "updated": updated,
+        "cursor": None if done else cursor
+    }
+
+
+def replaceNaN_db(dbClient, collections: list) -> pd.DataFrame:
+    """
+    Replace NaN values in multiple Firestore collections.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - collections: List of collection names to process.
+
+    Returns:
+    - A message indicating completion.
+    """
+    for collection in collections:
+        replaceNaN_collection(dbClient, collection)
+
+    return f"Done with {len(collections)} collections."
+
+
+def allocateCohorts(numCustomers: int, trials: int, numCohorts: int, seed: int | None = None) -> list:
+    """
+    Split customers into disjoint cohorts by slicing one random permutation of their positions.
+
+    Parameters:
+    - numCustomers: Number of eligible customers.
+    - trials: Customers per cohort.
+    - numCohorts: Number of cohorts.
+    - seed: Seed for the permutation; the same seed and inputs always give the same cohorts (optional).
+
+    Returns:
+    - A list of numCohorts arrays of customer positions.
+    """
+    numCohorts = min(numCohorts, numCustomers // trials) if trials > 0 else 0
+    permutation = np.random.default_rng(seed).permutation(numCustomers)
+    return list(permutation[:numCohorts * trials].reshape(numCohorts, trials))
+
+
+def checkCustomers(customers: pd.DataFrame, requestedCustomers: int) -> bool:
+    """
+    Check if the number of provided customers meets the requested amount.
+
+    Parameters:
+    - customers: DataFrame containing the customers.
+    - requestedCustomers: Number of requested customers.
+
+    Returns:
+    - True if the provided customers meet or exceed the requested amount, False otherwise.
+    """
+    print(f"Customers provided: {len(customers.index)}. Customers Requested: {requestedCustomers}" )
+    return len(customers.index) >= requestedCustomers
+
+
+def assignExperiment(x, batch, dbClient, expID: int, expGenID: int, platform: str, custRefs: dict | None = None):
+    """
+    Assign an experiment to a customer in Firestore.
+
+    Parameters:
+    - x: Customer data to process.
+    - batch: Firestore batch to add the experiment assignment to.
+    - dbClient: Firestore database client.
+    - expID: ID of the experiment.
+    - expGenID: ID of the experiment generator.
+    - platform: Platform associated with the experiment.
+    - custRefs: Mapping of platform key to customer reference, as built by assignExperimentBatch (optional).
+    """
+    key = PLATFORM_KEYS.get(platform)
+    if key is None:
+        return
+
+    value = x.to_dict()[key]
+    if custRefs is not None:
+        custRef = custRefs.get(value)
+    else:
+        keyFilter = firestore.FieldFilter(key, "==", value)
+        cust = dbClient.collection("customers").where(filter=keyFilter).limit(1).get()
+        custRef = cust[0].reference if cust else None
+
+    if custRef:
+        _expID, _expGenID = int(expID), int(expGenID)
+        expRef = custRef.collection("experiments").document()
+
+        batch.set(expRef, {
+            "experimentID": _expID, 
+            "experimentGeneratorID": _expGenID, 
+            "platform": platform,
+            "status": "Active",
+            "assigned_At": firestore.SERVER_TIMESTAMP
+        })
+        batch.update(custRef, activityUpdate(platform))
+
+
+def assignExperimentBatch(dbClient, customers: pd.DataFrame, batch, expID: int, expGenID: int, platform: str) -> dict:
+    """
+    Assign an experiment to a cohort of customers, resolving all of them in bulk first.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - customers: DataFrame containing the cohort.
+    - batch: Firestore batch to add the experiment assignments to.
+    - expID: ID of the experiment.
+    - expGenID: ID of the experiment generator.
+    - platform: Platform associated with the experiment.
+
+    Returns:
+    - A dictionary mapping each resolved key value to its customer reference.
+    """
+    key = PLATFORM_KEYS[platform]
+    resolved = resolveCustomers(dbClient, key, customers[key].to_list())
+    custRefs = {value: matches[0].reference for value, matches in resolved.items()}
+    customers.apply(assignExperiment, axis=1, args=[batch, dbClient, expID, expGenID, platform, custRefs])
+    return custRefs
+
+
+def assignContentToCustomers(dbClient, customers, batch, expID: int, expGenID: int, ownerEmail: str = None, platform: str = None,
+                             expInfo: dict | None = None) -> dict:
+    """
+    Assign content to customers in an experiment. Assignments and tasks store the experiment's
+    IDs only; renderContent resolves the content when they are read. Tasks carry the customer's
+    ID and the contact fields in AGENDA_CUSTOMER_FIELDS rather than a copy of the customer.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - customers: DataFrame containing the customers to assign content to.
+    - batch: Firestore batch to add the assignments to.
+    - expID: ID of the experiment.
+    - expGenID: ID of the experiment generator.
+    - ownerEmail: Email of the experiment owner, who receives one Agenda task per customer (optional).
+    - platform: Platform associated with the experiment (optional).
+    - expInfo: The experiment, when the caller already has it, e.g. from planExperiments (optional).
+
+    Returns:
+    - A dictionary containing the assigned customers.
+    """
+    activeCustomers = lookupCustomerBatch(dbClient, customers)
+
+    if not activeCustomers:
+        return None
+    
+    if expInfo is None:
+        experiment_ref = dbClient.collection("experiments")
+        experiment_data = experiment_ref.where(
+            filter=firestore.FieldFilter("experimentID", "==", expID)
+        ).where(
+            filter=firestore.FieldFilter("experimentGeneratorID", "==", expGenID)
+        ).get()
+
+        if not experiment_data:
+            return None
+
+        expInfo = experiment_data[0].to_dict()
+    else:
+        expInfo = dict(expInfo)
+    numVariables = len(resultVariables(expInfo))
+    assignedPlatform = platform if platform is not None else expInfo.get("platform")
+
+    if ownerEmail:
+        owner = getOwner(dbClient, ownerEmail)
+        # One task walks the customer through every variable in order, see completeTask
+        task = {
+            "sequence_idx": "1",
+            "sequenceLength": numVariables,
+            "platform": platform,
+            "leaseExpires": AGENDA_LEASE_FREE
+        }
+        task.update(expInfo)
+        customers_info = getDocuments(dbClient, activeCustomers)
+
+    for active in activeCustomers:
+        expRef = active.collection("experiments").document()
+        batch.set(expRef, expInfo, merge=True)
+        if assignedPlatform is not None:
+            batch.update(active, activityUpdate(assignedPlatform))
+        
+        if ownerEmail:
+            customer_info = customers_info[active.path].to_dict()
+            contact = {field: customer_info.get(field) for field in AGENDA_CUSTOMER_FIELDS}
+            task_doc = owner.collection("Agenda").document()
+            # Task fields win over customer fields of the same name
+            batch.set(task_doc, {**contact, "customerID": active.id, **task})
+
+    recordResults(dbClient, batch, expInfo, trials=len(activeCustomers))
+    
+    return activeCustomers
+
+
+def getExperiments(dbClient, ownerEmail, experimentGeneratorID) -> dict:
+    """
+    Retrieve experiments associated with a specific owner and experiment generator.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - ownerEmail: Email of the experiment owner.
+    - experimentGeneratorID: ID(s) of the experiment generator(s).
+
+    Returns:
+    - A dictionary containing the experiments.
+    """
+    if type(experimentGeneratorID) is not list:
+        experimentGeneratorID = [experimentGeneratorID]
+
+    experiments = []
+
+    for expGenID in experimentGeneratorID: 
+        data = experimentsQuery(dbClient, ownerEmail, expGenID).get()
+        
+        if data:
+            for d in data:
+                if d:
+                    experiments.append((expGenID, d.to_dict()))
+
+    # Every variable of every experiment is read in one get_all
+    variables = fetchVariables(dbClient, [key for _, expInfo in experiments for key in experimentVariableKeys(expInfo)])
+    experiments = [experimentContent(expInfo, expGenID, [variables[key] for key in experimentVariableKeys(expInfo)])
+                   for expGenID, expInfo in experiments]
+
+    if experiments:
+        return experiments
+    else:
+        return None
+
+
+def experimentsQuery(dbClient, ownerEmail, expGenID):
+    """
+    Build the query for the experiments of an owner and experiment generator.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - ownerEmail: Email of the experiment owner.
+    - expGenID: ID of the experiment generator.
+
+    Returns:
+    - A Firestore query.
+    """
+    rawData = dbClient.collection("experiments")
+
+    if ownerEmail is not None:
+        ownerFilter = firestore.FieldFilter("ownerEmail", "==", ownerEmail)
+        rawData = rawData.where(filter=ownerFilter)
+    
+    if expGenID is not None:
+        expGenFilter = firestore.FieldFilter("experimentGeneratorID", "==", int(expGenID))
+        rawData = rawData.where(filter=expGenFilter)
+
+    return rawData
+
+
+def variableQuery(dbClient, varGenID: int, varID: int):
     """
-    Create a new experiment generator in Firestore.
+    Build the query for a single variable of a variable generator.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - varGenIDs: List of variable generator IDs to associate with the experiment generator.
-    - platform: Platform associated with the experiment generator.
-    - ownerEmail: Email of the owner of the experiment generator.
+    - dbClient: Firestore database client, sync or async.
+    - varGenID: ID of the variable generator.
+    - varID: ID of the variable.
 
     Returns:
-    - A dictionary representing the created experiment generator.
+    - A Firestore query.
     """
-    rawDataExpGen = dbClient.collection("experimentGenerators").get()
-    rawData = [d.to_dict() for d in rawDataExpGen]
-    
-    expGen = pd.DataFrame(rawData)
-    varGenDict = dict()
-    
-    if not expGen.empty:
-        expGenID = max(expGen["experimentGeneratorID"].values) + 1
-    else:
-        expGenID = 1
+    varGen_filter = firestore.FieldFilter("variableGeneratorID", "==", varGenID)
+    varID_filter = firestore.FieldFilter("variableID", "==", varID)
+    return dbClient.collection("variables").where(filter=varGen_filter).where(filter=varID_filter)
 
-    numVars = len(varGenIDs)
-    sameSizeExpGen = [d for d in rawData if len(d.keys()) - 3 == numVars]
-    expGen = pd.DataFrame(sameSizeExpGen)
 
-    for i, varGenID in enumerate(varGenIDs):
-        if not expGen.empty: 
-            expGen = expGen[expGen[f"variableGeneratorID_{i+1}"] == varGenID]
-        varGenDict[f"variableGeneratorID_{i+1}"] = varGenID
-    
-    if not expGen.empty:
-        print("Existing experiment generator found.")
-        expGenInfo = expGen.iloc[0].to_dict()
-        return expGenInfo
-    
-    else:
-        if checkExpGenValid(dbClient, varGenIDs):
-            expGenInfo = {
-                "experimentGeneratorID": int(expGenID),
-                "ownerEmail": ownerEmail,
-                "platform": platform
-            }
-            expGenInfo.update(varGenDict)
-            
-            dbClient.collection("experimentGenerators").add(expGenInfo)
-            return expGenInfo
+def lookupVariable(dbClient, varGenID: int, varID: int) -> dict | None:
+    """
+    Lookup a single variable, through readCache.
 
+    Parameters:
+    - dbClient: Firestore database client.
+    - varGenID: ID of the variable generator.
+    - varID: ID of the variable.
 
-def checkExpGenValid(dbClient, varGenIDs: list) -> bool:    
+    Returns:
+    - A dictionary representing the variable, or None if it does not exist.
     """
-    Check if an experiment generator is valid based on its variable generators.
+    return fetchVariables(dbClient, [(varGenID, varID)])[(int(varGenID), int(varID))]
+
+
+def fetchVariables(dbClient, keys: list, memo: dict | None = None) -> dict:
+    """
+    Fetch many variables by their composite document ID with a single get_all. Variables already
+    in the request memo or in readCache are not read again.
 
     Parameters:
     - dbClient: Firestore database client.
-    - varGenIDs: List of variable generator IDs to validate.
+    - keys: List of (variableGeneratorID, variableID) tuples.
+    - memo: Dictionary kept for the duration of a request, filled with every variable fetched (optional).
 
     Returns:
-    - True if the experiment generator is valid, False otherwise.
+    - A dictionary mapping each (variableGeneratorID, variableID) to the variable, or None if it does not exist.
     """
-    vGen = pd.DataFrame([d.to_dict() for d in dbClient.collection("variableGenerators").get()])
-    vGen = vGen[vGen["variableGeneratorID"].isin(varGenIDs)]
-    
-    check = len(vGen.index) == len(varGenIDs)
-
-    variables = pd.DataFrame([d.to_dict() for d in dbClient.collection("variables").get()])
-    
-    for vGenID in varGenIDs:
-        vCheck = variables[variables["variableGeneratorID"] == int(vGenID)]
-        check = not vCheck.empty
+    memo = memo if memo is not None else dict()
+    keys = list(dict.fromkeys((int(varGenID), int(varID)) for varGenID, varID in keys))
+    pending = cachedVariables(dbClient, [key for key in keys if key not in memo], memo)
+
+    if pending:
+        snapshots = getDocuments(dbClient, [variableRef(dbClient, *key) for key in pending])
+        for key in pending:
+            snapshot = snapshots[variableRef(dbClient, *key).path]
+            if snapshot.exists:
+                memo[key] = snapshot.to_dict()
+            else:
+                # Variables created before composite IDs, until migrateVariableIDs has run
+                var = variableQuery(dbClient, *key).get()
+                memo[key] = var[0].to_dict() if var else None
+        storeVariables(dbClient, pending, memo)
 
-    return check
+    return {key: memo[key] for key in keys}
 
 
-def getVarBank(dbClient, expGen: ExperimentGenerator):
+def variableDocID(varGenID: int, varID: int) -> str:
     """
-    Retrieve the bank of variables associated with an experiment generator.
+    Build the document ID of a variable from its generator and variable IDs.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - expGen: ExperimentGenerator instance.
+    - varGenID: ID of the variable generator.
+    - varID: ID of the variable.
 
     Returns:
-    - A dictionary containing the variable bank.
+    - The document ID, "{variableGeneratorID}_{variableID}".
     """
-    numVariables = len(expGen.getGenerators())
-    variables = pd.DataFrame([d.to_dict() for d in dbClient.collection("variables").get()])
-    varBank = collections.defaultdict(list)
-    for i, varGenID in enumerate(expGen.getGenerators()):
-        varBank[f"variableGeneratorID_{i+1}"] = varGenID
-        varBank[f"variableID_{i+1}_Bank"] = variables[variables["variableGeneratorID"] == varGenID]["variableID"].values
-    return varBank
+    return f"{int(varGenID)}_{int(varID)}"
 
 
-def createExperiment(dbClient, expGen: ExperimentGenerator, varBank: dict, ownerEmail: str, platform: str) -> int:
+def variableRef(dbClient, varGenID: int, varID: int):
     """
-    Create a new experiment in Firestore.
+    Build the reference to a variable document.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - expGen: ExperimentGenerator instance.
-    - varBank: Bank of variables to use in the experiment.
-    - ownerEmail: Email of the experiment owner.
-    - platform: Platform associated with the experiment.
+    - dbClient: Firestore database client, sync or async.
+    - varGenID: ID of the variable generator.
+    - varID: ID of the variable.
 
     Returns:
-    - The ID of the created experiment.
+    - A document reference.
     """
-    rawData = dbClient.collection("experiments")
+    return dbClient.collection("variables").document(variableDocID(varGenID, varID))
 
-    if ownerEmail is not None:
-        ownerFilter = firestore.FieldFilter("ownerEmail", "==", ownerEmail)
-        rawData = rawData.where(filter=ownerFilter)
-    
-    if expGen.getID() is not None:
-        expGenFilter = firestore.FieldFilter("experimentGeneratorID", "==", int(expGen.getID()))
-        rawData = rawData.where(filter=expGenFilter)
 
-    data = [d.to_dict() for d in rawData.get()]
-    numVariables = int((len(varBank.keys())) / 2)
+def cachedVariables(dbClient, keys: list, memo: dict) -> dict:
+    """
+    Copy the variables found in readCache into the request memo.
 
-    experiments = pd.DataFrame([d for d in data if (len(d.keys()) - 4) / 2 == numVariables])
-    
-    expID = 1
-    
-    if not experiments.empty:
-        expID = max(experiments["experimentID"].values) + 1
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - keys: List of (variableGeneratorID, variableID) tuples not in the memo.
+    - memo: Request memo to fill.
 
-    expDict = dict()
-    expDict["ownerEmail"] = ownerEmail
-    
-    for i in range(1, numVariables + 1):
-        varGenID = int(varBank[f"variableGeneratorID_{i}"])
-        varID = int(random.choice(varBank[f"variableID_{i}_Bank"]))        
-        
-        expDict[f"variableGeneratorID_{i}"] = varGenID
-        expDict[f"variableID_{i}"] = varID
-        
-        if not experiments.empty: 
-            experiments = experiments[experiments[f"variableGeneratorID_{i}"] == varGenID]
+    Returns:
+    - A dictionary mapping each key still to be read to its readCache generation.
+    """
+    scope = clientScope(dbClient)
+    pending = dict()
+    for key in keys:
+        found, value, generation = readCache.lookup((scope, "variables") + key)
+        if found:
+            memo[key] = value
+        else:
+            pending[key] = generation
+    return pending
 
-        if not experiments.empty: 
-            experiments = experiments[experiments[f"variableID_{i}"] == varID]        
-    
-    if not experiments.empty:
-        expID = int(experiments["experimentID"].values[0])
-    
-    else:
-        expDict["experimentGeneratorID"] = int(expGen.getID())
-        expDict["experimentID"] = int(expID)
-        expDict["platform"] = platform
-        dbClient.collection("experiments").add(expDict)
 
-    return expID
+def storeVariables(dbClient, pending: dict, memo: dict) -> None:
+    scope = clientScope(dbClient)
+    for key, generation in pending.items():
+        readCache.put((scope, "variables") + key, memo[key], generation)
 
 
-def getActiveCustomers(dbClient, expGenID: int, expID: int = 0) -> dict:
+def migrateVariableIDs(dbClient) -> str:
     """
-    Retrieve active customers associated with a specific experiment or experiment generator.
+    Move variables stored under random IDs to their composite IDs. Variables sharing a generator
+    and variable ID are merged when their fields agree; variables whose fields differ are left in
+    place and reported.
 
     Parameters:
     - dbClient: Firestore database client.
-    - expGenID: ID of the experiment generator.
-    - expID: ID of the experiment (optional).
 
     Returns:
-    - A list of references to the active customers.
+    - A message indicating how many variables were moved.
     """
-    customers_ref = dbClient.collection("customers")
-    if expID != 0:
-        experiment_filter = firestore.FieldFilter("experimentID", "==", int(expID))
-    experimentGen_filter = firestore.FieldFilter("experimentGeneratorID", "==", int(expGenID))
+    moves = []
+    for variable in dbClient.collection("variables").stream():
+        data = variable.to_dict()
+        if data.get("variableGeneratorID") is None or data.get("variableID") is None:
+            continue
+        target = variableRef(dbClient, data["variableGeneratorID"], data["variableID"])
+        if target.id != variable.id:
+            moves.append((variable, target))
+
+    numMoved = 0
+    conflicts = []
+    with BulkWriter(dbClient) as writer:
+        for i in range(0, len(moves), GET_ALL_CHUNK_SIZE):
+            chunk = moves[i:i + GET_ALL_CHUNK_SIZE]
+            targets = getDocuments(dbClient, [target for _, target in chunk])
+            merged = dict()
+            moved = []
+            for variable, target in chunk:
+                if target.path not in merged:
+                    merged[target.path] = (target, targets[target.path].to_dict() if targets[target.path].exists else dict())
+                data = merged[target.path][1]
+                duplicate = variable.to_dict()
+                if any(data.get(key) is not None and value is not None and data[key] != value for key, value in duplicate.items()):
+                    conflicts.append(variable.id)
+                    continue
+                data.update({key: value for key, value in duplicate.items() if data.get(key) is None})
+                moved.append(variable)
+            for target, data in merged.values():
+                if data:
+                    writer.set(target, data)
+
+            # Old documents are only deleted once their copies landed, so an interrupted run can simply be repeated
+            writer.flush()
+            for variable in moved:
+                writer.delete(variable.reference)
+                numMoved += 1
+            writer.flush()
+
+    invalidateCache(dbClient, "variables")
+    if conflicts:
+        print(f"Variables left in place, their ID is taken by a different variable: {conflicts}")
+        return f"Done with {numMoved} variables. Left in place, their ID is taken by a different variable: {', '.join(conflicts)}."
+    return f"Done with {numMoved} variables."
+
+
+def experimentVariables(expInfo: dict) -> list:
+    """
+    List the variables an experiment uses.
 
-    customers = customers_ref.stream()    
-    customers_with_experiments = []
-    
-    for customer in customers:
-        customer_ref = customer.reference
-        experiments_ref = customer_ref.collection("experiments")
-        
-        if expID != 0:
-            experiments = experiments_ref.where(filter=experiment_filter).where(filter=experimentGen_filter).get()
-        else: 
-            experiments = experiments_ref.where(filter=experimentGen_filter).get()
+    Parameters:
+    - expInfo: Experiment dictionary.
+
+    Returns:
+    - A list of (variableGeneratorID, variableID) tuples in variable order.
+    """
+    return resultVariables(expInfo)
+
+
+def experimentVariableKeys(expInfo: dict) -> list:
+    """
+    List the variables an experiment uses as fetchVariables keys.
 
-        if len(experiments) != 0:
-            customers_with_experiments.append(deepcopy(customer_ref))   
+    Parameters:
+    - expInfo: Experiment dictionary.
 
-    return customers_with_experiments
+    Returns:
+    - A list of (variableGeneratorID, variableID) integer tuples in variable order.
+    """
+    return [(int(varGenID), int(varID)) for varGenID, varID in experimentVariables(expInfo)]
 
 
-def getInactiveCustomers(customers, platform) -> dict:
+def experimentContent(expInfo: dict, expGenID, variables: list) -> dict:
     """
-    Retrieve inactive customers associated with a specific platform.
+    Combine an experiment with the content of its variables, as returned by getExperiments.
 
     Parameters:
-    - customers: Firestore collection of customers.
-    - platform: Platform to filter by.
+    - expInfo: Experiment dictionary.
+    - expGenID: ID of the experiment generator.
+    - variables: Variable dictionaries in the order of experimentVariables, None for missing ones.
 
     Returns:
-    - A list of references to the inactive customers.
+    - A dictionary with the experiment IDs and the content of each variable.
     """
-    customers_without_experiments = []
-    platform_filter = firestore.FieldFilter("platform", "==", platform)
-    
-    for customer in customers.stream():
-        customer_ref = customer.reference
-        experiments_ref = customer_ref.collection("experiments")
-        
-        experiments = experiments_ref.where(filter=platform_filter).get()
-        print(experiments)
+    varContent = {"experimentGeneratorID": int(expGenID),
+                  "experimentID": expInfo["experimentID"]}
 
-        if len(experiments) == 0:
-            customers_without_experiments.append(deepcopy(customer_ref))
+    for i, ((varGenID, varID), content) in enumerate(zip(experimentVariables(expInfo), variables), start=1):
+        if content is not None:
+            for suffix in ["A", "B", "C", "D", "E"]:
+                content_key = f"content{suffix}"
+                if content.get(content_key) is not None:
+                    varContent[f"content_{i}_{suffix}"] = content[content_key]
+            
+            varContent[f"variableGeneratorID_{i}"] = varGenID
+            varContent[f"variableID_{i}"] = varID
 
-    return customers_without_experiments
+    return varContent
 
 
-def lookupCustomerBatch(dbClient, customers):
+def renderContent(keys: list, variables: dict, start: int = 1) -> dict:
     """
-    Lookup a batch of customers in Firestore.
+    Render the content of variables into the content_{i}_{X} fields read by the outbound exports and the Phone page.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - customers: DataFrame containing the customers to lookup.
+    - keys: List of (variableGeneratorID, variableID) tuples in variable order.
+    - variables: Variables by key, as returned by fetchVariables.
+    - start: Position i of the first key (default: 1).
 
     Returns:
-    - A list of references to the found customers.
+    - A dictionary with the content fields of every variable found.
     """
-    cust_references = []
+    content_fields = {}
+    for i, key in enumerate(keys, start=start):
+        content = variables.get(key)
+        if content:
+            for suffix in ["A", "B", "C", "D", "E"]:
+                content_key = f"content{suffix}"
+                if content.get(content_key):
+                    content_fields[f"content_{i}_{suffix}"] = content[content_key]
+    return content_fields
 
-    for cust in customers.to_dict(orient='records'):
-        emailFilter = firestore.FieldFilter("email", "==", cust["email"])
-        phoneFilter = firestore.FieldFilter("phoneNumber", "==", cust["phoneNumber"])
-        customer_ref = dbClient.collection("customers").where(
-            filter=emailFilter).where(filter=phoneFilter).get()[0].reference
-        cust_references.append(deepcopy(customer_ref))
 
-    return cust_references
+def taskVariableKey(task: dict) -> tuple | None:
+    """
+    Find the variable of the step a task is at.
 
+    Parameters:
+    - task: Task data.
 
-def getCustomers(dbClient, custRole: str = None, platform: str = None, country: str = None, inactiveOnly: str = "False") -> pd.DataFrame:
+    Returns:
+    - A (variableGeneratorID, variableID) tuple, or None for tasks written before sequences, which store their content.
     """
-    Retrieve customers from Firestore based on filters.
+    if task.get("sequenceLength") is None:
+        return None
+    step = int(task["sequence_idx"])
+    return (int(task[f"variableGeneratorID_{step}"]), int(task[f"variableID_{step}"]))
+
+
+def renderTasks(tasks: list, variables: dict) -> list:
+    """
+    Add the content of their current step to tasks.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - custRole: Role to filter by (optional).
-    - platform: Platform to filter by (optional).
-    - country: Country to filter by (optional).
-    - inactiveOnly: Flag to include only inactive customers (default: "False").
+    - tasks: List of task dictionaries.
+    - variables: Variables by key, as returned by fetchVariables for taskVariableKey of each task.
 
     Returns:
-    - A DataFrame containing the filtered customers.
+    - The tasks, updated in place.
     """
-    customers = dbClient.collection("customers")
-    
-    if custRole is not None:
-        role_filter = firestore.FieldFilter("role", "==", custRole)
-        customers = customers.where(filter=role_filter)
-    
-    if country is not None:
-        country_filter = firestore.FieldFilter("country", "==", country)
-        customers = customers.where(filter=country_filter)        
+    for task in tasks:
+        key = taskVariableKey(task)
+        if key is not None:
+            task.update(renderContent([key], variables, start=int(task["sequence_idx"])))
+    return tasks
 
-    if platform is not None:    
-        if platform == "LinkedIn":
-            platform_filter = firestore.FieldFilter("hasLinkedIn", "==", True)
-        elif platform == "Email":
-            platform_filter = firestore.FieldFilter("hasEmail", "==", True)
-        elif platform == "Phone":
-            platform_filter = firestore.FieldFilter("hasPhone", "==", True)
-        customers = customers.where(filter=platform_filter)
 
-    try:
-        if inactiveOnly:
-            customer_data = getInactiveCustomers(customers, platform)
-        else:
-            customer_data = customers.get()
+def loadTasks(dbClient, tasks: list) -> list:
+    """
+    Render tasks with a single fetchVariables for all of them.
 
-    except Exception as e:
-        print(f"Error retrieving customer data: {e}")
-        return None
+    Parameters:
+    - dbClient: Firestore database client.
+    - tasks: List of task dictionaries.
 
-    numCust = len(customer_data)
-    print("Number of customers found in the database", numCust)
-    if numCust > 0:
-        customers_export = [d.get().to_dict() for d in customer_data]
-        return {"customers": customers_export}
-    else:
-        return None
+    Returns:
+    - The rendered tasks.
+    """
+    keys = [key for key in map(taskVariableKey, tasks) if key is not None]
+    return renderTasks(tasks, fetchVariables(dbClient, keys) if keys else dict())
 
 
-def replaceNaN_single(d):
+def renderAssignments(contacts: list, variables: dict) -> list:
     """
-    Replace NaN and other placeholder values with None in a dictionary.
+    Add the content of their variables to outbound contacts, skipping assignments written before
+    content was resolved on read, which store it.
 
     Parameters:
-    - d: Dictionary to process.
+    - contacts: List of customer dictionaries merged with their assignment.
+    - variables: Variables by key, as returned by fetchVariables for resultVariables of each contact.
 
     Returns:
-    - The processed dictionary with NaN and placeholder values replaced with None.
+    - The contacts, updated in place.
     """
-    for key, value in d.items():
-        if value in ["N/A", "NaN", float('inf'), float('-inf')]:
-            d[key] = None
-        elif pd.isna(value):
-            d[key] = None
-    return d
+    for contact in contacts:
+        rendered = renderContent(resultVariables(contact), variables)
+        contact.update({k: v for k, v in rendered.items() if k not in contact})
+    return contacts
 
 
-def replaceNaN_db(dbClient, collections: list) -> pd.DataFrame:
+def getTasks(dbClient, ownerEmail):
     """
-    Replace NaN values in multiple Firestore collections.
+    Retrieve tasks associated with a specific owner.
 
     Parameters:
     - dbClient: Firestore database client.
-    - collections: List of collection names to process.
+    - ownerEmail: Email of the owner.
 
     Returns:
-    - A message indicating completion.
+    - A list of tasks associated with the owner.
     """
-    for collection in collections:
-        docs = dbClient.collection(collection)
-        docSnapshots = docs.get()
-    
-        for docSnapshot in docSnapshots:
-            docInfo = replaceNaN_single(docSnapshot.to_dict())
-            docSnapshot.reference.set(docInfo, merge=True)
+    owner = getOwner(dbClient, ownerEmail)
+    tasks_data = owner.collection("Agenda").get()
+    tasks = loadTasks(dbClient, [taskData(t) for t in tasks_data])
+    return tasks
 
-    return f"Done with {len(collections)} collections."
-        
 
-def checkCustomers(customers: pd.DataFrame, requestedCustomers: int) -> bool:
+def completeTask(dbClient, batch, ownerEmail: str, platform: str | None = None, phoneNumber: str | None = None, email: str | None = None, sequence_idx: str | None = None,
+                 taskID: str | None = None, holder: str | None = None, callStatus: str | None = None):
     """
-    Check if the number of provided customers meets the requested amount.
+    Mark a task as complete for a specific owner. Tasks are found by taskID when given, otherwise
+    by querying the owner's agenda with the other filters. A task with steps left moves on to
+    the next one and returns to the queue; it is deleted after its last step.
 
     Parameters:
-    - customers: DataFrame containing the customers.
-    - requestedCustomers: Number of requested customers.
+    - dbClient: Firestore database client.
+    - batch: Firestore batch to add the task completion to.
+    - ownerEmail: Email of the owner.
+    - platform: Platform associated with the task (optional).
+    - phoneNumber: Phone number associated with the task (optional).
+    - email: Email associated with the task (optional).
+    - sequence_idx: Sequence index of the task; with a taskID, the step being completed, so a stale
+      or repeated completion is rejected (optional).
+    - taskID: Document ID of the task, as returned by getAgenda (optional).
+    - holder: ID of the calling session, as passed to leaseTasks; the task must be leased to it.
+      Without one, tasks currently leased to anyone are rejected (optional).
+    - callStatus: Outcome of the step; a success marks the task converted for its later steps (optional).
 
     Returns:
-    - True if the provided customers meet or exceed the requested amount, False otherwise.
+    - A dictionary representing the completed task as it was read, to pass on to submitEvent.
     """
-    print(f"Customers provided: {len(customers.index)}. Customers Requested: {requestedCustomers}" )
-    return len(customers.index) >= requestedCustomers
+    owner = getOwner(dbClient, ownerEmail)
+    if taskID is not None:
+        task = owner.collection("Agenda").document(taskID).get()
+        if not task.exists:
+            raise ValueError(f"Unknown task: {taskID}")
+    else:
+        task = taskQuery(owner, platform, phoneNumber, email, sequence_idx).get()[0]
+    data = taskData(task)
+    checkStep(data, sequence_idx)
+    checkLease(data, holder)
+    finishStep(dbClient, batch, task, converted=callStatus in SUCCESS_STATUSES)
 
+    return data
 
-def assignExperiment(x, batch, dbClient, expID: int, expGenID: int, platform: str):
+
+def checkStep(task: dict, sequence_idx: str | None) -> None:
     """
-    Assign an experiment to a customer in Firestore.
+    Reject the completion of a step the task is no longer at, e.g. a retried or duplicate completion.
 
     Parameters:
-    - x: Customer data to process.
-    - batch: Firestore batch to add the experiment assignment to.
-    - dbClient: Firestore database client.
-    - expID: ID of the experiment.
-    - expGenID: ID of the experiment generator.
-    - platform: Platform associated with the experiment.
+    - task: Task data, as returned by taskData.
+    - sequence_idx: Step being completed, None to skip the check.
     """
-    cust = None
+    if sequence_idx is not None and str(task.get("sequence_idx")) != str(sequence_idx):
+        raise ValueError(f"Task {task['taskID']} is at step {task.get('sequence_idx')}, not {sequence_idx}")
 
-    if platform == "LinkedIn":
-        key = x.to_dict()["linkedInUrl"]
-        linkedIn_filter = firestore.FieldFilter("linkedInUrl", "==", key)
-        cust = dbClient.collection("customers").where(filter=linkedIn_filter).get()
-    
-    elif platform == "Email":
-        key = x.to_dict()["email"]
-        email_filter = firestore.FieldFilter("email", "==", key)
-        cust = dbClient.collection("customers").where(filter=email_filter).get()
-    
-    elif platform == "Phone":
-        key = x.to_dict()["phoneNumber"]
-        phone_filter = firestore.FieldFilter("phoneNumber", "==", key)
-        cust = dbClient.collection("customers").where(filter=phone_filter).get()
-        
-    if cust:
-        custRef = cust[0].reference
-        _expID, _expGenID = int(expID), int(expGenID)
-        expRef = custRef.collection("experiments").document()
 
-        batch.set(expRef, {
-            "experimentID": _expID, 
-            "experimentGeneratorID": _expGenID, 
-            "platform": platform,
-            "status": "Active",
-            "assigned_At": firestore.SERVER_TIMESTAMP
-        })
+def checkLease(task: dict, holder: str | None) -> None:
+    """
+    Reject the completion of a task leased to another caller, e.g. by a caller whose lease expired
+    and was taken over. The lease is checked on the same read finishStep's write is conditional on.
+
+    Parameters:
+    - task: Task data, as returned by taskData.
+    - holder: ID of the calling session, None for callers that do not lease tasks.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if holder is not None and task.get("leaseHolder") != holder:
+        raise ValueError(f"Task {task['taskID']} is not leased to {holder}")
+    if holder is None and not isLeaseFree(task, holder, now):
+        raise ValueError(f"Task {task['taskID']} is leased to another caller")
+
 
+def finishStep(dbClient, batch, task, converted: bool = False) -> bool:
+    """
+    Move a task on to its next step, releasing its lease, or delete it after its last step. The
+    write is conditional on the task not having changed since it was read, so the commit fails
+    with FailedPrecondition if another completion or lease got there first.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - batch: Firestore batch to add the write to.
+    - task: Snapshot of the task document.
+    - converted: Whether the step ended in a success, recorded on the task for its later steps (default: False).
 
-def assignContentToCustomers(dbClient, customers, batch, expID: int, expGenID: int, ownerEmail: str = None, platform: str = None) -> dict:
+    Returns:
+    - True if the task has steps left.
     """
-    Assign content to customers in an experiment.
+    data = task.to_dict()
+    option = dbClient.write_option(last_update_time=task.update_time)
+    sequence_idx, sequenceLength = data.get("sequence_idx"), data.get("sequenceLength")
+    if sequenceLength is not None and int(sequence_idx) < int(sequenceLength):
+        update = {"sequence_idx": f"{int(sequence_idx) + 1}",
+                  "leaseHolder": firestore.DELETE_FIELD,
+                  "leaseExpires": AGENDA_LEASE_FREE}
+        if converted:
+            update["converted"] = True
+        batch.update(task.reference, update, option=option)
+        return True
+    batch.delete(task.reference, option=option)
+    return False
+
+
+def leaseTasks(dbClient, ownerEmail: str, holder: str, platform: str | None = None, count: int = AGENDA_LEASE_COUNT, leaseMinutes: float = AGENDA_LEASE_MINUTES) -> list:
+    """
+    Claim the next tasks of an owner's agenda for one caller inside a transaction, so concurrent
+    callers never receive the same task. Tasks already leased to this holder are renewed first,
+    then free tasks (leaseExpires at AGENDA_LEASE_FREE) and expired ones are taken in lease order.
+    Only the candidates are read, at most twice count, however long the agenda is.
 
     Parameters:
     - dbClient: Firestore database client.
-    - customers: DataFrame containing the customers to assign content to.
-    - batch: Firestore batch to add the assignments to.
-    - expID: ID of the experiment.
-    - expGenID: ID of the experiment generator.
-    - ownerEmail: Email of the experiment owner (optional).
-    - platform: Platform associated with the experiment (optional).
+    - ownerEmail: Email of the owner.
+    - holder: ID of the calling session, e.g. one per open Phone page.
+    - platform: Platform to filter by (optional).
+    - count: Maximum number of tasks to lease (default: AGENDA_LEASE_COUNT).
+    - leaseMinutes: Minutes before the tasks return to the queue (default: AGENDA_LEASE_MINUTES).
 
     Returns:
-    - A dictionary containing the assigned customers.
+    - A list of leased tasks with their taskID, leaseHolder and leaseExpires.
     """
-    activeCustomers = lookupCustomerBatch(dbClient, customers)
+    owner = getOwner(dbClient, ownerEmail)
+    agenda = agendaQuery(owner, platform)
 
-    if not activeCustomers:
-        return None
-    
-    experiment_ref = dbClient.collection("experiments")
-    experiment_data = experiment_ref.where(
-        filter=firestore.FieldFilter("experimentID", "==", expID)
-    ).where(
-        filter=firestore.FieldFilter("experimentGeneratorID", "==", expGenID)
-    ).get()
-
-    if not experiment_data:
-        return None
+    @firestore.transactional
+    def claim(transaction):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        lease = {"leaseHolder": holder, "leaseExpires": now + datetime.timedelta(minutes=leaseMinutes)}
+        held = agenda.where(filter=firestore.FieldFilter("leaseHolder", "==", holder)).limit(count)
+        free = agenda.where(filter=firestore.FieldFilter("leaseExpires", "<=", now)).order_by("leaseExpires").limit(count)
 
-    expInfo = experiment_data[0].to_dict()
-    numVariables = int((len(expInfo.keys()) - 3) / 2)
-    
-    variable_content = {}
-    for i in range(1, numVariables + 1):
-        varGenID = expInfo[f"variableGeneratorID_{i}"]
-        varID = expInfo[f"variableID_{i}"]
+        # A holder's own expired lease is returned by both queries
+        claimed = dict()
+        for snapshot in list(transaction.get(held)) + list(transaction.get(free)):
+            claimed.setdefault(snapshot.id, snapshot)
 
-        var_data = dbClient.collection("variables").where(
-            filter=firestore.FieldFilter("variableGeneratorID", "==", varGenID)
-        ).where(
-            filter=firestore.FieldFilter("variableID", "==", varID)
-        ).get()
+        tasks = []
+        for snapshot in list(claimed.values())[:count]:
+            transaction.update(snapshot.reference, lease)
+            tasks.append({**taskData(snapshot), **lease})
+        return tasks
 
-        if var_data:
-            content = var_data[0].to_dict()
-            for suffix in ["A", "B", "C", "D", "E"]:
-                content_key = f"content{suffix}"
-                if content.get(content_key):
-                    variable_content[f"content_{i}_{suffix}"] = content[content_key]
+    return loadTasks(dbClient, claim(dbClient.transaction(max_attempts=AGENDA_LEASE_ATTEMPTS)))
 
-    tasks = []
-    if ownerEmail:
-        owner = dbClient.collection("Users").where(
-            filter=firestore.FieldFilter("email", "==", ownerEmail)
-        ).get()[0].reference
-
-        for i in range(1, numVariables + 1):
-            task = {
-                "sequence_idx": f"{i}",
-                "platform": platform
-            }
-            for suffix in ["A", "B", "C", "D", "E"]:
-                key = f"content_{i}_{suffix}"
-                if key in variable_content:
-                    task[key] = variable_content[key]
-            task.update(expInfo)
-            tasks.append(task)    
 
-    for active in activeCustomers:
-        customer_info = active.get().to_dict()
-        
-        expRef = active.collection("experiments").document()
-        expInfo.update(variable_content)
-        batch.set(expRef, expInfo, merge=True)
-        
-        if ownerEmail:
-            for task in tasks:
-                task_with_customer_info = {**task, **customer_info}
-                task_doc = owner.collection("Agenda").document()
-                batch.set(task_doc, task_with_customer_info)
-    
-    return activeCustomers
+def isLeaseFree(task: dict, holder: str, now) -> bool:
+    """
+    Check whether a task can be leased by a holder.
+
+    Parameters:
+    - task: Task data.
+    - holder: ID of the calling session.
+    - now: Current time, timezone aware.
+
+    Returns:
+    - True if the task is unleased, its lease expired, or it is leased to holder.
+    """
+    expires = task.get("leaseExpires")
+    return expires is None or expires <= now or task.get("leaseHolder") == holder
 
 
-def getExperiments(dbClient, ownerEmail, experimentGeneratorID) -> dict:
+def releaseTasks(dbClient, ownerEmail: str, holder: str, taskIDs: list) -> int:
     """
-    Retrieve experiments associated with a specific owner and experiment generator.
+    Return leased tasks to the queue, e.g. when a caller ends their session early. Tasks
+    leased to someone else since are left untouched.
 
     Parameters:
     - dbClient: Firestore database client.
-    - ownerEmail: Email of the experiment owner.
-    - experimentGeneratorID: ID(s) of the experiment generator(s).
+    - ownerEmail: Email of the owner.
+    - holder: ID of the calling session.
+    - taskIDs: Document IDs of the tasks to release.
 
     Returns:
-    - A dictionary containing the experiments.
+    - The number of tasks released.
     """
-    if type(experimentGeneratorID) is not list:
-        experimentGeneratorID = [experimentGeneratorID]
-
-    experiments = []
+    owner = getOwner(dbClient, ownerEmail)
+    refs = [owner.collection("Agenda").document(taskID) for taskID in taskIDs]
 
-    for expGenID in experimentGeneratorID: 
-        rawData = dbClient.collection("experiments")
-    
-        if ownerEmail is not None:
-            ownerFilter = firestore.FieldFilter("ownerEmail", "==", ownerEmail)
-            rawData = rawData.where(filter=ownerFilter)
-        
-        if expGenID is not None:
-            expGenFilter = firestore.FieldFilter("experimentGeneratorID", "==", int(expGenID))
-            rawData = rawData.where(filter=expGenFilter)
-    
-        data = rawData.get()
-        
-        if data:
-            for d in data:
-                if d:
-                    expInfo = d.to_dict()
-                else:
-                    continue
-    
-                numVariables = int((len(expInfo.keys()) - 3) / 2)
-                varContent = {"experimentGeneratorID": int(expGenID),
-                              "experimentID": expInfo["experimentID"]}
-    
-                for i in range(1, numVariables + 1):
-                    varGenID = expInfo[f"variableGeneratorID_{i}"]
-                    varID = expInfo[f"variableID_{i}"]
-    
-                    varGen_filter = firestore.FieldFilter("variableGeneratorID", "==", varGenID)
-                    varID_filter = firestore.FieldFilter("variableID", "==", varID)
-    
-                    var = dbClient.collection("variables").where(filter=varGen_filter).where(filter=varID_filter).get()
-    
-                    if var:
-                        content = var[0].to_dict()
-                        for suffix in ["A", "B", "C", "D", "E"]:
-                            content_key = f"content{suffix}"
-                            if content.get(content_key) is not None:
-                                varContent[f"content_{i}_{suffix}"] = content[content_key]
-                        
-                        varContent[f"variableGeneratorID_{i}"] = varGenID
-                        varContent[f"variableID_{i}"] = varID
-
-                experiments.append(deepcopy(varContent))
+    @firestore.transactional
+    def release(transaction):
+        released = 0
+        for snapshot in transaction.get_all(refs):
+            if snapshot.exists and snapshot.to_dict().get("leaseHolder") == holder:
+                transaction.update(snapshot.reference, {"leaseHolder": firestore.DELETE_FIELD, "leaseExpires": AGENDA_LEASE_FREE})
+                released += 1
+        return released
 
-    if experiments:
-        return experiments
-    else:
-        return None
+    return release(dbClient.transaction()) if refs else 0
 
 
-def getTasks(dbClient, ownerEmail):
+def backfillAgendaLeases(dbClient) -> str:
     """
-    Retrieve tasks associated with a specific owner.
+    Mark the Agenda tasks written before AGENDA_LEASE_FREE as free, so leaseTasks finds them.
 
     Parameters:
     - dbClient: Firestore database client.
-    - ownerEmail: Email of the owner.
 
     Returns:
-    - A list of tasks associated with the owner.
+    - A message indicating how many tasks were updated.
     """
-    owner = dbClient.collection("Users").where("email", "==", ownerEmail).get()[0].reference
-    tasks_data = owner.collection("Agenda").get()
-    tasks = [t.to_dict() for t in tasks_data]
-    return tasks
+    numUpdates = 0
+    with BulkWriter(dbClient) as writer:
+        for task in dbClient.collection_group("Agenda").select(["leaseExpires"]).stream():
+            if task.to_dict().get("leaseExpires") is None:
+                writer.set(task.reference, {"leaseExpires": AGENDA_LEASE_FREE}, merge=True)
+                numUpdates += 1
+
+    return f"Done with {numUpdates} tasks."
 
 
-def completeTask(dbClient, batch, ownerEmail: str, platform: str | None = None, phoneNumber: str | None = None, email: str | None = None, sequence_idx: str | None = None):
+def taskData(task) -> dict:
     """
-    Mark a task as complete for a specific owner.
+    Export an Agenda task together with its document ID, which completeTask accepts as taskID.
 
     Parameters:
-    - dbClient: Firestore database client.
-    - batch: Firestore batch to add the task completion to.
-    - ownerEmail: Email of the owner.
+    - task: Snapshot of the task document.
+
+    Returns:
+    - A dictionary with the task's fields and taskID.
+    """
+    data = task.to_dict()
+    data["taskID"] = task.id
+    return data
+
+
+def taskQuery(owner, platform: str | None = None, phoneNumber: str | None = None, email: str | None = None, sequence_idx: str | None = None):
+    """
+    Build the query for a single task in an owner's agenda.
+
+    Parameters:
+    - owner: Reference to the owner's user document.
     - platform: Platform associated with the task (optional).
     - phoneNumber: Phone number associated with the task (optional).
     - email: Email associated with the task (optional).
     - sequence_idx: Sequence index of the task (optional).
 
     Returns:
-    - A dictionary representing the completed task.
+    - A Firestore query.
     """
-    owner = dbClient.collection("Users").where("email", "==", ownerEmail).get()[0].reference
-    get_data = owner.collection("Agenda")
-
-    if platform is not None:
-        platformFilter = firestore.FieldFilter("platform", "==", platform)
-        get_data = get_data.where(filter=platformFilter)
+    get_data = agendaQuery(owner, platform)
     
     if phoneNumber is not None:
         phoneFilter = firestore.FieldFilter("phoneNumber", "==", phoneNumber)
@@ -1822,25 +3832,146 @@ def completeTask(dbClient, batch, ownerEmail: str, platform: str | None = None,
         sequenceFilter = firestore.FieldFilter("sequence_idx", "==", sequence_idx)
         get_data = get_data.where(filter=sequenceFilter)
 
-    batch.delete(get_data.get()[0].reference)
+    return get_data.limit(1)
 
-    return get_data.get()[0].to_dict()
 
-
-def submitEvent(dbClient, batch, event: dict):
+def submitEvent(dbClient, batch, event: dict, task: dict | None = None):
     """
-    Submit an event to the Firestore database.
+    Submit an event to the Firestore database. A success is counted at most once per assignment:
+    not again for a task that already converted at an earlier step.
 
     Parameters:
     - dbClient: Firestore database client.
     - batch: Firestore batch to add the event to.
     - event: Dictionary representing the event.
+    - task: The task the event completes, as returned by completeTask (optional).
     """
     doc = dbClient.collection("events").document()
     batch.set(doc, event)
+    converted = task is not None and task.get("converted", False)
+    if event.get("callStatus") in SUCCESS_STATUSES and event.get("experimentID") is not None and not converted:
+        recordResults(dbClient, batch, event, successes=1)
+
 
+def recordResults(dbClient, batch, experiment: dict, trials: int = 0, successes: int = 0) -> None:
+    """
+    Add trials and successes to the results counters of an experiment and each of its variables.
+    Every counter is spread over RESULT_SHARDS shard documents, one picked at random per write,
+    so busy experiments never contend on a single document.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - batch: Batch to add the increments to.
+    - experiment: Experiment, assignment or event dictionary with the experiment and variable IDs.
+    - trials: Number of trials to add (default: 0).
+    - successes: Number of successes to add (default: 0).
+    """
+    counts = {"trials": firestore.Increment(trials), "successes": firestore.Increment(successes)}
+    expGenID, expID = int(experiment["experimentGeneratorID"]), int(experiment["experimentID"])
+
+    shard = {"experimentGeneratorID": expGenID, "experimentID": expID}
+    for i, (varGenID, varID) in enumerate(resultVariables(experiment), start=1):
+        shard.update({f"variableGeneratorID_{i}": varGenID, f"variableID_{i}": varID})
+        varShard = {"variableGeneratorID": varGenID, "variableID": varID, **counts}
+        batch.set(resultShard(dbClient, "variable", varGenID, varID), varShard, merge=True)
+    batch.set(resultShard(dbClient, "experiment", expGenID, expID), {**shard, **counts}, merge=True)
+
+
+def resultVariables(experiment: dict) -> list:
+    """
+    List the variables of an experiment, assignment or event, whatever other fields it carries.
+
+    Parameters:
+    - experiment: Dictionary with variableGeneratorID_i and variableID_i fields.
+
+    Returns:
+    - A list of (variableGeneratorID, variableID) tuples in variable order.
+    """
+    variables = []
+    while experiment.get(f"variableGeneratorID_{len(variables) + 1}") is not None:
+        i = len(variables) + 1
+        variables.append((int(experiment[f"variableGeneratorID_{i}"]), int(experiment[f"variableID_{i}"])))
+    return variables
+
+
+def resultShard(dbClient, kind: str, generatorID: int, id: int):
+    """
+    Pick a random shard of a results counter.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - kind: "experiment" or "variable".
+    - generatorID: ID of the experiment or variable generator.
+    - id: ID of the experiment or variable.
+
+    Returns:
+    - A reference to results/{kind}_{generatorID}_{id}/{kind}Shards/{shard}.
+    """
+    counter = dbClient.collection("results").document(f"{kind}_{generatorID}_{id}")
+    return counter.collection(f"{kind}Shards").document(str(random.randrange(RESULT_SHARDS)))
+
+
+def resultShardsQueries(dbClient, kind: str, generatorIDs: list) -> list:
+    """
+    Build the collection group queries for every results shard of some generators.
+
+    Parameters:
+    - dbClient: Firestore database client, sync or async.
+    - kind: "experiment" or "variable".
+    - generatorIDs: IDs of the experiment or variable generators.
+
+    Returns:
+    - A list of Firestore queries, one per IN_QUERY_LIMIT generators.
+    """
+    generatorIDs = sorted({int(g) for g in generatorIDs})
+    return [dbClient.collection_group(f"{kind}Shards").where(
+                filter=firestore.FieldFilter(f"{kind}GeneratorID", "in", generatorIDs[i:i + IN_QUERY_LIMIT]))
+            for i in range(0, len(generatorIDs), IN_QUERY_LIMIT)]
+
+
+def sumResultShards(shards: list, kind: str) -> list:
+    """
+    Add up the shards of each results counter.
 
-def fullExperimentalSetup(dbClient, varGenIDs: list, trials: int = 5, numExperiments: int = 5, platform: str = None, country: str = None, ownerEmail: str = None):    
+    Parameters:
+    - shards: Shard dictionaries.
+    - kind: "experiment" or "variable".
+
+    Returns:
+    - A list of counters with their IDs, trials, successes and success rate, sorted by ID.
+    """
+    totals = dict()
+    for shard in shards:
+        key = (shard[f"{kind}GeneratorID"], shard[f"{kind}ID"])
+        total = totals.setdefault(key, {k: v for k, v in shard.items() if k not in ("trials", "successes")} | {"trials": 0, "successes": 0})
+        total["trials"] += shard.get("trials", 0)
+        total["successes"] += shard.get("successes", 0)
+    for total in totals.values():
+        total["successRate"] = total["successes"] / total["trials"] if total["trials"] else None
+    return [totals[key] for key in sorted(totals)]
+
+
+def getResults(dbClient, expGenIDs: list) -> dict:
+    """
+    Read the trials and successes of every experiment of some experiment generators, and of
+    the variables they use, from the results counters.
+
+    Parameters:
+    - dbClient: Firestore database client.
+    - expGenIDs: IDs of the experiment generators.
+
+    Returns:
+    - A dictionary with the experiment and variable counters.
+    """
+    shards = [s.to_dict() for q in resultShardsQueries(dbClient, "experiment", expGenIDs) for s in q.get()]
+    experiments = sumResultShards(shards, "experiment")
+    varGenIDs = {varGenID for e in experiments for varGenID, _ in resultVariables(e)}
+    shards = [s.to_dict() for q in resultShardsQueries(dbClient, "variable", varGenIDs) for s in q.get()]
+    return {"experiments": experiments, "variables": sumResultShards(shards, "variable")}
+
+
+def fullExperimentalSetup(dbClient, varGenIDs: list, trials: int = 5, numExperiments: int = 5, platform: str = None, country: str = None, ownerEmail: str = None,
+                          seed: int | None = None):
     """
     Set up a full experiment including variables, customers, and assignments.
 
@@ -1852,47 +3983,41 @@ def fullExperimentalSetup(dbClient, varGenIDs: list, trials: int = 5, numExperim
     - platform: Platform associated with the experiment (optional).
     - country: Country associated with the experiment (optional).
     - ownerEmail: Email of the experiment owner (optional).
+    - seed: Seed for the experiments picked, the customers sampled and the customers in each cohort, for reproducible setups (optional).
 
     Returns:
     - A success message indicating completion.
     """
     assert country is not None
-    rawDataCust = getCustomers(dbClient, platform=platform, country=country, inactiveOnly="True")
+    # Only the customers the cohorts need are read, not the whole inactive pool
+    rawDataCust = sampleCustomers(dbClient, math.ceil(trials * numExperiments * SAMPLE_OVERDRAW), platform=platform, country=country, seed=seed)
     if rawDataCust is not None:
         expGenInfo = createExpGen(dbClient, varGenIDs=varGenIDs, platform=platform, ownerEmail=ownerEmail)
         expGen = ExperimentGenerator(**expGenInfo)
         varBank = getVarBank(dbClient, expGen)
         
         cust = pd.DataFrame(rawDataCust["customers"])
+        key = PLATFORM_KEYS.get(platform)
+        if key in cust.columns:
+            # A customer listed twice must not land in two cohorts
+            cust = cust.drop_duplicates(subset=key).reset_index(drop=True)
+
+        # Checked up front so a setup short of customers creates nothing
+        if not checkCustomers(cust, trials * numExperiments):
+            raise Exception("Error: Upload Customers.")
+        plan = planExperiments(dbClient, expGen, varBank, numExperiments, ownerEmail, platform, seed=seed)
+        cohorts = allocateCohorts(len(cust.index), trials, len(plan), seed=seed)
+        expGenID = expGen.getID()
         
-        experiments = set()
-        
-        while numExperiments > 0:
-            if checkCustomers(cust, trials):
-                numExperiments -= 1
-
-                expID = createExperiment(dbClient, expGen, varBank, ownerEmail, platform)
-                expGenID = expGen.getID()
-                experiments.add(expID)
-                
-                trial_cust = cust.sample(n=trials)
-
-                batch = dbClient.batch()
+        # Assignments and Agenda tasks of all experiments share one writer and commit in parallel
+        with BulkWriter(dbClient) as writer:
+            for expInfo, cohort in zip(plan, cohorts):
+                trial_cust = cust.iloc[cohort]
                 if platform == "Phone":
-                    assignContentToCustomers(dbClient, trial_cust, batch, int(expID), int(expGenID), ownerEmail, platform)
+                    assignContentToCustomers(dbClient, trial_cust, writer, int(expInfo["experimentID"]), int(expGenID), ownerEmail, platform, expInfo=expInfo)
                 else:
-                    assignContentToCustomers(dbClient, trial_cust, batch, int(expID), int(expGenID))
-                batch.commit()
-                
-                if platform == "Email":
-                    cust = cust[~cust["email"].isin(trial_cust["email"])]
-                elif platform == "LinkedIn":
-                    cust = cust[~cust["linkedInUrl"].isin(trial_cust["linkedInUrl"])]
-                elif platform == "Phone":
-                    cust = cust[~cust["phoneNumber"].isin(trial_cust["phoneNumber"])]
-            else:
-                raise Exception("Error: Upload Customers.")
-            
+                    assignContentToCustomers(dbClient, trial_cust, writer, int(expInfo["experimentID"]), int(expGenID), expInfo=expInfo)
+
         return "Success: Experiment uploaded."
 
 
@@ -1909,6 +4034,32 @@ def getVariableGenerators(db, ownerEmail: str, platform: str | None = None, phas
     Returns:
     - A dictionary containing the variable generators.
     """
+    mirror = getMirror(db, "variableGenerators")
+    if mirror is not None:
+        return {"variableGenerators": mirror.query(ownerEmail, platform=platform or None, phase=phase or None)}
+
+    load = lambda: [d.to_dict() for d in variableGeneratorsQuery(db, ownerEmail, platform, phase).get()]
+    data = {"variableGenerators": cachedRead(db, ("variableGenerators", ownerEmail, platform, phase), load)}
+    
+    if data:
+        return data
+    else:
+        return None
+
+
+def variableGeneratorsQuery(db, ownerEmail: str, platform: str | None = None, phase: str | None = None):
+    """
+    Build the query for the variable generators of an owner.
+
+    Parameters:
+    - db: Firestore database client, sync or async.
+    - ownerEmail: Email of the owner.
+    - platform: Platform to filter by (optional).
+    - phase: Phase to filter by (optional).
+
+    Returns:
+    - A Firestore query.
+    """
     ownerFilter = firestore.FieldFilter("ownerEmail", "==", ownerEmail)
     get_data = db.collection("variableGenerators").where(filter=ownerFilter)
     
@@ -1920,12 +4071,7 @@ def getVariableGenerators(db, ownerEmail: str, platform: str | None = None, phas
         phaseFilter = firestore.FieldFilter("phase", "==", phase)
         get_data = get_data.where(filter=phaseFilter)
 
-    data = {"variableGenerators": [d.to_dict() for d in get_data.get()]}
-    
-    if data:
-        return data
-    else:
-        return None
+    return get_data
 
 
 def getExperimentGenerators(db, ownerEmail: str, platform: str | None = None) -> dict:
@@ -1940,6 +4086,30 @@ def getExperimentGenerators(db, ownerEmail: str, platform: str | None = None) ->
     Returns:
     - A dictionary containing the experiment generators.
     """
+    mirror = getMirror(db, "experimentGenerators")
+    if mirror is not None:
+        return {"experimentGenerators": mirror.query(ownerEmail, platform=platform)}
+
+    load = lambda: [d.to_dict() for d in experimentGeneratorsQuery(db, ownerEmail, platform).get()]
+    data = {"experimentGenerators": cachedRead(db, ("experimentGenerators", ownerEmail, platform), load)}
+    if data:
+        return data
+    else:
+        return None
+
+
+def experimentGeneratorsQuery(db, ownerEmail: str, platform: str | None = None):
+    """
+    Build the query for the experiment generators of an owner.
+
+    Parameters:
+    - db: Firestore database client, sync or async.
+    - ownerEmail: Email of the owner.
+    - platform: Platform to filter by (optional).
+
+    Returns:
+    - A Firestore query.
+    """
     ownerFilter = firestore.FieldFilter("ownerEmail", "==", ownerEmail)
     get_data = db.collection("experimentGenerators").where(filter=ownerFilter)
     
@@ -1948,12 +4118,7 @@ def getExperimentGenerators(db, ownerEmail: str, platform: str | None = None) ->
         get_data = get_data.where(filter=platformFilter)
         print("Platform is not None", ownerEmail, platform)
 
-    get_data = get_data.get()
-    data = {"experimentGenerators": [d.to_dict() for d in get_data]}
-    if data:
-        return data
-    else:
-        return None
+    return get_data
 
 
 def getAgenda(db, ownerEmail: str, platform: str | None = None):
@@ -1968,38 +4133,250 @@ def getAgenda(db, ownerEmail: str, platform: str | None = None):
     Returns:
     - A dictionary containing the tasks.
     """
+    owner = getOwner(db, ownerEmail)
+    get_data = agendaQuery(owner, platform).get()
+    data = {"Tasks": loadTasks(db, [taskData(d) for d in get_data])}
+    if data:
+        return data
+    else:
+        return None
+
+
+def getOwner(db, ownerEmail: str):
+    """
+    Find the user document of an owner: a point read of the email keyed document, kept in
+    readCache, falling back to a query for users not migrated yet. Those are never cached, since
+    migrateUserIDs moves them while other workers keep running.
+
+    Parameters:
+    - db: Firestore database client.
+    - ownerEmail: Email of the owner.
+
+    Returns:
+    - A reference to the owner's user document.
+    """
+    key = ownerCacheKey(db, ownerEmail)
+    found, path, generation = readCache.lookup(key)
+    if not found:
+        snapshot = userRef(db, ownerEmail).get()
+        if snapshot.exists:
+            path = snapshot.reference.path
+            readCache.put(key, path, generation)
+        else:
+            legacy = ownerQuery(db, ownerEmail).get()
+            if not legacy:
+                raise ValueError(f"Unknown owner: {ownerEmail}")
+            path = legacy[0].reference.path
+    return db.document(path)
+
+
+def userDocID(email: str | None) -> str | None:
+    """
+    Build the document ID of a user, their normalized email.
+
+    Parameters:
+    - email: Email of the user.
+
+    Returns:
+    - The document ID, or None for a missing email.
+    """
+    if email is None or not str(email).strip():
+        return None
+    return str(email).strip().lower()
+
+
+def userRef(db, email: str):
+    """
+    Build the reference to the email keyed document of a user.
+
+    Parameters:
+    - db: Firestore database client, sync or async.
+    - email: Email of the user.
+
+    Returns:
+    - A document reference.
+    """
+    return db.collection("Users").document(userDocID(email))
+
+
+def ownerCacheKey(db, ownerEmail: str) -> tuple:
+    """
+    Build the readCache key of an owner's email keyed user document path.
+
+    Parameters:
+    - db: Firestore database client, sync or async.
+    - ownerEmail: Email of the owner.
+
+    Returns:
+    - A cache key.
+    """
+    return (clientScope(db), "Users", userDocID(ownerEmail))
+
+
+def migrateUserIDs(dbClient) -> str:
+    """
+    Move users stored under random IDs to their email keyed IDs, together with their Agenda
+    subcollection. A user is only merged into a document this migration created for the same
+    email, or one holding the same data from an interrupted run; users whose normalized email is
+    taken by someone else are left in place and reported.
+
+    Parameters:
+    - dbClient: Firestore database client.
+
+    Returns:
+    - A message indicating how many users were moved, and which were left in place.
+    """
+    collectionRef = dbClient.collection("Users")
+    moves = []
+    for user in collectionRef.stream():
+        docID = userDocID(user.to_dict().get("email"))
+        if docID is not None and docID != user.id:
+            moves.append((user, collectionRef.document(docID)))
+
+    numMoved = 0
+    conflicts = []
+    with BulkWriter(dbClient) as writer:
+        targets = getDocuments(dbClient, [target for _, target in moves])
+        created = dict()
+        tasks = []
+        moved = []
+        for user, target in moves:
+            data = user.to_dict()
+            existing = targets[target.path].to_dict() if targets[target.path].exists else None
+            if target.path not in created and existing in (None, data):
+                if existing is None:
+                    writer.set(target, data)
+                created[target.path] = data.get("email")
+            elif created.get(target.path) != data.get("email"):
+                conflicts.append(user.id)
+                continue
+            for task in user.reference.collection("Agenda").stream():
+                writer.set(target.collection("Agenda").document(task.id), task.to_dict())
+                tasks.append(task.reference)
+            moved.append(user)
+
+        # Old documents are only deleted once their copies landed, so an interrupted run can simply be repeated
+        writer.flush()
+        for ref in tasks:
+            writer.delete(ref)
+        for user in moved:
+            writer.delete(user.reference)
+            numMoved += 1
+
+    if conflicts:
+        print(f"Users left in place, their email is taken: {conflicts}")
+        return f"Done with {numMoved} users. Left in place, their email is taken: {', '.join(conflicts)}."
+    return f"Done with {numMoved} users."
+
+
+def ownerQuery(db, ownerEmail: str):
+    """
+    Build the query for the user document of an owner stored under a random ID.
+
+    Parameters:
+    - db: Firestore database client, sync or async.
+    - ownerEmail: Email of the owner.
+
+    Returns:
+    - A Firestore query.
+    """
     emailFilter = firestore.FieldFilter("email", "==", ownerEmail)
-    owner = db.collection("Users").where(filter=emailFilter).get()[0].reference
-    
+    return db.collection("Users").where(filter=emailFilter).limit(1)
+
+
+def agendaQuery(owner, platform: str | None = None):
+    """
+    Build the query for an owner's agenda.
+
+    Parameters:
+    - owner: Reference to the owner's user document.
+    - platform: Platform to filter by (optional).
+
+    Returns:
+    - A Firestore query.
+    """
+    get_data = owner.collection("Agenda")
     if platform is not None:
         platformFilter = firestore.FieldFilter("platform", "==", platform)
-        get_data = owner.collection("Agenda").where(filter=platformFilter)
+        get_data = get_data.where(filter=platformFilter)
+    return get_data
 
-    get_data = get_data.get()
-    data = {"Tasks": [d.to_dict() for d in get_data]}
-    if data:
-        return data
+
+def collectionQuery(db, collection: str, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None, cursor=None):
+    """
+    Build a paginated query over a collection.
+
+    Parameters:
+    - db: Firestore database client.
+    - collection: Name of the collection.
+    - limit: Maximum number of documents to return (optional).
+    - startAfter: ID of the last document of the previous page (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order; document ID order if omitted.
+    - cursor: Snapshot of the startAfter document, read here if needed and not given (optional).
+
+    Returns:
+    - A Firestore query.
+    """
+    collectionRef = db.collection(collection)
+    if orderBy:
+        direction = firestore.Query.DESCENDING if orderBy.startswith("-") else firestore.Query.ASCENDING
+        query = collectionRef.order_by(orderBy.lstrip("-"), direction=direction)
     else:
-        return None
+        query = collectionRef.order_by("__name__")
+
+    if startAfter is not None:
+        if orderBy:
+            # The cursor needs the ordered field's value, so resume from the document itself
+            if cursor is None:
+                cursor = collectionRef.document(startAfter).get()
+            if not cursor.exists:
+                raise ValueError(f"Unknown cursor: {startAfter}")
+            query = query.start_after(cursor)
+        else:
+            query = query.start_after({"__name__": startAfter})
 
+    if limit is not None:
+        query = query.limit(limit)
+    return query
 
-def getCollection(db, collection) -> dict:
+
+def getCollection(db, collection, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None) -> dict:
     """
-    Retrieve a collection from Firestore.
+    Retrieve a collection, or one page of it, from Firestore.
 
     Parameters:
     - db: Firestore database client.
     - collection: Name of the collection to retrieve.
+    - limit: Maximum number of documents to return (optional).
+    - startAfter: ID of the last document of the previous page (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order (optional).
 
     Returns:
-    - A dictionary containing the collection's documents.
+    - A dictionary containing the collection's documents and the cursor of the next page,
+      which is None when there are no more documents.
     """
-    get_data = db.collection(collection).get()
+    get_data = collectionQuery(db, collection, limit, startAfter, orderBy).get()
     data = {collection: [d.to_dict() for d in get_data]}
-    if data:
-        return data
-    else:
-        return None
+    data["cursor"] = get_data[-1].id if limit is not None and len(get_data) == limit else None
+    return data
+
+
+def streamCollection(db, collection: str, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None):
+    """
+    Stream the documents of a collection one at a time, so memory stays flat however large it is.
+
+    Parameters:
+    - db: Firestore database client.
+    - collection: Name of the collection to stream.
+    - limit: Maximum number of documents to stream (optional).
+    - startAfter: ID of the document to resume after (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order (optional).
+
+    Returns:
+    - A generator of document dictionaries.
+    """
+    for d in collectionQuery(db, collection, limit, startAfter, orderBy).stream():
+        yield d.to_dict()
 
 
 def readWithNone(path: str) -> pd.DataFrame:
@@ -2055,8 +4432,16 @@ def extractAllOutboundContacts(dbClient, experimentGeneratorIDs) -> dict:
     contacts = []
 
     for expGenID in experimentGeneratorIDs:         
-        activeCustomers = getActiveCustomers(dbClient, expGenID)
-        if activeCustomers:
-            contacts.extend([deepcopy(extractOutbound(active, expGenID)) for active in activeCustomers])
+        assignments = getActiveAssignments(dbClient, expGenID)
+        if assignments:
+            customers = getDocuments(dbClient, list(assignments.keys()))
+            for customer_ref, assignment in assignments.items():
+                customer = customers.get(customer_ref.path)
+                if customer is None or not customer.exists:
+                    continue
+                outbound = customer.to_dict()
+                outbound.update(assignment.to_dict())
+                contacts.append(outbound)
 
-    return contacts
+    keys = [key for contact in contacts for key in resultVariables(contact)]
+    return renderAssignments(contacts, fetchVariables(dbClient, keys) if keys else dict())
@@ -0,0 +1,450 @@
+import asyncio
+import src.helpers.mdpFirestore as mdp
+
+# Async variants of the mdpFirestore reads behind the FastAPI endpoints, for use with firestore.AsyncClient.
+# Queries are built by the shared mdpFirestore builders so both variants always read the same data.
+
+
+async def cachedRead(dbClient, key: tuple, load):
+    """
+    Serve a read from mdpFirestore.readCache, awaiting the load on a miss.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - key: Cache key starting with the collection name, e.g. ("variables", 3).
+    - load: Zero argument coroutine function performing the read.
+
+    Returns:
+    - The cached or loaded value.
+    """
+    key = (mdp.clientScope(dbClient),) + key
+    found, value, generation = mdp.readCache.lookup(key)
+    if found:
+        return value
+    value = await load()
+    mdp.readCache.put(key, value, generation)
+    return value
+
+
+async def getDocuments(dbClient, references: list) -> dict:
+    """
+    Fetch many documents by reference, with every get_all chunk in flight at once.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - references: List of document references to fetch.
+
+    Returns:
+    - A dictionary mapping each document path to its snapshot.
+    """
+    async def fetch(chunk):
+        return [snapshot async for snapshot in dbClient.get_all(chunk)]
+
+    chunks = [references[i:i + mdp.GET_ALL_CHUNK_SIZE] for i in range(0, len(references), mdp.GET_ALL_CHUNK_SIZE)]
+    snapshots = dict()
+    for chunk in await asyncio.gather(*[fetch(chunk) for chunk in chunks]):
+        for snapshot in chunk:
+            snapshots[snapshot.reference.path] = snapshot
+    return snapshots
+
+
+async def getCustomers(dbClient, custRole: str = None, platform: str = None, country: str = None, inactiveOnly: str = "False") -> dict:
+    """
+    Retrieve customers from Firestore based on filters.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - custRole: Role to filter by (optional).
+    - platform: Platform to filter by (optional).
+    - country: Country to filter by (optional).
+    - inactiveOnly: Flag to include only inactive customers (default: "False").
+
+    Returns:
+    - A dictionary containing the filtered customers.
+    """
+    customers = mdp.customersQuery(dbClient, custRole, platform, country)
+
+    # Errors propagate, so the endpoint answers with an HTTP error rather than null
+    if str(inactiveOnly).lower() == "true":
+        customers = mdp.inactiveCustomersQuery(customers, platform)
+    customer_data = await customers.get()
+
+    return mdp.exportCustomerData(customer_data)
+
+
+async def getVariableGenerators(db, ownerEmail: str, platform: str | None = None, phase: str | None = None) -> dict:
+    """
+    Retrieve variable generators associated with a specific owner.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - ownerEmail: Email of the owner.
+    - platform: Platform to filter by (optional).
+    - phase: Phase to filter by (optional).
+
+    Returns:
+    - A dictionary containing the variable generators.
+    """
+    mirror = mdp.getMirror(db, "variableGenerators")
+    if mirror is not None:
+        return {"variableGenerators": mirror.query(ownerEmail, platform=platform or None, phase=phase or None)}
+
+    async def load():
+        return [d.to_dict() for d in await mdp.variableGeneratorsQuery(db, ownerEmail, platform, phase).get()]
+
+    return {"variableGenerators": await cachedRead(db, ("variableGenerators", ownerEmail, platform, phase), load)}
+
+
+async def getExperimentGenerators(db, ownerEmail: str, platform: str | None = None) -> dict:
+    """
+    Retrieve experiment generators associated with a specific owner.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - ownerEmail: Email of the owner.
+    - platform: Platform to filter by (optional).
+
+    Returns:
+    - A dictionary containing the experiment generators.
+    """
+    mirror = mdp.getMirror(db, "experimentGenerators")
+    if mirror is not None:
+        return {"experimentGenerators": mirror.query(ownerEmail, platform=platform)}
+
+    async def load():
+        return [d.to_dict() for d in await mdp.experimentGeneratorsQuery(db, ownerEmail, platform).get()]
+
+    return {"experimentGenerators": await cachedRead(db, ("experimentGenerators", ownerEmail, platform), load)}
+
+
+async def getOwner(db, ownerEmail: str):
+    """
+    Find the user document of an owner, keeping the path of email keyed documents in the read cache.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - ownerEmail: Email of the owner.
+
+    Returns:
+    - A reference to the owner's user document.
+    """
+    key = mdp.ownerCacheKey(db, ownerEmail)
+    found, path, generation = mdp.readCache.lookup(key)
+    if not found:
+        snapshot = await mdp.userRef(db, ownerEmail).get()
+        if snapshot.exists:
+            path = snapshot.reference.path
+            mdp.readCache.put(key, path, generation)
+        else:
+            # Users not migrated yet are never cached, see mdpFirestore.getOwner
+            legacy = await mdp.ownerQuery(db, ownerEmail).get()
+            if not legacy:
+                raise ValueError(f"Unknown owner: {ownerEmail}")
+            path = legacy[0].reference.path
+    return db.document(path)
+
+
+async def getAgenda(db, ownerEmail: str, platform: str | None = None) -> dict:
+    """
+    Retrieve the agenda (tasks) associated with a specific owner.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - ownerEmail: Email of the owner.
+    - platform: Platform to filter by (optional).
+
+    Returns:
+    - A dictionary containing the tasks.
+    """
+    owner = await getOwner(db, ownerEmail)
+    get_data = await mdp.agendaQuery(owner, platform).get()
+    return {"Tasks": await loadTasks(db, [mdp.taskData(d) for d in get_data])}
+
+
+async def loadTasks(dbClient, tasks: list) -> list:
+    """
+    Render tasks with the content of their current step, fetched with a single fetchVariables.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - tasks: List of task dictionaries.
+
+    Returns:
+    - The rendered tasks.
+    """
+    keys = [key for key in map(mdp.taskVariableKey, tasks) if key is not None]
+    return mdp.renderTasks(tasks, await fetchVariables(dbClient, keys) if keys else dict())
+
+
+async def lookupVariablesByVarGen(dbClient, variableGeneratorID) -> list:
+    """
+    Lookup variables based on a variable generator ID.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - variableGeneratorID: ID of the variable generator to search for.
+
+    Returns:
+    - A list of dictionaries representing the variables.
+    """
+    async def load():
+        return [d.to_dict() for d in await mdp.variablesByVarGenQuery(dbClient, variableGeneratorID).get()]
+
+    return await cachedRead(dbClient, ("variables", variableGeneratorID), load)
+
+
+async def getExperiments(dbClient, ownerEmail, experimentGeneratorID) -> list:
+    """
+    Retrieve experiments associated with a specific owner and experiment generators. The experiments
+    of every generator are queried concurrently, then every variable they use is read in one get_all.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - ownerEmail: Email of the experiment owner.
+    - experimentGeneratorID: ID(s) of the experiment generator(s).
+
+    Returns:
+    - A list of dictionaries containing the experiments, or None if there are none.
+    """
+    if type(experimentGeneratorID) is not list:
+        experimentGeneratorID = [experimentGeneratorID]
+
+    results = await asyncio.gather(*[mdp.experimentsQuery(dbClient, ownerEmail, expGenID).get() for expGenID in experimentGeneratorID])
+    experiments = [(expGenID, d.to_dict()) for expGenID, data in zip(experimentGeneratorID, results) for d in data]
+
+    variables = await fetchVariables(dbClient, [key for _, expInfo in experiments for key in mdp.experimentVariableKeys(expInfo)])
+    experiments = [mdp.experimentContent(expInfo, expGenID, [variables[key] for key in mdp.experimentVariableKeys(expInfo)])
+                   for expGenID, expInfo in experiments]
+    return experiments or None
+
+
+async def lookupVariable(dbClient, varGenID: int, varID: int) -> dict | None:
+    """
+    Lookup a single variable, through the read cache.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - varGenID: ID of the variable generator.
+    - varID: ID of the variable.
+
+    Returns:
+    - A dictionary representing the variable, or None if it does not exist.
+    """
+    return (await fetchVariables(dbClient, [(varGenID, varID)]))[(int(varGenID), int(varID))]
+
+
+async def fetchVariables(dbClient, keys: list, memo: dict | None = None) -> dict:
+    """
+    Fetch many variables by their composite document ID with a single get_all, skipping those
+    already in the request memo or in the read cache.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - keys: List of (variableGeneratorID, variableID) tuples.
+    - memo: Dictionary kept for the duration of a request, filled with every variable fetched (optional).
+
+    Returns:
+    - A dictionary mapping each (variableGeneratorID, variableID) to the variable, or None if it does not exist.
+    """
+    memo = memo if memo is not None else dict()
+    keys = list(dict.fromkeys((int(varGenID), int(varID)) for varGenID, varID in keys))
+    pending = mdp.cachedVariables(dbClient, [key for key in keys if key not in memo], memo)
+
+    if pending:
+        snapshots = await getDocuments(dbClient, [mdp.variableRef(dbClient, *key) for key in pending])
+        missing = []
+        for key in pending:
+            snapshot = snapshots[mdp.variableRef(dbClient, *key).path]
+            if snapshot.exists:
+                memo[key] = snapshot.to_dict()
+            else:
+                missing.append(key)
+
+        # Variables created before composite IDs, until migrateVariableIDs has run
+        found = await asyncio.gather(*[mdp.variableQuery(dbClient, *key).get() for key in missing])
+        for key, var in zip(missing, found):
+            memo[key] = var[0].to_dict() if var else None
+        mdp.storeVariables(dbClient, pending, memo)
+
+    return {key: memo[key] for key in keys}
+
+
+async def getActiveAssignments(dbClient, expGenID: int, expID: int = 0) -> dict:
+    """
+    Retrieve the experiment assignments of an experiment or experiment generator with a single
+    collection group query.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - expGenID: ID of the experiment generator.
+    - expID: ID of the experiment (optional).
+
+    Returns:
+    - A dictionary mapping each customer reference to its first matching assignment snapshot.
+    """
+    assignments = dict()
+    async for assignment in mdp.assignmentsQuery(dbClient, expGenID, expID).stream():
+        customer_ref = mdp.assignmentCustomer(assignment)
+        if customer_ref is not None and customer_ref not in assignments:
+            assignments[customer_ref] = assignment
+    return assignments
+
+
+async def extractAllOutboundContacts(dbClient, experimentGeneratorIDs) -> list:
+    """
+    Extract outbound contacts for multiple experiment generators, reading every generator concurrently.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - experimentGeneratorIDs: List of experiment generator IDs.
+
+    Returns:
+    - A list of dictionaries containing the outbound contacts.
+    """
+    if type(experimentGeneratorIDs) is not list:
+        experimentGeneratorIDs = list(experimentGeneratorIDs)
+
+    async def extract(expGenID):
+        assignments = await getActiveAssignments(dbClient, expGenID)
+        customers = await getDocuments(dbClient, list(assignments.keys()))
+        contacts = []
+        for customer_ref, assignment in assignments.items():
+            customer = customers.get(customer_ref.path)
+            if customer is None or not customer.exists:
+                continue
+            outbound = customer.to_dict()
+            outbound.update(assignment.to_dict())
+            contacts.append(outbound)
+        return contacts
+
+    results = await asyncio.gather(*[extract(expGenID) for expGenID in experimentGeneratorIDs])
+    contacts = [contact for contacts in results for contact in contacts]
+    keys = [key for contact in contacts for key in mdp.resultVariables(contact)]
+    return mdp.renderAssignments(contacts, await fetchVariables(dbClient, keys) if keys else dict())
+
+
+async def collectionQuery(db, collection: str, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None):
+    """
+    Build a paginated query over a collection, reading the cursor document first when ordering by a field.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - collection: Name of the collection.
+    - limit: Maximum number of documents to return (optional).
+    - startAfter: ID of the last document of the previous page (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order (optional).
+
+    Returns:
+    - A Firestore query.
+    """
+    cursor = None
+    if startAfter is not None and orderBy:
+        cursor = await db.collection(collection).document(startAfter).get()
+    return mdp.collectionQuery(db, collection, limit, startAfter, orderBy, cursor)
+
+
+async def getCollection(db, collection: str, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None) -> dict:
+    """
+    Retrieve a collection, or one page of it, from Firestore.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - collection: Name of the collection to retrieve.
+    - limit: Maximum number of documents to return (optional).
+    - startAfter: ID of the last document of the previous page (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order (optional).
+
+    Returns:
+    - A dictionary containing the collection's documents and the cursor of the next page.
+    """
+    get_data = await (await collectionQuery(db, collection, limit, startAfter, orderBy)).get()
+    data = {collection: [d.to_dict() for d in get_data]}
+    data["cursor"] = get_data[-1].id if limit is not None and len(get_data) == limit else None
+    return data
+
+
+async def streamCollection(db, collection: str, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None):
+    """
+    Stream the documents of a collection one at a time.
+
+    Parameters:
+    - db: Async Firestore database client.
+    - collection: Name of the collection to stream.
+    - limit: Maximum number of documents to stream (optional).
+    - startAfter: ID of the document to resume after (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order (optional).
+
+    Returns:
+    - An async generator of document dictionaries.
+    """
+    async for d in (await collectionQuery(db, collection, limit, startAfter, orderBy)).stream():
+        yield d.to_dict()
+
+
+async def getEvents(db) -> dict:
+    """
+    Retrieve all events.
+
+    Parameters:
+    - db: Async Firestore database client.
+
+    Returns:
+    - A dictionary containing the events.
+    """
+    return {"events": [d.to_dict() async for d in db.collection("events").stream()]}
+
+
+async def getResults(dbClient, expGenIDs: list) -> dict:
+    """
+    Read the trials and successes of every experiment of some experiment generators, and of
+    the variables they use, from the results counters.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - expGenIDs: IDs of the experiment generators.
+
+    Returns:
+    - A dictionary with the experiment and variable counters.
+    """
+    async def shards(kind, generatorIDs):
+        pages = await asyncio.gather(*[q.get() for q in mdp.resultShardsQueries(dbClient, kind, generatorIDs)])
+        return [s.to_dict() for page in pages for s in page]
+
+    experiments = mdp.sumResultShards(await shards("experiment", expGenIDs), "experiment")
+    varGenIDs = {varGenID for e in experiments for varGenID, _ in mdp.resultVariables(e)}
+    return {"experiments": experiments, "variables": mdp.sumResultShards(await shards("variable", varGenIDs), "variable")}
+
+
+async def completeTask(dbClient, batch, ownerEmail: str, platform: str | None = None, phoneNumber: str | None = None, email: str | None = None, sequence_idx: str | None = None,
+                       taskID: str | None = None, holder: str | None = None, callStatus: str | None = None) -> dict:
+    """
+    Mark a task as complete for a specific owner, by taskID when given, otherwise by querying the agenda.
+    Tasks with steps left move on to the next one, see mdpFirestore.finishStep.
+
+    Parameters:
+    - dbClient: Async Firestore database client.
+    - batch: Async Firestore batch to add the task completion to.
+    - ownerEmail: Email of the owner.
+    - platform: Platform associated with the task (optional).
+    - phoneNumber: Phone number associated with the task (optional).
+    - email: Email associated with the task (optional).
+    - sequence_idx: Sequence index of the task; with a taskID, the step being completed (optional).
+    - taskID: Document ID of the task, as returned by getAgenda (optional).
+    - holder: ID of the calling session the task must be leased to, see mdpFirestore.checkLease (optional).
+    - callStatus: Outcome of the step; a success marks the task converted for its later steps (optional).
+
+    Returns:
+    - A dictionary representing the completed task as it was read, to pass on to submitEvent.
+    """
+    owner = await getOwner(dbClient, ownerEmail)
+    if taskID is not None:
+        task = await owner.collection("Agenda").document(taskID).get()
+        if not task.exists:
+            raise ValueError(f"Unknown task: {taskID}")
+    else:
+        task = (await mdp.taskQuery(owner, platform, phoneNumber, email, sequence_idx).get())[0]
+    data = mdp.taskData(task)
+    mdp.checkStep(data, sequence_idx)
+    mdp.checkLease(data, holder)
+    mdp.finishStep(dbClient, batch, task, converted=callStatus in mdp.SUCCESS_STATUSES)
+    return data
@@ -0,0 +1,1158 @@
+import threading
+import string
+import random
+import datetime
+from google.api_core import exceptions
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud import firestore
+from google.cloud.firestore_v1 import base_aggregation, transforms
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+
+AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+
+def autoID() -> str:
+    """
+    Generate a 20 character document ID in the same alphabet Firestore uses.
+
+    Returns:
+    - A random document ID.
+    """
+    return "".join(random.choices(AUTO_ID_CHARS, k=20))
+
+
+def copyData(value):
+    """
+    Copy document data so callers cannot mutate what is stored. Faster than deepcopy
+    because scalar Firestore values are immutable.
+
+    Parameters:
+    - value: Document data or a field value.
+
+    Returns:
+    - An independent copy of the value.
+    """
+    if isinstance(value, dict):
+        return {k: copyData(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copyData(v) for v in value]
+    return value
+
+
+def getField(data: dict, fieldPath: str):
+    """
+    Resolve a (possibly dotted) field path inside a document.
+
+    Parameters:
+    - data: Document data.
+    - fieldPath: Field path, e.g. "experiments.Phone".
+
+    Returns:
+    - A tuple (found, value).
+    """
+    value = data
+    for part in fieldPath.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def setField(data: dict, fieldPath: str, value) -> None:
+    """
+    Set a (possibly dotted) field path inside a document, creating maps as needed.
+
+    Parameters:
+    - data: Document data to modify in place.
+    - fieldPath: Field path to set.
+    - value: Value to store.
+    """
+    parts = fieldPath.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    data[parts[-1]] = value
+
+
+def deleteField(data: dict, fieldPath: str) -> None:
+    """
+    Remove a (possibly dotted) field path from a document if it exists.
+
+    Parameters:
+    - data: Document data to modify in place.
+    - fieldPath: Field path to remove.
+    """
+    parts = fieldPath.split(".")
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+
+def applyValue(data: dict, fieldPath: str, value) -> None:
+    """
+    Write a value into a document, resolving Firestore transform sentinels.
+
+    Parameters:
+    - data: Document data to modify in place.
+    - fieldPath: Field path to write.
+    - value: Plain value or a Firestore sentinel / transform.
+    """
+    if value is firestore.SERVER_TIMESTAMP:
+        setField(data, fieldPath, datetime.datetime.now(datetime.timezone.utc))
+    elif value is firestore.DELETE_FIELD:
+        deleteField(data, fieldPath)
+    elif isinstance(value, transforms.Increment):
+        found, current = getField(data, fieldPath)
+        current = current if found and isinstance(current, (int, float)) else 0
+        setField(data, fieldPath, current + value.value)
+    elif isinstance(value, transforms.ArrayUnion):
+        found, current = getField(data, fieldPath)
+        current = list(current) if found and isinstance(current, list) else []
+        current.extend([v for v in value.values if v not in current])
+        setField(data, fieldPath, current)
+    elif isinstance(value, transforms.ArrayRemove):
+        found, current = getField(data, fieldPath)
+        current = list(current) if found and isinstance(current, list) else []
+        setField(data, fieldPath, [v for v in current if v not in value.values])
+    elif isinstance(value, dict):
+        found, current = getField(data, fieldPath)
+        if not (found and isinstance(current, dict)):
+            setField(data, fieldPath, {})
+        for key, v in value.items():
+            applyValue(data, f"{fieldPath}.{key}", v)
+    else:
+        setField(data, fieldPath, copyData(value))
+
+
+def compareValues(left, op: str, right) -> bool:
+    """
+    Evaluate a single Firestore filter operator.
+
+    Parameters:
+    - left: Value stored in the document.
+    - op: Firestore operator string.
+    - right: Value from the filter.
+
+    Returns:
+    - True if the document value satisfies the filter.
+    """
+    try:
+        if op == "==":
+            return left == right
+        if op == "!=":
+            return left != right and left is not None
+        if op == "<":
+            return left < right
+        if op == "<=":
+            return left <= right
+        if op == ">":
+            return left > right
+        if op == ">=":
+            return left >= right
+        if op == "in":
+            return left in right
+        if op == "not-in":
+            return left not in right and left is not None
+        if op == "array-contains":
+            return isinstance(left, list) and right in left
+        if op == "array-contains-any":
+            return isinstance(left, list) and any(r in left for r in right)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def orderKey(value):
+    """
+    Build a sort key that orders mixed value types the way Firestore does.
+
+    Parameters:
+    - value: Field value.
+
+    Returns:
+    - A tuple usable as a sort key.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime.datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, DocumentReference):
+        return (6, value.path)
+    if isinstance(value, list):
+        return (8, [orderKey(v) for v in value])
+    if isinstance(value, dict):
+        return (9, sorted((k, orderKey(v)) for k, v in value.items()))
+    return (7, str(value))
+
+
+def matchesFilter(data: dict, filter) -> bool:
+    """
+    Check whether a document matches a FieldFilter or a composite And/Or filter.
+
+    Parameters:
+    - data: Document data.
+    - filter: A firestore.FieldFilter, firestore.And or firestore.Or.
+
+    Returns:
+    - True if the document matches.
+    """
+    if isinstance(filter, firestore.And):
+        return all(matchesFilter(data, f) for f in filter.filters)
+    if isinstance(filter, firestore.Or):
+        return any(matchesFilter(data, f) for f in filter.filters)
+    found, value = getField(data, filter.field_path)
+    if not found:
+        return False
+    return compareValues(value, filter.op_string, filter.value)
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        """
+        Minimal stand-in for firestore WriteResult.
+
+        Parameters:
+        - update_time: Time of the write.
+        """
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data: dict | None, update_time=None):
+        """
+        Immutable view of a document at read time.
+
+        Parameters:
+        - reference: DocumentReference the snapshot was read from.
+        - data: Document data, or None if the document does not exist.
+        - update_time: Time of the last write to the document, None if it does not exist.
+        """
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time if self.exists else None
+        self._data = data
+
+    def to_dict(self) -> dict | None:
+        """
+        Return a copy of the document data.
+
+        Returns:
+        - The document data, or None if the document does not exist.
+        """
+        return copyData(self._data) if self.exists else None
+
+    def get(self, fieldPath: str):
+        """
+        Return a single field of the document.
+
+        Parameters:
+        - fieldPath: Field path to read.
+
+        Returns:
+        - The field value, or None if missing.
+        """
+        found, value = getField(self._data or {}, fieldPath)
+        return copyData(value) if found else None
+
+
+class DocumentReference:
+    def __init__(self, client, path: str):
+        """
+        Reference to a document at a slash separated path.
+
+        Parameters:
+        - client: The owning in-memory Client.
+        - path: Document path, e.g. "customers/abc/experiments/xyz".
+        """
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, collectionID: str):
+        """
+        Return a subcollection of this document.
+
+        Parameters:
+        - collectionID: Name of the subcollection.
+
+        Returns:
+        - A CollectionReference.
+        """
+        return CollectionReference(self._client, f"{self.path}/{collectionID}")
+
+    def get(self, field_paths=None, transaction=None) -> DocumentSnapshot:
+        """
+        Read the document.
+
+        Returns:
+        - A DocumentSnapshot (exists is False if the document is missing).
+        """
+        return self._client._getDocuments([self], transaction)[0]
+
+    def set(self, document_data: dict, merge: bool = False) -> WriteResult:
+        return self._client._commit([("set", self, document_data, merge)])
+
+    def create(self, document_data: dict) -> WriteResult:
+        return self._client._commit([("create", self, document_data, False)])
+
+    def update(self, field_updates: dict, option=None) -> WriteResult:
+        return self._client._commit([("update", self, field_updates, option)])
+
+    def delete(self, option=None) -> WriteResult:
+        return self._client._commit([("delete", self, option, False)])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __copy__(self):
+        return DocumentReference(self._client, self.path)
+
+    def __deepcopy__(self, memo):
+        return DocumentReference(self._client, self.path)
+
+    def __repr__(self):
+        return f"DocumentReference({self.path})"
+
+
+class Query:
+    ASCENDING = firestore.Query.ASCENDING
+    DESCENDING = firestore.Query.DESCENDING
+
+    def __init__(self, client, parentPath: str, allDescendants: bool = False):
+        """
+        Immutable query over a single collection, or over every collection with
+        the same ID when allDescendants is set (a collection group query).
+
+        Parameters:
+        - client: The owning in-memory Client.
+        - parentPath: Path of the collection being queried, or the collection ID for a group.
+        - allDescendants: Query every collection whose ID equals parentPath.
+        """
+        self._client = client
+        self._parentPath = parentPath
+        self._allDescendants = allDescendants
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._projection = None
+        self._start = None
+
+    def _copy(self, **kwargs):
+        query = Query.__new__(Query)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(kwargs)
+        return query
+
+    def where(self, field_path: str | None = None, op_string: str | None = None, value=None, *, filter=None):
+        """
+        Add a filter to the query.
+
+        Parameters:
+        - field_path, op_string, value: Positional form of a field filter.
+        - filter: A firestore.FieldFilter, firestore.And or firestore.Or.
+
+        Returns:
+        - A new Query.
+        """
+        if filter is None:
+            filter = firestore.FieldFilter(field_path, op_string, value)
+        return self._copy(_filters=self._filters + [filter])
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return self._copy(_orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count: int):
+        return self._copy(_limit=count)
+
+    def count(self, alias: str | None = None):
+        return AggregationQuery(self, alias or "count")
+
+    def start_at(self, document_fields):
+        return self._copy(_start=(document_fields, True))
+
+    def start_after(self, document_fields):
+        """
+        Start the query after a cursor, given as a DocumentSnapshot or a dictionary of values
+        of the ordered fields ("__name__" may be a document ID).
+
+        Returns:
+        - A new Query.
+        """
+        return self._copy(_start=(document_fields, False))
+
+    def select(self, field_paths: list):
+        return self._copy(_projection=list(field_paths))
+
+    def _project(self, data: dict) -> dict:
+        if self._projection is None:
+            return data
+        projected = dict()
+        for fieldPath in self._projection:
+            found, value = getField(data, fieldPath)
+            if found:
+                setField(projected, fieldPath, value)
+        return projected
+
+    def _normalizedOrders(self) -> list:
+        # Firestore always breaks ties by document name, in the direction of the last ordering
+        orders = list(self._orders)
+        if "__name__" not in [fieldPath for fieldPath, _ in orders]:
+            orders.append(("__name__", orders[-1][1] if orders else Query.ASCENDING))
+        return orders
+
+    def _orderValue(self, snapshot, fieldPath: str):
+        if fieldPath == "__name__":
+            return True, snapshot.reference
+        return getField(snapshot._data, fieldPath)
+
+    def _sort(self, snapshots: list) -> list:
+        orders = self._normalizedOrders()
+        for fieldPath, _ in orders:
+            snapshots = [s for s in snapshots if self._orderValue(s, fieldPath)[0]]
+        # Stable sorts applied from the last ordering to the first
+        for fieldPath, direction in reversed(orders):
+            snapshots.sort(key=lambda s: orderKey(self._orderValue(s, fieldPath)[1]), reverse=direction == Query.DESCENDING)
+        return snapshots
+
+    def _cursorValues(self) -> list:
+        documentFields, _ = self._start
+        orders = self._normalizedOrders()
+        if isinstance(documentFields, DocumentSnapshot):
+            return [self._orderValue(documentFields, fieldPath)[1] for fieldPath, _ in orders]
+        if isinstance(documentFields, dict):
+            values = [documentFields[fieldPath] if fieldPath in documentFields else getField(documentFields, fieldPath)[1]
+                      for fieldPath, _ in orders[:len(documentFields)]]
+        else:
+            values = list(documentFields)
+        for i, (fieldPath, _) in enumerate(orders[:len(values)]):
+            if fieldPath == "__name__" and isinstance(values[i], str):
+                values[i] = DocumentReference(self._client, f"{self._parentPath}/{values[i]}")
+        return values
+
+    def _afterCursor(self, snapshots: list) -> list:
+        values = self._cursorValues()
+        _, before = self._start
+        orders = self._normalizedOrders()[:len(values)]
+
+        def isAfter(snapshot) -> bool:
+            for (fieldPath, direction), value in zip(orders, values):
+                left, right = orderKey(self._orderValue(snapshot, fieldPath)[1]), orderKey(value)
+                if left != right:
+                    return left > right if direction == Query.ASCENDING else left < right
+            return before
+
+        return [s for s in snapshots if isAfter(s)]
+
+    def _matches(self, data: dict) -> bool:
+        return all(matchesFilter(data, f) for f in self._filters)
+
+    def stream(self, transaction=None):
+        """
+        Run the query and yield matching document snapshots ordered by ID.
+
+        Returns:
+        - A generator of DocumentSnapshot.
+        """
+        return iter(self._client._runQuery(self, transaction))
+
+    def get(self, transaction=None) -> list:
+        """
+        Run the query.
+
+        Returns:
+        - A list of DocumentSnapshot.
+        """
+        return self._client._runQuery(self, transaction)
+
+    def on_snapshot(self, callback):
+        """
+        Listen to the query. The callback is called with (snapshots, changes, read_time) right away
+        with every matching document ADDED, then after every commit that changes a match.
+
+        Parameters:
+        - callback: Function called with the matching snapshots, the DocumentChanges and the read time.
+
+        Returns:
+        - A Watch; call unsubscribe() to stop listening.
+        """
+        return Watch(self._client, self, callback)
+
+
+class Watch:
+    def __init__(self, client, query: Query, callback):
+        """
+        Listener registered by Query.on_snapshot. Callbacks run synchronously after the commit that
+        triggered them, and every changed document is billed as one read, as in Firestore.
+
+        Parameters:
+        - client: The owning in-memory Client.
+        - query: Query being listened to.
+        - callback: Function called with (snapshots, changes, read_time).
+        """
+        self._client = client
+        self._query = query
+        self._callback = callback
+        self.is_active = True
+        with client._lock:
+            snapshots = client._matchingSnapshots(query)
+            client.stats["reads"] += max(len(snapshots), 1)
+            client._listeners.append(self)
+        changes = [DocumentChange(ChangeType.ADDED, snapshot, -1, i) for i, snapshot in enumerate(snapshots)]
+        callback(snapshots, changes, datetime.datetime.now(datetime.timezone.utc))
+
+    def _listensTo(self, collectionPath: str) -> bool:
+        if self._query._allDescendants:
+            return collectionPath.rsplit("/", 1)[-1] == self._query._parentPath
+        return collectionPath == self._query._parentPath
+
+    def _notify(self, changed: dict, readTime) -> None:
+        changes = []
+        for path, (old, new) in changed.items():
+            if old == new or not self._listensTo(path.rsplit("/", 1)[0]):
+                continue
+            wasMatch = old is not None and self._query._matches(old)
+            isMatch = new is not None and self._query._matches(new)
+            ref = DocumentReference(self._client, path)
+            if isMatch:
+                changeType = ChangeType.MODIFIED if wasMatch else ChangeType.ADDED
+                changes.append(DocumentChange(changeType, DocumentSnapshot(ref, new, readTime), -1, -1))
+            elif wasMatch:
+                changes.append(DocumentChange(ChangeType.REMOVED, DocumentSnapshot(ref, old), -1, -1))
+        if changes:
+            with self._client._lock:
+                snapshots = self._client._matchingSnapshots(self._query)
+                self._client.stats["reads"] += len(changes)
+            self._callback(snapshots, changes, readTime)
+
+    def unsubscribe(self) -> None:
+        with self._client._lock:
+            if self in self._client._listeners:
+                self._client._listeners.remove(self)
+        self.is_active = False
+
+
+class AggregationQuery:
+    def __init__(self, query: Query, alias: str):
+        """
+        Count aggregation over a query, billed like Firestore at one read per 1000 matches.
+
+        Parameters:
+        - query: Query to count.
+        - alias: Alias of the count result.
+        """
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None) -> list:
+        """
+        Run the aggregation.
+
+        Returns:
+        - A list holding one list with the count AggregationResult.
+        """
+        count = self._query._client._countQuery(self._query)
+        return [[base_aggregation.AggregationResult(alias=self._alias, value=count, read_time=None)]]
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path: str):
+        """
+        Reference to a collection at a slash separated path.
+
+        Parameters:
+        - client: The owning in-memory Client.
+        - path: Collection path, e.g. "customers" or "Users/abc/Agenda".
+        """
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        if "/" not in self._parentPath:
+            return None
+        return DocumentReference(self._client, self._parentPath.rsplit("/", 1)[0])
+
+    def document(self, document_id: str | None = None) -> DocumentReference:
+        """
+        Return a reference to a document in this collection.
+
+        Parameters:
+        - document_id: Document ID; a random one is generated if omitted.
+
+        Returns:
+        - A DocumentReference.
+        """
+        return DocumentReference(self._client, f"{self._parentPath}/{document_id or autoID()}")
+
+    def add(self, document_data: dict, document_id: str | None = None):
+        """
+        Create a new document in this collection.
+
+        Parameters:
+        - document_data: Document data.
+        - document_id: Optional document ID.
+
+        Returns:
+        - A tuple (update_time, DocumentReference).
+        """
+        docRef = self.document(document_id)
+        result = docRef.create(document_data)
+        return result.update_time, docRef
+
+
+class WriteBatch:
+    def __init__(self, client):
+        """
+        Collects writes and applies them atomically on commit.
+
+        Parameters:
+        - client: The owning in-memory Client.
+        """
+        self._client = client
+        self._writes = []
+
+    def set(self, reference: DocumentReference, document_data: dict, merge: bool = False):
+        self._writes.append(("set", reference, document_data, merge))
+
+    def create(self, reference: DocumentReference, document_data: dict):
+        self._writes.append(("create", reference, document_data, False))
+
+    def update(self, reference: DocumentReference, field_updates: dict, option=None):
+        self._writes.append(("update", reference, field_updates, option))
+
+    def delete(self, reference: DocumentReference, option=None):
+        self._writes.append(("delete", reference, option, False))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self) -> list:
+        """
+        Apply every queued write.
+
+        Returns:
+        - A list of WriteResult, one per write.
+        """
+        if not self._writes:
+            return []
+        result = self._client._commit(self._writes)
+        writes, self._writes = self._writes, []
+        return [result for _ in writes]
+
+
+class Transaction(WriteBatch):
+    def __init__(self, client, max_attempts: int = 5, read_only: bool = False):
+        """
+        Optimistic transaction compatible with firestore.transactional. Commit fails with
+        Aborted if any document read inside the transaction was written since it was read.
+
+        Parameters:
+        - client: The owning in-memory Client.
+        - max_attempts: Attempts made by firestore.transactional before giving up.
+        - read_only: Whether the transaction only reads.
+        """
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._readVersions = dict()
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references: list):
+        return self._client.get_all(references, transaction=self)
+
+    def _recordRead(self, path: str, version: int) -> None:
+        self._readVersions.setdefault(path, version)
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._readVersions = dict()
+        self._id = None
+
+    def _begin(self, retry_id=None) -> None:
+        self._id = autoID().encode()
+
+    def _rollback(self) -> None:
+        self._clean_up()
+
+    def _commit(self) -> list:
+        try:
+            if self._writes:
+                self._client._commit(self._writes, self._readVersions)
+            return []
+        finally:
+            self._clean_up()
+
+
+class Client:
+    def __init__(self, project: str | None = None, credentials=None, database: str | None = None):
+        """
+        In-memory implementation of the subset of firestore.Client used by mdpFirestore.
+        Documents live in a dict keyed by collection path, and every operation is counted
+        so benchmarks can report reads, writes and round trips without a live project.
+
+        Parameters:
+        - project: Project name; a unique one is generated so separate clients never share caches.
+        - credentials: Ignored, kept for signature compatibility.
+        - database: Database name (default: "(default)").
+        """
+        self.project = project or f"in-memory-{autoID()}"
+        self._database = database or "(default)"
+        self._collections = dict()
+        self._sortedIDs = dict()
+        self._versions = dict()
+        self._updateTimes = dict()
+        self._lastCommitTime = None
+        self._listeners = []
+        self._lock = threading.RLock()
+        self.resetStats()
+
+    def resetStats(self) -> None:
+        """
+        Reset the read, write and round trip counters.
+        """
+        self.stats = {"reads": 0, "writes": 0, "roundTrips": 0}
+
+    def getStats(self) -> dict:
+        """
+        Return a copy of the operation counters.
+
+        Returns:
+        - A dictionary with reads, writes and roundTrips.
+        """
+        return dict(self.stats)
+
+    def collection(self, collectionPath: str) -> CollectionReference:
+        return CollectionReference(self, collectionPath)
+
+    def document(self, documentPath: str) -> DocumentReference:
+        return DocumentReference(self, documentPath)
+
+    def collection_group(self, collectionID: str) -> Query:
+        return Query(self, collectionID, allDescendants=True)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return firestore.Client.write_option(**kwargs)
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> Transaction:
+        return Transaction(self, max_attempts, read_only)
+
+    def get_all(self, references: list, field_paths=None, transaction=None):
+        """
+        Read many documents in a single round trip.
+
+        Parameters:
+        - references: DocumentReferences to read.
+        - transaction: Transaction the reads belong to, so a later conflicting write aborts it (optional).
+
+        Returns:
+        - A generator of DocumentSnapshot, one per reference.
+        """
+        return iter(self._getDocuments(list(references), transaction=transaction))
+
+    def seed(self, collectionPath: str, documents: dict) -> None:
+        """
+        Load documents directly into a collection without counting any operations.
+
+        Parameters:
+        - collectionPath: Collection path to seed.
+        - documents: Mapping of document ID to document data.
+        """
+        with self._lock:
+            self._collections.setdefault(collectionPath, dict()).update(documents)
+            self._sortedIDs.pop(collectionPath, None)
+            seedTime = self._commitTime()
+            for docID in documents:
+                self._updateTimes[f"{collectionPath}/{docID}"] = seedTime
+
+    def _read(self, path: str):
+        collectionPath, docID = path.rsplit("/", 1)
+        return self._collections.get(collectionPath, {}).get(docID)
+
+    def _snapshot(self, ref, data: dict | None) -> DocumentSnapshot:
+        return DocumentSnapshot(ref, data, self._updateTimes.get(ref.path))
+
+    def _commitTime(self):
+        # Strictly increasing, so a last_update_time precondition never matches a later write
+        now = DatetimeWithNanoseconds.now(datetime.timezone.utc)
+        if self._lastCommitTime is not None and now <= self._lastCommitTime:
+            now = self._lastCommitTime + datetime.timedelta(microseconds=1)
+        self._lastCommitTime = now
+        return now
+
+    def _orderedIDs(self, collectionPath: str) -> list:
+        if collectionPath not in self._sortedIDs:
+            self._sortedIDs[collectionPath] = sorted(self._collections.get(collectionPath, {}))
+        return self._sortedIDs[collectionPath]
+
+    def _getDocuments(self, references: list, transaction=None) -> list:
+        with self._lock:
+            self.stats["roundTrips"] += 1
+            self.stats["reads"] += len(references)
+            if transaction is not None:
+                for ref in references:
+                    transaction._recordRead(ref.path, self._versions.get(ref.path, 0))
+            return [self._snapshot(ref, self._read(ref.path)) for ref in references]
+
+    def _matchingSnapshots(self, query: Query) -> list:
+        if query._allDescendants:
+            paths = sorted(p for p in self._collections if p.rsplit("/", 1)[-1] == query._parentPath)
+        else:
+            paths = [query._parentPath]
+        return [self._snapshot(DocumentReference(self, f"{path}/{docID}"), self._collections[path][docID])
+                for path in paths if path in self._collections
+                for docID in self._orderedIDs(path) if query._matches(self._collections[path][docID])]
+
+    def _countQuery(self, query: Query) -> int:
+        with self._lock:
+            stats = dict(self.stats)
+            # Like Firestore, a limited query counts at most its limit
+            count = len(self._runQuery(query))
+            self.stats = stats
+            self.stats["roundTrips"] += 1
+            self.stats["reads"] += max(1, -(-count // 1000))
+            return count
+
+    def _runQuery(self, query: Query, transaction=None) -> list:
+        with self._lock:
+            if query._allDescendants:
+                paths = sorted(p for p in self._collections if p.rsplit("/", 1)[-1] == query._parentPath)
+            else:
+                paths = [query._parentPath]
+            # Without an ordering results come back by document path and the limit can stop the scan
+            stopAt = query._limit if not query._orders and query._start is None else None
+            results = []
+            for path in paths:
+                docs = self._collections.get(path, {})
+                for docID in self._orderedIDs(path):
+                    data = docs[docID]
+                    if query._matches(data):
+                        ref = DocumentReference(self, f"{path}/{docID}")
+                        results.append(self._snapshot(ref, data))
+                        if stopAt is not None and len(results) >= stopAt:
+                            break
+                if stopAt is not None and len(results) >= stopAt:
+                    break
+            if query._orders or query._start is not None:
+                results = query._sort(results)
+            if query._start is not None:
+                results = query._afterCursor(results)
+            if query._limit is not None:
+                results = results[:query._limit]
+            if query._projection is not None:
+                results = [DocumentSnapshot(s.reference, query._project(s._data), s.update_time) for s in results]
+            if transaction is not None:
+                for snapshot in results:
+                    transaction._recordRead(snapshot.reference.path, self._versions.get(snapshot.reference.path, 0))
+            self.stats["roundTrips"] += 1
+            self.stats["reads"] += max(len(results), 1)
+            return results
+
+    def _commit(self, writes: list, readVersions: dict | None = None) -> WriteResult:
+        with self._lock:
+            for path, version in (readVersions or {}).items():
+                if self._versions.get(path, 0) != version:
+                    raise exceptions.Aborted(f"Document changed during transaction: {path}")
+
+            for op, ref, data, extra in writes:
+                exists = self._read(ref.path) is not None
+                if op == "create" and exists:
+                    raise exceptions.AlreadyExists(f"Document already exists: {ref.path}")
+                if op == "update" and not exists:
+                    raise exceptions.NotFound(f"No document to update: {ref.path}")
+                # Deletes carry their write option in place of data, updates in place of merge
+                option = data if op == "delete" else extra if op == "update" else None
+                if getattr(option, "_exists", None) is True and not exists:
+                    raise exceptions.NotFound(f"No document to {op}: {ref.path}")
+                lastUpdateTime = getattr(option, "_last_update_time", None)
+                if lastUpdateTime is not None and (not exists or self._updateTimes.get(ref.path) != lastUpdateTime):
+                    raise exceptions.FailedPrecondition(f"Document changed since {lastUpdateTime}: {ref.path}")
+
+            changed = dict()
+            commitTime = self._commitTime()
+            for op, ref, data, merge in writes:
+                changed.setdefault(ref.path, [self._read(ref.path), None])
+                self._versions[ref.path] = self._versions.get(ref.path, 0) + 1
+                self._updateTimes[ref.path] = commitTime
+                collectionPath, docID = ref.path.rsplit("/", 1)
+                docs = self._collections.setdefault(collectionPath, dict())
+                if op == "delete":
+                    if docs.pop(docID, None) is not None:
+                        self._sortedIDs.pop(collectionPath, None)
+                    continue
+                if docID not in docs:
+                    self._sortedIDs.pop(collectionPath, None)
+                # Stored dicts are replaced, never mutated, so snapshots stay immutable
+                current = copyData(docs.get(docID)) if (merge or op == "update") else None
+                current = dict() if current is None else current
+                for key, value in data.items():
+                    if op == "update" and isinstance(value, dict):
+                        deleteField(current, key)
+                    applyValue(current, key, value)
+                docs[docID] = current
+
+            self.stats["roundTrips"] += 1
+            self.stats["writes"] += len(writes)
+            result = WriteResult(commitTime)
+            for path in changed:
+                changed[path][1] = self._read(path)
+            listeners = list(self._listeners)
+
+        # Listeners run outside the lock, like Firestore's watch threads
+        for listener in listeners:
+            listener._notify(changed, result.update_time)
+        return result
+
+
+class AsyncDocumentReference:
+    def __init__(self, reference: DocumentReference):
+        """
+        Async view of a DocumentReference, matching firestore.AsyncDocumentReference.
+
+        Parameters:
+        - reference: The wrapped DocumentReference.
+        """
+        self._ref = reference
+        self.path = reference.path
+        self.id = reference.id
+
+    @property
+    def parent(self):
+        return AsyncCollectionReference(self._ref.parent)
+
+    def collection(self, collectionID: str):
+        return AsyncCollectionReference(self._ref.collection(collectionID))
+
+    async def get(self, field_paths=None, transaction=None) -> DocumentSnapshot:
+        return asyncSnapshot(self._ref.get())
+
+    async def set(self, document_data: dict, merge: bool = False) -> WriteResult:
+        return self._ref.set(document_data, merge)
+
+    async def create(self, document_data: dict) -> WriteResult:
+        return self._ref.create(document_data)
+
+    async def update(self, field_updates: dict, option=None) -> WriteResult:
+        return self._ref.update(field_updates, option)
+
+    async def delete(self, option=None) -> WriteResult:
+        return self._ref.delete(option)
+
+    def __eq__(self, other):
+        return isinstance(other, AsyncDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"AsyncDocumentReference({self.path})"
+
+
+def asyncSnapshot(snapshot: DocumentSnapshot) -> DocumentSnapshot:
+    """
+    Re-point a snapshot at an AsyncDocumentReference, as the async client returns them.
+
+    Parameters:
+    - snapshot: Snapshot read through the wrapped Client.
+
+    Returns:
+    - A DocumentSnapshot whose reference is async.
+    """
+    return DocumentSnapshot(AsyncDocumentReference(snapshot.reference), snapshot._data, snapshot.update_time)
+
+
+def syncValue(value):
+    """
+    Unwrap async references and snapshots passed back into query cursors.
+
+    Parameters:
+    - value: Cursor value, snapshot or dictionary of values.
+
+    Returns:
+    - The same value built on sync references.
+    """
+    if isinstance(value, AsyncDocumentReference):
+        return value._ref
+    if isinstance(value, DocumentSnapshot) and isinstance(value.reference, AsyncDocumentReference):
+        return DocumentSnapshot(value.reference._ref, value._data, value.update_time)
+    if isinstance(value, dict):
+        return {k: syncValue(v) for k, v in value.items()}
+    return value
+
+
+class AsyncQuery:
+    def __init__(self, query: Query):
+        """
+        Async view of a Query, matching firestore.AsyncQuery: get() is a coroutine and
+        stream() an async generator.
+
+        Parameters:
+        - query: The wrapped Query.
+        """
+        self._query = query
+
+    def where(self, field_path: str | None = None, op_string: str | None = None, value=None, *, filter=None):
+        return AsyncQuery(self._query.where(field_path, op_string, value, filter=filter))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return AsyncQuery(self._query.order_by(field_path, direction))
+
+    def limit(self, count: int):
+        return AsyncQuery(self._query.limit(count))
+
+    def select(self, field_paths: list):
+        return AsyncQuery(self._query.select(field_paths))
+
+    def start_at(self, document_fields):
+        return AsyncQuery(self._query.start_at(syncValue(document_fields)))
+
+    def start_after(self, document_fields):
+        return AsyncQuery(self._query.start_after(syncValue(document_fields)))
+
+    def count(self, alias: str | None = None):
+        return AsyncAggregationQuery(self._query.count(alias))
+
+    async def get(self, transaction=None) -> list:
+        return [asyncSnapshot(s) for s in self._query.get()]
+
+    async def stream(self, transaction=None):
+        for snapshot in self._query.get():
+            yield asyncSnapshot(snapshot)
+
+
+class AsyncAggregationQuery:
+    def __init__(self, query: AggregationQuery):
+        self._query = query
+
+    async def get(self, transaction=None) -> list:
+        return self._query.get()
+
+
+class AsyncCollectionReference(AsyncQuery):
+    def __init__(self, collection: CollectionReference):
+        """
+        Async view of a CollectionReference.
+
+        Parameters:
+        - collection: The wrapped CollectionReference.
+        """
+        super().__init__(collection)
+        self.id = collection.id
+
+    @property
+    def parent(self):
+        parent = self._query.parent
+        return AsyncDocumentReference(parent) if parent is not None else None
+
+    def document(self, document_id: str | None = None) -> AsyncDocumentReference:
+        return AsyncDocumentReference(self._query.document(document_id))
+
+    async def add(self, document_data: dict, document_id: str | None = None):
+        updateTime, docRef = self._query.add(document_data, document_id)
+        return updateTime, AsyncDocumentReference(docRef)
+
+
+class AsyncWriteBatch:
+    def __init__(self, batch: WriteBatch):
+        """
+        Async view of a WriteBatch: writes are queued synchronously and commit() is a coroutine.
+
+        Parameters:
+        - batch: The wrapped WriteBatch.
+        """
+        self._batch = batch
+
+    def set(self, reference: AsyncDocumentReference, document_data: dict, merge: bool = False):
+        self._batch.set(reference._ref, document_data, merge)
+
+    def create(self, reference: AsyncDocumentReference, document_data: dict):
+        self._batch.create(reference._ref, document_data)
+
+    def update(self, reference: AsyncDocumentReference, field_updates: dict, option=None):
+        self._batch.update(reference._ref, field_updates, option)
+
+    def delete(self, reference: AsyncDocumentReference, option=None):
+        self._batch.delete(reference._ref, option)
+
+    def __len__(self):
+        return len(self._batch)
+
+    async def commit(self) -> list:
+        return self._batch.commit()
+
+
+class AsyncClient:
+    def __init__(self, client: Client | None = None, project: str | None = None, credentials=None, database: str | None = None):
+        """
+        In-memory implementation of the subset of firestore.AsyncClient used by mdpFirestoreAsync.
+        It shares its documents and counters with the wrapped Client, so sync and async code can
+        run against the same data.
+
+        Parameters:
+        - client: In-memory Client to wrap; a new one is created if omitted.
+        - project, credentials, database: Passed to the new Client when client is omitted.
+        """
+        self._client = client or Client(project, credentials, database)
+        self.project = self._client.project
+        self._database = self._client._database
+
+    def resetStats(self) -> None:
+        self._client.resetStats()
+
+    def getStats(self) -> dict:
+        return self._client.getStats()
+
+    def seed(self, collectionPath: str, documents: dict) -> None:
+        self._client.seed(collectionPath, documents)
+
+    def collection(self, collectionPath: str) -> AsyncCollectionReference:
+        return AsyncCollectionReference(self._client.collection(collectionPath))
+
+    def document(self, documentPath: str) -> AsyncDocumentReference:
+        return AsyncDocumentReference(self._client.document(documentPath))
+
+    def collection_group(self, collectionID: str) -> AsyncQuery:
+        return AsyncQuery(self._client.collection_group(collectionID))
+
+    @staticmethod
+    def write_option(**kwargs):
+        return firestore.Client.write_option(**kwargs)
+
+    def batch(self) -> AsyncWriteBatch:
+        return AsyncWriteBatch(self._client.batch())
+
+    async def get_all(self, references: list, field_paths=None, transaction=None):
+        for snapshot in self._client.get_all([ref._ref for ref in references]):
+            yield asyncSnapshot(snapshot)
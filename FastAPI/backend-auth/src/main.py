@@ -1,12 +1,17 @@
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from google.cloud import firestore
 from google.oauth2 import service_account
 import src.helpers.mdpFirestore as mdp
+import src.helpers.mdpFirestoreAsync as amdp
 import src.helpers.auth as auth
 import pandas as pd
 from urllib.error import HTTPError
 import json
+import os
 
 path1 = "secrets/bigQuery.json"
 with open(path1) as jsonFile:
@@ -18,9 +23,29 @@ with open(path2) as jsonFile:
 
 credentials = service_account.Credentials.from_service_account_info(gcp_cred)
 db = firestore.Client(project=projectSpecs["projectID"], credentials=credentials)
+# Reads run on the async client so they never block the event loop; the sync client serves
+# the write jobs, which run in the threadpool
+adb = firestore.AsyncClient(project=projectSpecs["projectID"], credentials=credentials)
+
+# Optional mode that keeps variableGenerators and experimentGenerators mirrored in memory through
+# on_snapshot listeners, so their readers skip Firestore entirely
+MIRROR_REFERENCE_DATA = os.environ.get("MIRROR_REFERENCE_DATA", "False").lower() == "true"
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+async def startMirrors():
+    if MIRROR_REFERENCE_DATA:
+        # Waits for the first snapshots so the mirrors are warm before the first request
+        await run_in_threadpool(mdp.startMirrors, db)
+
+
+@app.on_event("shutdown")
+async def stopMirrors():
+    mdp.stopMirrors()
+
+
 @app.get("/")
 async def root():
     return {"message": "Ciao bella."}
@@ -38,7 +63,7 @@ async def checkUser(email: str, password: str):
     Returns:
     - User details if the user exists; otherwise, an appropriate response indicating the user does not exist.
     """
-    check = auth.checkUser(db, email, password)
+    check = await run_in_threadpool(auth.checkUser, db, email, password)
     return check
 
 
@@ -54,7 +79,7 @@ async def createUser(email: str, password: str):
     Returns:
     - Details of the newly created user.
     """
-    newUser = auth.createUser(db, email, password)
+    newUser = await run_in_threadpool(auth.createUser, db, email, password)
     return newUser
 
 
@@ -72,7 +97,7 @@ async def getCustomers(inactiveOnly: str = "False", platform: str | None = None,
     Returns:
     - A list of customers that match the provided filters.
     """
-    cust = mdp.getCustomers(db, inactiveOnly=inactiveOnly, custRole=custRole, platform=platform, country=country)
+    cust = await amdp.getCustomers(adb, inactiveOnly=inactiveOnly, custRole=custRole, platform=platform, country=country)
     return cust
 
 
@@ -90,7 +115,7 @@ async def getVarGens(ownerEmail: str, platform: str | None = None, phase: str |
     - Data related to the variable generators that match the provided filters.
     """
     try:
-        data = mdp.getVariableGenerators(db, ownerEmail, platform, phase)
+        data = await amdp.getVariableGenerators(adb, ownerEmail, platform, phase)
         return data
     except Exception as e:
         return f"Import failed: {e}"
@@ -106,15 +131,64 @@ async def getAgenda(ownerEmail: str, platform: str | None = None):
     - platform: Optional filter by platform.
 
     Returns:
-    - Data related to the agenda items that match the provided filters.
+    - Data related to the agenda items that match the provided filters, each with the taskID that POST /agenda accepts.
     """
     try:
-        data = mdp.getAgenda(db, ownerEmail, platform)
+        data = await amdp.getAgenda(adb, ownerEmail, platform)
         return data
     except Exception as e:
         return f"Import failed: {e}"
 
 
+@app.post("/agenda/lease")
+async def leaseTasks(ownerEmail: str, holder: str, platform: str | None = None, count: int = mdp.AGENDA_LEASE_COUNT):
+    """
+    Lease the next agenda tasks to a caller, so callers sharing an owner never work the same task.
+
+    Parameters:
+    - ownerEmail: The email of the owner of the agenda items.
+    - holder: ID of the calling session; calling again renews its leases.
+    - platform: Optional filter by platform.
+    - count: Maximum number of tasks to lease.
+
+    Returns:
+    - The leased tasks with their taskID and lease expiry.
+    """
+    try:
+        tasks = await run_in_threadpool(mdp.leaseTasks, db, ownerEmail, holder, platform, count)
+        return {"Tasks": tasks}
+    except Exception as e:
+        return f"Lease failed: {e}"
+
+
+@app.post("/agenda/release")
+async def releaseTasks(ownerEmail: str, holder: str, taskIDs: list[str]):
+    """
+    Return leased agenda tasks to the queue before their lease expires.
+
+    Parameters:
+    - ownerEmail: The email of the owner of the agenda items.
+    - holder: ID of the calling session that leased the tasks.
+    - taskIDs: Document IDs of the tasks to release.
+
+    Returns:
+    - The number of tasks released.
+    """
+    released = await run_in_threadpool(mdp.releaseTasks, db, ownerEmail, holder, taskIDs)
+    return {"released": released}
+
+
+@app.post("/agenda/leases")
+async def backfillAgendaLeases():
+    """
+    Mark agenda tasks written before free tasks carried a leaseExpires as free, so they can be leased.
+
+    Returns:
+    - A message with the number of tasks updated.
+    """
+    return await run_in_threadpool(mdp.backfillAgendaLeases, db)
+
+
 @app.get("/variables")
 async def lookupVariablesByVarGen(variableGeneratorID: int):
     """
@@ -126,7 +200,7 @@ async def lookupVariablesByVarGen(variableGeneratorID: int):
     Returns:
     - A dictionary containing the variables associated with the variable generator.
     """
-    variables = mdp.lookupVariablesByVarGen(db, variableGeneratorID)
+    variables = await amdp.lookupVariablesByVarGen(adb, variableGeneratorID)
     return {"variables": variables}
 
 
@@ -145,9 +219,9 @@ async def getExpGenerators(ownerEmail: str, platform: str | None = None):
     print("At the first step in the endpoint:", ownerEmail, platform)
     if platform is not None:
         print("Platform is not None.")
-        expGens = mdp.getExperimentGenerators(db, ownerEmail, platform)
+        expGens = await amdp.getExperimentGenerators(adb, ownerEmail, platform)
     else:
-        expGens = mdp.getExperimentGenerators(db, ownerEmail)
+        expGens = await amdp.getExperimentGenerators(adb, ownerEmail)
     return expGens
 
 
@@ -165,7 +239,7 @@ async def getExperiments(ownerEmail: str, experimentGeneratorIDs: str):
     """
     print("At the first step in the endpoint:", experimentGeneratorIDs)
     expGenIDs = experimentGeneratorIDs.split("-")
-    experiments = mdp.getExperiments(db, ownerEmail, expGenIDs)
+    experiments = await amdp.getExperiments(adb, ownerEmail, expGenIDs)
     return experiments
 
 
@@ -182,10 +256,24 @@ async def getOutboundContacts(experimentGeneratorIDs: str):
     """
     expGenIDs = experimentGeneratorIDs.split("-")
     print("At the first step in the endpoint:", expGenIDs)
-    experiments = mdp.extractAllOutboundContacts(db, expGenIDs)
+    experiments = await amdp.extractAllOutboundContacts(adb, expGenIDs)
     return experiments
 
 
+@app.get("/results")
+async def getResults(experimentGeneratorIDs: str):
+    """
+    Retrieve the trials, successes and success rate of each experiment and variable.
+
+    Parameters:
+    - experimentGeneratorIDs: Experiment generator IDs separated by "-".
+
+    Returns:
+    - A dictionary with the experiment and variable counters.
+    """
+    return await amdp.getResults(adb, experimentGeneratorIDs.split("-"))
+
+
 @app.get("/events")
 async def getEvents():
     """
@@ -194,22 +282,43 @@ async def getEvents():
     Returns:
     - Data related to the events.
     """
-    data = mdp.getEvents(db)
+    data = await amdp.getEvents(adb)
     return data
 
 
+@app.get("/cache")
+async def getCacheStats():
+    """
+    Report the hit and miss counters of the reference data read cache, and which collections are mirrored.
+
+    Returns:
+    - A dictionary with hits, misses, evictions, entries, the hit rate and the live mirrors.
+    """
+    stats = mdp.readCache.stats()
+    stats["mirrors"] = {collection: mdp.getMirror(db, collection) is not None for collection in mdp.MIRRORED_COLLECTIONS}
+    return stats
+
+
 @app.get("/statistics")
-async def getRaw(collection: str):
+async def getRaw(collection: str, limit: int | None = None, startAfter: str | None = None, orderBy: str | None = None, stream: bool = False):
     """
     Retrieve raw data from a specified Firestore collection.
 
     Parameters:
     - collection: The name of the Firestore collection to retrieve data from.
+    - limit: Maximum number of documents to return (optional).
+    - startAfter: Cursor returned with the previous page (optional).
+    - orderBy: Field to order by, prefixed with "-" for descending order (optional).
+    - stream: Stream the documents as newline delimited JSON instead of one JSON body.
 
     Returns:
-    - Data from the specified Firestore collection.
+    - Data from the specified Firestore collection and the cursor of the next page, or an NDJSON stream.
     """
-    data = mdp.getCollection(db, collection)
+    if stream:
+        lines = (json.dumps(jsonable_encoder(d)) + "\n" async for d in amdp.streamCollection(adb, collection, limit, startAfter, orderBy))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    data = await amdp.getCollection(adb, collection, limit, startAfter, orderBy)
     return data
 
 
@@ -226,7 +335,7 @@ async def uploadVariables(rawData: dict | None = None):
     """
     if rawData:
         try:
-            mdp.variableImport(db, rawData["rawData"], rawData["Platform"], rawData["Product"], rawData["OwnerEmail"])
+            await run_in_threadpool(mdp.variableImport, db, rawData["rawData"], rawData["Platform"], rawData["Product"], rawData["OwnerEmail"])
         except Exception as e:
             return f"Import failed: {e}"
 
@@ -245,7 +354,7 @@ async def uploadCustomers(rawData: dict | None = None):
     if rawData:
         try:
             print(rawData["Platform"], rawData["Title"], rawData["Country"])
-            mdp.customerImport(db, rawData["rawData"], rawData["Platform"], rawData["Title"], rawData["Country"])
+            await run_in_threadpool(mdp.customerImport, db, rawData["rawData"], rawData["Platform"], rawData["Title"], rawData["Country"])
         except Exception as e:
             return f"Import failed: {e}"
 
@@ -256,7 +365,8 @@ async def setupExperiments(rawData: dict | None = None):
     Set up experiments based on provided data.
 
     Parameters:
-    - rawData: A dictionary containing the variable generator IDs, trials, number of experiments, platform, country, and owner email.
+    - rawData: A dictionary containing the variable generator IDs, trials, number of experiments, platform, country, and owner email,
+      and optionally a seed to make the setup reproducible.
 
     Returns:
     - Success or failure message based on the operation outcome.
@@ -268,7 +378,8 @@ async def setupExperiments(rawData: dict | None = None):
         if type(rawData["varGenIDs"][0]) != list:
             vGenIDs = [int(vGen) for vGen in rawData["varGenIDs"]]
             try:
-                resp = mdp.fullExperimentalSetup(db, vGenIDs, rawData["trials"], rawData["numExperiments"], rawData["platform"], rawData["country"], rawData["ownerEmail"])
+                resp = await run_in_threadpool(mdp.fullExperimentalSetup, db, vGenIDs, rawData["trials"], rawData["numExperiments"], rawData["platform"], rawData["country"], rawData["ownerEmail"],
+                                               rawData.get("seed"))
             except Exception as e:
                 raise e
         else:
@@ -276,18 +387,98 @@ async def setupExperiments(rawData: dict | None = None):
 
 
 @app.post("/replaceNaN")
-async def replaceNaN(collection: str):
+async def replaceNaN(collection: str, startAfter: str | None = None, maxDocuments: int | None = 50000):
     """
-    Replace NaN values in the specified Firestore collection.
+    Replace NaN values in the specified Firestore collection, a bounded slice at a time.
 
     Parameters:
     - collection: The name of the Firestore collection to replace NaN values in.
+    - startAfter: Cursor returned by a previous call, to resume from (optional).
+    - maxDocuments: Maximum number of documents to scan in this call (default: 50000).
+
+    Returns:
+    - The number of documents scanned and updated, and the cursor to pass as startAfter to continue,
+      which is None once the collection is done.
+    """
+    # Run in a worker thread so a long cleanup does not block other requests
+    return await run_in_threadpool(mdp.replaceNaN_collection, db, collection, startAfter, maxDocuments)
+
+
+@app.post("/customers/activity")
+async def backfillActivity():
+    """
+    Backfill the activePlatforms and lastAssignedAt fields of existing customers from their experiments.
+
+    Returns:
+    - A message with the number of customers updated.
+    """
+    return await run_in_threadpool(mdp.backfillCustomerActivity, db)
+
+
+@app.post("/customers/sampleKeys")
+async def backfillSampleKeys():
+    """
+    Backfill the random sampleKey that experiment setups draw customers by on existing customers.
+
+    Returns:
+    - A message with the number of customers updated.
+    """
+    return await run_in_threadpool(mdp.backfillCustomerSampleKeys, db)
+
+
+@app.post("/customers/ids")
+async def migrateCustomerIDs():
+    """
+    Move customers stored under random document IDs to the deterministic IDs used by imports.
+
+    Returns:
+    - A message with the number of customers moved.
+    """
+    return await run_in_threadpool(mdp.migrateCustomerIDs, db)
+
+
+@app.post("/users/ids")
+async def migrateUserIDs():
+    """
+    Move users stored under random document IDs to documents keyed by their normalized email.
+
+    Returns:
+    - A message with the number of users moved.
+    """
+    return await run_in_threadpool(mdp.migrateUserIDs, db)
+
+
+@app.post("/variables/ids")
+async def migrateVariableIDs():
+    """
+    Move variables stored under random document IDs to their "{variableGeneratorID}_{variableID}" IDs.
+
+    Returns:
+    - A message with the number of variables moved.
+    """
+    return await run_in_threadpool(mdp.migrateVariableIDs, db)
+
+
+@app.post("/experiments/ids")
+async def migrateExperimentIDs():
+    """
+    Move experiments stored under random document IDs to their combination keys, so setups reuse them.
+
+    Returns:
+    - A message with the number of experiments moved.
+    """
+    return await run_in_threadpool(mdp.migrateExperimentIDs, db)
+
+
+@app.post("/experimentgenerators/keys")
+async def backfillExpGenKeys():
+    """
+    Backfill canonical keys and lookup documents for existing experiment generators.
 
     Returns:
-    - "Done" upon successful completion of the operation.
+    - A message with the number of experiment generators updated.
     """
-    mdp.replaceNaN_db(db, [collection])
-    return "Done"
+    return await run_in_threadpool(mdp.backfillExpGenKeys, db)
 
 
 @app.post("/agenda")
@@ -296,7 +487,10 @@ async def completeTask(event: dict | None = None):
     Mark an agenda task as complete.
 
     Parameters:
-    - event: A dictionary containing event details, including ownerEmail, platform, phoneNumber, email, and sequence_idx.
+    - event: A dictionary containing event details, including ownerEmail and the taskID, sequence_idx and
+      leaseHolder returned by POST /agenda/lease. Tasks with steps left return to the agenda at their next
+      step; completing a step the task is no longer at, or a task leased to another caller, fails.
+      Events without a taskID find the task by platform, phoneNumber, email and sequence_idx instead.
 
     Returns:
     - Data related to the completed task, or an error message if the operation fails.
@@ -304,11 +498,12 @@ async def completeTask(event: dict | None = None):
     event = event.get("event")
     event = json.loads(event)
     try:
-        batch = db.batch()
-        data = mdp.completeTask(db, batch, event.get("ownerEmail"), event.get("platform"), event.get("phoneNumber"), event.get("email"), event.get("sequence_idx"))
+        batch = adb.batch()
+        data = await amdp.completeTask(adb, batch, event.get("ownerEmail"), event.get("platform"), event.get("phoneNumber"), event.get("email"), event.get("sequence_idx"),
+                                       taskID=event.get("taskID"), holder=event.get("leaseHolder"), callStatus=event.get("callStatus"))
         if event is not None:
-            eventSubmission = mdp.submitEvent(db, batch, event)
-        batch.commit()
+            eventSubmission = mdp.submitEvent(adb, batch, event, task=data)
+        await batch.commit()
         return data
     except Exception as e:
         return f"Import failed: {e}"
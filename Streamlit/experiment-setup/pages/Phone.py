@@ -3,6 +3,7 @@ import pandas as pd
 import requests
 import json
 import numpy as np
+import uuid
 from copy import deepcopy
 import pages.helpers.auth as auth
 
@@ -28,6 +29,12 @@ if 'phase' not in st.session_state:
 if 'agenda' not in st.session_state:
     st.session_state.agenda = pd.DataFrame()  # Store the call agenda as a DataFrame
 
+if 'callQueue' not in st.session_state:
+    st.session_state.callQueue = pd.DataFrame()  # Tasks leased to this session, called in order
+
+if 'leaseHolder' not in st.session_state:
+    st.session_state.leaseHolder = uuid.uuid4().hex  # Identify this session to the agenda work queue
+
 if 'task' not in st.session_state:
     st.session_state.task = pd.Series()  # Store the current task
 
@@ -199,20 +206,47 @@ def getCallAgenda():
     else:
         st.write("Upload more customers.")
 
-# Function to get the next task from the call agenda
+# Function to lease the next calls from the agenda work queue
+def leaseCallTasks():
+    """
+    Leases the next tasks of the call agenda to this session, so other reps sharing the
+    account never receive the same prospects while the lease lasts.
+    
+    Returns:
+        DataFrame containing the leased tasks.
+    """
+    url = f"{backend_url}/agenda/lease"
+    payload = {
+        "ownerEmail": st.session_state.username,
+        "holder": st.session_state.leaseHolder,
+        "platform": "Phone"
+    }
+    token = auth.get_auth_idtoken()  # Get the authentication token
+    headers = {"Authorization": f"Bearer {token}"}  # Authorization header
+    req = requests.post(url=url, params=payload, headers=headers)  # Claim the next tasks
+    
+    callQueue = req.json()["Tasks"]  # Extract the leased tasks from the response
+
+    if len(callQueue) > 0:
+        st.session_state.callQueue = pd.DataFrame(callQueue).fillna(np.nan).replace([np.nan], [None])
+        return st.session_state.callQueue  # Return the leased tasks
+    else:
+        st.write("Upload more customers.")
+
+# Function to get the next task from the call queue
 def getTask():
     """
-    Retrieves the next task from the call agenda.
+    Retrieves the next task from the call queue, leasing more tasks when it runs out.
     
     Returns:
         Series containing the next task.
     """
     retries = 2
-    while st.session_state.agenda.empty and retries > 0:
-        getCallAgenda()  # Try to fetch the agenda if it's empty
+    while st.session_state.callQueue.empty and retries > 0:
+        leaseCallTasks()  # Try to lease more tasks if the queue is empty
         retries -= 1
-    if not st.session_state.agenda.empty:
-        st.session_state.task = st.session_state.agenda.iloc[0, :].fillna(np.nan).replace([np.nan], [None])
+    if not st.session_state.callQueue.empty:
+        st.session_state.task = st.session_state.callQueue.iloc[0, :].fillna(np.nan).replace([np.nan], [None])
         return st.session_state.task  # Return the next task
     return None
 
@@ -224,7 +258,7 @@ def completeTask():
     Returns:
         Response object indicating the success or failure of the task completion.
     """
-    st.session_state.agenda = st.session_state.agenda.iloc[1:, :]  # Remove the completed task from the agenda
+    st.session_state.callQueue = st.session_state.callQueue.iloc[1:, :]  # Remove the completed task from the queue
     
     taskInfo = deepcopy(st.session_state.task.to_dict())  # Deep copy of the task info
 
@@ -305,9 +339,9 @@ else:
                                     vertical_alignment="top")
 
             if not st.session_state.callSession:
-                st.button("Start", use_container_width=True, on_click=getCallAgenda)  # Start the call session
-                if not st.session_state.agenda.empty:
-                    st.session_state.callSession = True  # Activate call session if agenda is available
+                st.button("Start", use_container_width=True, on_click=leaseCallTasks)  # Start the call session
+                if not st.session_state.callQueue.empty:
+                    st.session_state.callSession = True  # Activate call session if tasks were leased
 
             else:
                 try:
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import requests
+import json
 import pages.helpers.auth as auth
 import numpy as np
 
@@ -15,15 +16,18 @@ SERVICE_ACCOUNT_FILE = 'pages/helpers/secrets/key.json'
 
 st.set_page_config(page_title="Statistics", page_icon="📈")
 
-def viewRaw(collection:str):
+def viewRaw(collection:str, limit:int | None = None):
     token = auth.get_auth_idtoken()
     url = f"{backend_url}/statistics"
-    payload = {"collection": collection}
+    payload = {"collection": collection, "stream": True}
+    if limit:
+        payload["limit"] = limit
     headers = {"Authorization": f"Bearer {token}"}
     
-    req = requests.get(url=url, params=payload, headers=headers)
-    # st.write(req.text)
-    return pd.DataFrame(req.json()[collection])
+    # Rows arrive as newline delimited JSON, so neither side holds the whole response body
+    with requests.get(url=url, params=payload, headers=headers, stream=True) as req:
+        rows = [json.loads(line) for line in req.iter_lines() if line]
+    return pd.DataFrame(rows)
 
 # Display login or main content based on login status
 if not st.session_state.logged_in:
@@ -37,7 +41,9 @@ else:
         options=["events", "customers", "experiments"]
     )
     
+    limit = st.number_input("Maximum rows (0 for all):", min_value=0, value=0, step=1000)
+    
     if st.button("Get Statistics"):
-        st.write(viewRaw(collection).replace(np.nan,None))
+        st.write(viewRaw(collection, int(limit)).replace(np.nan,None))
     
 